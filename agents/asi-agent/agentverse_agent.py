@@ -63,6 +63,9 @@ class MeTTaReasoner:
             from metta_engine import MeTTaReasoner as CustomMeTTaReasoner
             self.metta_engine = CustomMeTTaReasoner()
             self.rules_loaded = True
+            # Apply edits to metta_knowledge_base.metta without restarting the agent
+            if os.getenv("METTA_HOT_RELOAD", "1") != "0":
+                self.metta_engine.watch()
             print("✅ Custom MeTTa reasoning engine loaded with symbolic AI")
         except ImportError as e:
             print(f"⚠️ Custom MeTTa engine not available: {e}")
@@ -0,0 +1,1053 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the ChimeraProtocol MeTTa engine
+Run: python benchmarks.py <benchmark> [options]
+"""
+
+import argparse
+import contextlib
+import gc
+import importlib.util
+import io
+import itertools
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import metta_engine
+from metta_engine import MeTTaKnowledgeBase, MeTTaParser
+
+def best_of(func: Callable[[], object], repeat: int = 5) -> float:
+    """Return the fastest wall-clock time of several runs, in seconds"""
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def load_engine(path: str = None):
+    """Import metta_engine, or another copy of it (e.g. a checkout of an older revision)"""
+
+    if not path:
+        return metta_engine
+
+    spec = importlib.util.spec_from_file_location("metta_engine_baseline", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def generate_markets(count: int, seed: int = 42) -> List[Dict]:
+    """Generate random market snapshots in the shape analyze_market expects"""
+
+    rng = random.Random(seed)
+    return [
+        {"optionARatio": round(rng.random(), 3), "totalVolume": rng.randrange(0, 20000)}
+        for _ in range(count)
+    ]
+
+def generate_knowledge_base(rules: int, depth: int, facts: int = 0) -> List[str]:
+    """Generate MeTTa source forms: nested if-chain rules plus flat facts"""
+
+    forms = []
+    for i in range(rules):
+        body = f"level-{depth}"
+        for level in range(depth - 1, -1, -1):
+            body = f"(if (> $x {level}.5) level-{level} {body})"
+        forms.append(f"(= (rule-{i} $x)\n   {body})")
+
+    for i in range(facts):
+        forms.append(f"(market-fact market-{i} crypto {i % 100}.25)")
+
+    return forms
+
+def bench_parse(args):
+    """Parse throughput: single-pass tokenizer vs legacy substring parser"""
+
+    print("🧪 Parse throughput (single-pass vs legacy)")
+
+    for depth in args.depths:
+        forms = generate_knowledge_base(args.rules, depth)
+        source = "\n\n".join(forms)
+        megabytes = len(source) / 1e6
+
+        legacy = MeTTaParser(mode="legacy")
+        single_pass = MeTTaParser()
+
+        # Legacy mode can only parse one form per call, so feed it form by form
+        legacy_time = best_of(lambda: [legacy.parse(form) for form in forms], args.repeat)
+        single_time = best_of(lambda: single_pass.parse_all(source), args.repeat)
+
+        print(f"\n📊 {args.rules} rules, nesting depth {depth} ({megabytes:.2f} MB)")
+        print(f"   legacy:      {legacy_time * 1000:9.2f} ms  ({megabytes / legacy_time:6.2f} MB/s)")
+        print(f"   single-pass: {single_time * 1000:9.2f} ms  ({megabytes / single_time:6.2f} MB/s)")
+        print(f"   speedup:     {legacy_time / single_time:9.2f}x")
+
+def bench_analyze(args):
+    """analyze_market latency, optionally against a baseline engine"""
+
+    markets = generate_markets(args.markets)
+    engines = [("current", load_engine())]
+    if args.baseline:
+        engines.append(("baseline", load_engine(args.baseline)))
+
+    print(f"🧪 analyze_market over {len(markets)} markets")
+
+    timings = {}
+    for label, engine in engines:
+        reasoner = engine.MeTTaReasoner()
+        elapsed = best_of(lambda: [reasoner.analyze_market(market) for market in markets], args.repeat)
+        timings[label] = elapsed
+        print(f"   {label:9s} {elapsed * 1e6 / len(markets):8.1f} µs/market  ({len(markets) / elapsed:9.0f} markets/s)")
+
+    if "baseline" in timings:
+        print(f"   speedup:  {timings['baseline'] / timings['current']:8.2f}x")
+
+def bench_match(args):
+    """Indexed knowledge-base lookups and unification vs a linear scan over all facts"""
+
+    print("🧪 Knowledge-base match (index vs linear scan)")
+
+    for size in args.sizes:
+        kb = MeTTaKnowledgeBase()
+        parser = kb.parser
+        for form in generate_knowledge_base(0, 0, facts=size):
+            kb.add_atom(parser.parse(form))
+        kb.add_fact("(correlated bitcoin ethereum 0.8)")
+
+        patterns = [parser.parse(text) for text in (
+            f"(market-fact market-{size // 2} $category $score)",
+            "(correlated bitcoin $other $weight)",
+        )]
+
+        def linear_scan():
+            for pattern in patterns:
+                [fact for fact in kb.facts if metta_engine._pattern_matches(pattern, fact, {})]
+
+        def indexed():
+            for pattern in patterns:
+                kb.match(pattern)
+
+        def unified():
+            for pattern in patterns:
+                list(kb.unify(pattern))
+
+        scan_time = best_of(linear_scan, args.repeat)
+        index_time = best_of(indexed, args.repeat)
+        unify_time = best_of(unified, args.repeat)
+
+        print(f"\n📊 {size:,} facts ({len(patterns)} lookups)")
+        print(f"   linear scan: {scan_time * 1e6:10.1f} µs")
+        print(f"   indexed:     {index_time * 1e6:10.1f} µs")
+        print(f"   unify:       {unify_time * 1e6:10.1f} µs  (all binding sets)")
+        print(f"   speedup:     {scan_time / index_time:10.1f}x")
+
+def bench_batch(args):
+    """Vectorized analyze_markets vs looping analyze_market"""
+
+    if not metta_engine.NUMPY_AVAILABLE:
+        print("⚠️ NumPy not available - analyze_markets falls back to a per-market loop")
+
+    reasoner = metta_engine.MeTTaReasoner()
+    print("🧪 Batch analysis (analyze_markets vs analyze_market loop)")
+
+    for count in args.sizes:
+        markets = generate_markets(count)
+        loop_time = best_of(lambda: [reasoner.analyze_market(market) for market in markets], args.repeat)
+        batch_time = best_of(lambda: reasoner.analyze_markets(markets), args.repeat)
+
+        print(f"\n📊 {count:,} markets")
+        print(f"   loop:    {loop_time * 1000:9.2f} ms")
+        print(f"   batch:   {batch_time * 1000:9.2f} ms")
+        print(f"   speedup: {loop_time / batch_time:9.2f}x")
+
+def bench_stress(args):
+    """Concurrent analyze_market calls on one shared reasoner must match serial results"""
+
+    engine = load_engine(args.baseline)
+    markets = generate_markets(args.markets, seed=7)
+    reasoner = engine.MeTTaReasoner()
+    expected = [reasoner.analyze_market(market) for market in markets]
+
+    # Switch threads as often as possible so shared-state races actually interleave
+    previous_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    stop = threading.Event()
+
+    def mutate_knowledge_base():
+        # Unrelated facts bump the knowledge-base version, forcing recompiles mid-flight
+        i = 0
+        while not stop.is_set():
+            reasoner.kb.add_fact(f"(stress-fact {i})")
+            i += 1
+            time.sleep(0.001)
+
+    mutator = threading.Thread(target=mutate_knowledge_base, daemon=True)
+    print(f"🧪 Stress: {len(markets):,} analyze_market calls on {args.threads} threads"
+          f"{' with concurrent knowledge-base updates' if args.mutate else ''}")
+
+    try:
+        if args.mutate:
+            mutator.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = list(pool.map(reasoner.analyze_market, markets))
+        elapsed = time.perf_counter() - start
+    finally:
+        stop.set()
+        sys.setswitchinterval(previous_interval)
+        if mutator.is_alive():
+            mutator.join()
+
+    # Evaluation counters depend on which results were already tabled, so they are not compared
+    def outcome(analysis):
+        return {key: value for key, value in analysis.items() if key != "evaluation"}
+
+    mismatches = [i for i, (got, want) in enumerate(zip(results, expected)) if outcome(got) != outcome(want)]
+    print(f"   {elapsed * 1000:9.2f} ms  ({len(markets) / elapsed:9.0f} markets/s)")
+
+    if mismatches:
+        first = mismatches[0]
+        print(f"❌ {len(mismatches)} results differ from serial evaluation")
+        print(f"   market:   {markets[first]}")
+        print(f"   serial:   {expected[first]}")
+        print(f"   threaded: {results[first]}")
+        sys.exit(1)
+
+    print("✅ All results match serial evaluation")
+
+def bench_startup(args):
+    """MeTTaReasoner construction: parsing the sources vs loading the binary snapshot"""
+
+    print("🧪 Reasoner startup (text parse vs snapshot)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for facts in args.facts:
+            path = os.path.join(directory, f"kb-{facts}.metta")
+            with open(path, "w") as f:
+                f.write("\n\n".join(generate_knowledge_base(args.rules, 5, facts=facts)))
+
+            parse_time = best_of(lambda: metta_engine.MeTTaReasoner(knowledge_base_file=path, use_snapshot=False),
+                                 args.repeat)
+            metta_engine.MeTTaReasoner(knowledge_base_file=path)  # writes the snapshot
+            snapshot_time = best_of(lambda: metta_engine.MeTTaReasoner(knowledge_base_file=path), args.repeat)
+            size = os.path.getsize(path + metta_engine.SNAPSHOT_SUFFIX)
+
+            print(f"\n📊 {args.rules} rules + {facts:,} facts (snapshot {size / 1e6:.2f} MB)")
+            print(f"   parse:    {parse_time * 1000:9.2f} ms")
+            print(f"   snapshot: {snapshot_time * 1000:9.2f} ms")
+            print(f"   speedup:  {parse_time / snapshot_time:9.2f}x")
+
+def bench_reload(args):
+    """reload() after a one-rule edit vs constructing a new reasoner"""
+
+    print("🧪 Knowledge-base reload (incremental reload vs restart)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for facts in args.facts:
+            path = os.path.join(directory, f"kb-{facts}.metta")
+            forms = generate_knowledge_base(args.rules, 5, facts=facts)
+            variants = ["\n\n".join(forms), "\n\n".join(forms).replace("(> $x 0.5)", "(> $x 0.25)", 1)]
+
+            with open(path, "w") as f:
+                f.write(variants[0])
+            reasoner = metta_engine.MeTTaReasoner(knowledge_base_file=path, use_snapshot=False)
+            edits = itertools.cycle(variants[1:] + variants[:1])
+
+            def edit_and_reload():
+                with open(path, "w") as f:
+                    f.write(next(edits))
+                reasoner.reload()
+
+            def edit_and_restart():
+                with open(path, "w") as f:
+                    f.write(next(edits))
+                metta_engine.MeTTaReasoner(knowledge_base_file=path, use_snapshot=False)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                reload_time = best_of(edit_and_reload, args.repeat)
+                restart_time = best_of(edit_and_restart, args.repeat)
+
+            print(f"\n📊 {args.rules} rules + {facts:,} facts, one rule edited")
+            print(f"   restart: {restart_time * 1000:9.2f} ms")
+            print(f"   reload:  {reload_time * 1000:9.2f} ms")
+            print(f"   speedup: {restart_time / reload_time:9.2f}x")
+
+def count_atoms(forms) -> int:
+    """Atom positions in a list of forms, counting shared subexpressions every time they occur"""
+
+    total = 0
+    pending = list(forms)
+    while pending:
+        form = pending.pop()
+        if hasattr(form, "atoms"):
+            pending.extend(form.atoms)
+        else:
+            total += 1
+    return total
+
+def bench_memory(args):
+    """Memory retained by a loaded knowledge base, optionally against a baseline engine"""
+
+    engines = [("current", load_engine())]
+    if args.baseline:
+        engines.append(("baseline", load_engine(args.baseline)))
+
+    # Each generated fact holds four atoms
+    forms = generate_knowledge_base(args.rules, 5, facts=max(0, args.atoms - args.rules * 20) // 4)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "memory.metta")
+        with open(path, "w") as f:
+            f.write("\n\n".join(forms))
+
+        print(f"🧪 Knowledge-base memory ({len(forms):,} forms)")
+
+        retained = {}
+        for label, engine in engines:
+            gc.collect()
+            tracemalloc.start()
+            kb = engine.MeTTaKnowledgeBase()
+            kb.load_from_file(path)
+            gc.collect()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            atoms = count_atoms(kb.rules + kb.facts)
+            retained[label] = current
+            print(f"   {label:9s} {current / 1e6:8.2f} MB retained  ({current / atoms:6.1f} B/atom over {atoms:,} atoms,"
+                  f" peak {peak / 1e6:.2f} MB)")
+            del kb
+
+        if "baseline" in retained:
+            print(f"   reduction: {retained['baseline'] / retained['current']:7.2f}x")
+
+def bench_stream(args):
+    """Streaming a large .metta file in chunks vs reading it whole"""
+
+    parser = MeTTaParser()
+    forms = generate_knowledge_base(args.rules, 5, facts=10000)
+    block = "\n\n".join(forms) + "\n\n"
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "large.metta")
+        with open(path, "w") as f:
+            for _ in range(max(1, int(args.megabytes * 1e6 / len(block)))):
+                f.write(block)
+        megabytes = os.path.getsize(path) / 1e6
+
+        def whole():
+            with open(path) as f:
+                for _ in parser.iter_forms(f.read()):
+                    pass
+
+        def streamed():
+            with open(path) as f:
+                for _ in parser.iter_stream(f, args.chunk_size):
+                    pass
+
+        print(f"🧪 Loading {megabytes:.1f} MB of MeTTa source (forms are discarded as they arrive)")
+
+        for label, load in (("read whole", whole), ("streaming", streamed)):
+            elapsed = best_of(load, args.repeat)
+
+            tracemalloc.start()
+            load()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(f"   {label:10s} {elapsed * 1000:9.1f} ms  ({megabytes / elapsed:6.2f} MB/s)  peak {peak / 1e6:8.2f} MB")
+
+def bench_parallel(args):
+    """Loading a large .metta file serially vs split across worker processes"""
+
+    forms = generate_knowledge_base(args.rules, 5, facts=10000)
+    block = "\n\n".join(forms) + "\n\n"
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "large.metta")
+        with open(path, "w") as f:
+            for _ in range(max(1, int(args.megabytes * 1e6 / len(block)))):
+                f.write(block)
+        megabytes = os.path.getsize(path) / 1e6
+
+        print(f"🧪 Loading {megabytes:.1f} MB of MeTTa source ({os.cpu_count()} CPUs available)")
+
+        serial = MeTTaKnowledgeBase()
+        serial.load_from_file(path)
+
+        for workers in [1] + args.workers:
+            def load():
+                kb = MeTTaKnowledgeBase()
+                kb.load_from_file(path, workers=workers)
+                return kb
+
+            kb = load()
+            if (kb.rules, kb.facts) != (serial.rules, serial.facts):
+                print(f"❌ {workers} workers loaded a different knowledge base")
+                sys.exit(1)
+
+            elapsed = best_of(load, args.repeat)
+            print(f"   {workers:2d} workers {elapsed * 1000:9.1f} ms  ({megabytes / elapsed:6.2f} MB/s)")
+
+def bench_numeric(args):
+    """Arithmetic rules from the knowledge base vs the same formulas in plain Python"""
+
+    reasoner = metta_engine.MeTTaReasoner()
+    rng = random.Random(42)
+    rows = [
+        {"edge": rng.uniform(-0.5, 0.5), "odds": rng.uniform(1.1, 5.0), "bankroll": rng.uniform(100, 100000)}
+        for _ in range(args.calls)
+    ]
+
+    cases = [
+        ("kelly-bet-size", "(kelly-bet-size $edge $odds)", ("edge", "odds"),
+         lambda edge, odds: edge / (odds - 1)),
+        ("max-bet-size", "(max-bet-size $bankroll medium-risk)", ("bankroll",),
+         lambda bankroll: bankroll * 0.05),
+        ("expected-value", "(expected-value $edge $odds $bankroll)", ("edge", "odds", "bankroll"),
+         lambda edge, odds, bankroll: edge * odds - bankroll),
+    ]
+
+    print(f"🧪 {args.calls} calls per rule with distinct arguments (tabling cannot help)")
+
+    for name, query, variables, native in cases:
+        template = reasoner.query_template(query)
+        calls = [{variable: row[variable] for variable in variables} for row in rows]
+
+        for bindings in calls[:100]:
+            result = template.first(**bindings)
+            if abs(result - native(**bindings)) > 1e-9:
+                print(f"❌ {name} returned {result!r}")
+                sys.exit(1)
+
+        def metta():
+            reasoner.table.clear()
+            for bindings in calls:
+                template.first(**bindings)
+
+        metta_time = best_of(metta, args.repeat)
+        python_time = best_of(lambda: [native(**bindings) for bindings in calls], args.repeat)
+        print(f"   {name:15s} {metta_time * 1e6 / len(calls):7.2f} µs/call  "
+              f"(plain Python {python_time * 1e6 / len(calls):5.2f} µs/call)")
+
+def bench_results(args):
+    """Nondeterministic queries: first result vs lazily iterated vs all results"""
+
+    reasoner = metta_engine.MeTTaReasoner(use_snapshot=False, max_results=args.clauses ** 2)
+    for i in range(args.clauses):
+        reasoner.kb.add_rule(f"(= (candidate $x) (* $x {i}))")
+    query = "(+ (candidate $x) (candidate $x))"
+    template = reasoner.query_template(query)
+
+    results = template.run(x=1.5)
+    print(f"🧪 {query}: {len(results)} results from {args.clauses} clauses per call")
+
+    for label, evaluate in (
+        ("first()", lambda: template.first(x=1.5)),
+        ("next(iter())", lambda: next(template.iter(x=1.5))),
+        ("run()", lambda: template.run(x=1.5)),
+    ):
+        elapsed = best_of(lambda: [evaluate() for _ in range(args.calls)], args.repeat)
+        print(f"   {label:13s} {elapsed * 1e6 / args.calls:9.2f} µs/query")
+
+def bench_deep(args):
+    """Deeply nested rules: an N-deep if chain and a tail-recursive countdown"""
+
+    engines = [("current", load_engine())]
+    if args.baseline:
+        engines.append(("baseline", load_engine(args.baseline)))
+
+    cases = [(f"{depth}-deep if", generate_knowledge_base(1, depth)[0], "(rule-0 $x)", {"x": 0}, f"level-{depth}")
+             for depth in args.depths]
+    cases.append((f"countdown {args.countdown}", "(= (countdown $n) (if (<= $n 0) done (countdown (- $n 1))))",
+                  "(countdown $n)", {"n": args.countdown}, "done"))
+
+    print(f"🧪 Deep evaluation ({args.calls} calls per measurement)")
+
+    for label, engine in engines:
+        for name, rule, query, bindings, expected in cases:
+            # One rule per reasoner, and no tabling, so every call walks the whole chain
+            reasoner = engine.MeTTaReasoner(use_snapshot=False, table_size=0)
+            reasoner.kb.add_rule(rule)
+            try:
+                template = reasoner.query_template(query)
+                result = template.first(**bindings)
+            except Exception as e:
+                result = f"{type(e).__name__}: {e}"
+            if result != expected:
+                print(f"   {label:9s} {name:18s} ❌ {result}")
+                continue
+
+            elapsed = best_of(lambda: [template.first(**bindings) for _ in range(args.calls)], args.repeat)
+            print(f"   {label:9s} {name:18s} {elapsed * 1e6 / args.calls:10.1f} µs/call")
+
+def bench_profile(args):
+    """analyze_market cost of rule profiling and tracing, and the profile they produce"""
+
+    markets = generate_markets(args.markets)
+    print(f"🧪 analyze_market over {len(markets)} markets with profiling hooks")
+
+    # No tabling, so every run evaluates the rules rather than reading earlier results
+    reasoner = metta_engine.MeTTaReasoner(table_size=0)
+    profiler = metta_engine.MeTTaProfiler()
+
+    def profiled():
+        with reasoner.profile(profiler):
+            return [reasoner.analyze_market(market) for market in markets]
+
+    def traced():
+        reasoner.trace_rules = True
+        try:
+            return [reasoner.analyze_market(market) for market in markets]
+        finally:
+            reasoner.trace_rules = False
+
+    for label, run in (
+        ("disabled", lambda: [reasoner.analyze_market(market) for market in markets]),
+        ("profiled", profiled),
+        ("traced", traced),
+    ):
+        elapsed = best_of(run, args.repeat)
+        print(f"   {label:9s} {elapsed * 1e6 / len(markets):8.1f} µs/market")
+
+    print("   rules by inclusive time:")
+    for name, stats in profiler.stats().items():
+        print(f"     {name:24s} {stats['calls']:8d} calls {stats['table_hits']:8d} hits {stats['total_ms']:10.2f} ms")
+
+    if args.output:
+        profiler.write_json(args.output + ".json")
+        profiler.write_collapsed(args.output + ".folded")
+        print(f"   wrote {args.output}.json and {args.output}.folded")
+
+async def loop_lag(stop, lags: List[float]):
+    """Record how late a 1 ms ticker wakes up until stop is set: how long other handlers would wait"""
+
+    import asyncio
+
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.001)
+        now = time.perf_counter()
+        lags.append(now - last - 0.001)
+        last = now
+
+def generate_transactions(count: int, seed: int = 42, first_block: int = 1) -> List[Dict]:
+    """Generate explorer transaction records in the shape crawl_markets reads, newest first"""
+
+    rng = random.Random(seed)
+    return [
+        {"hash": "0x" + "".join(rng.choice("0123456789abcdef") for _ in range(64)),
+         "block_number": first_block + count - 1 - i,
+         "method": rng.choice(["createMarket", "placeBet"]), "value": "0"}
+        for i in range(count)
+    ]
+
+def bench_http(args):
+    """Explorer crawl and history fetch latency against a local stand-in server"""
+
+    import asyncio
+    import socket
+    import statistics
+
+    import aiohttp
+    import requests
+    from aiohttp import web
+    from market_analyzer import DirectRPCDataFetcher
+
+    page_size = 50  # What Blockscout returns per page
+    ledger = generate_transactions(args.transactions)
+    pages = []
+    history = {"data": {"betPlacedEvents": generate_transactions(page_size)}}
+
+    async def transactions(request):
+        if args.delay:
+            await asyncio.sleep(args.delay / 1000)
+        index = int(request.query.get("index", 0))
+        pages.append(index)
+        next_page = {"index": index + page_size} if index + page_size < len(ledger) else None
+        return web.json_response({"items": ledger[index:index + page_size], "next_page_params": next_page})
+
+    async def bet_events(request):
+        await request.json()
+        if args.delay:
+            await asyncio.sleep(args.delay / 1000)
+        return web.json_response(history)
+
+    async def histories(label: str, fetch: Callable):
+        stop, lags = asyncio.Event(), []
+        ticker = asyncio.create_task(loop_lag(stop, lags))
+        start = time.perf_counter()
+        await fetch()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await ticker
+        print(f"   {label:9s} {elapsed * 1e3:9.1f} ms for {args.markets} markets"
+              f"  {max(lags, default=0.0) * 1e3:7.3f} ms longest event loop stall")
+
+    async def unpooled(url: str):
+        # What the market fetch used to do: a new session, connector and connection per call
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                await response.json()
+
+    async def pooled(fetcher, url: str):
+        async with fetcher.session().get(url) as response:
+            await response.json()
+
+    async def poll(label: str, fetcher):
+        del pages[:]
+        start = time.perf_counter()
+        await fetcher.refresh_markets()
+        markets = fetcher.get_active_markets()
+        elapsed = time.perf_counter() - start
+        print(f"   {label:9s} {elapsed * 1e3:9.1f} ms  {len(pages):4d} pages  {len(markets):6d} markets known")
+
+    async def measure(label: str, request: Callable):
+        latencies = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(args.requests)))
+        concurrent = time.perf_counter() - start
+        latencies.sort()
+        print(f"   {label:9s} {statistics.mean(latencies) * 1e3:7.3f} ms mean"
+              f"  {latencies[len(latencies) * 95 // 100] * 1e3:7.3f} ms p95"
+              f"  {args.requests / concurrent:8.0f} req/s with {args.requests} concurrent")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/api/v2/addresses/{address}/transactions", transactions)
+        app.router.add_post("/", bet_events)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(runner, sock).start()
+        endpoint = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        fetcher = DirectRPCDataFetcher(endpoint, state_path=None, source="explorer")
+        url = f"{endpoint}/api/v2/addresses/{fetcher.explorer_address}/transactions"
+
+        print(f"🧪 Explorer page requests against {endpoint} ({args.delay} ms server delay)")
+        try:
+            await measure("unpooled", lambda: unpooled(url))
+            await measure("pooled", lambda: pooled(fetcher, url))
+
+            print(f"🧪 refresh_markets over {args.transactions} transactions, {page_size} per page")
+            await poll("first", fetcher)
+            await poll("unchanged", fetcher)
+            ledger[:0] = generate_transactions(args.new, seed=7, first_block=args.transactions + 1)
+            await poll(f"+{args.new} new", fetcher)
+
+            market_ids = list(range(args.markets))
+            print(f"🧪 get_market_history for {args.markets} markets")
+
+            async def blocking():
+                # What get_market_history used to do: a synchronous request on the event loop thread
+                for market_id in market_ids:
+                    requests.post(endpoint, json={"query": str(market_id)}).json()
+
+            async def serial():
+                for market_id in market_ids:
+                    await fetcher.get_market_history(market_id)
+
+            await histories("blocking", blocking)
+            await histories("serial", serial)
+            await histories("concurrent", lambda: fetcher.get_market_histories(market_ids))
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+def generate_market_events(markets: int, bets: int, first_block: int = 1, seed: int = 42) -> List[Dict]:
+    """Generate decoded contract events in chain order: each market created, then bets spread over later blocks"""
+
+    rng = random.Random(seed)
+    events = [{"event": "MarketCreated", "block_number": first_block, "log_index": i, "market_id": i + 1,
+               "title": f"Market {i + 1}", "market_type": rng.randrange(2)} for i in range(markets)]
+    for block in range(first_block + 1, first_block + 1 + bets):
+        for i in range(markets):
+            amount = rng.randrange(1, 1000)
+            events.append({"event": "BetPlaced", "block_number": block, "log_index": i, "market_id": i + 1,
+                           "option": rng.randrange(2), "amount": amount, "shares": amount})
+    return events
+
+def bench_state(args):
+    """Refreshing market state from new events only vs rebuilding it from the whole event history"""
+
+    from market_state import MarketStateCache
+
+    address = "0x7bee0ab565e6ab33009647174eb8cd55b56ecd7c"
+    history = generate_market_events(args.markets, args.bets)
+    block = history[-1]["block_number"]
+
+    print(f"🧪 Market state over {args.markets:,} markets, {len(history):,} events; {args.new} new events per round")
+
+    def rebuild():
+        cache = MarketStateCache()
+        cache.apply(address, history)
+        cache.take_changed(address)
+
+    cache = MarketStateCache()
+    cache.apply(address, history)
+    cache.take_changed(address)
+    rng = random.Random(7)
+    rounds = []
+    for i in range(args.repeat):
+        rounds.append([{"event": "BetPlaced", "block_number": block + 1 + i, "log_index": j,
+                        "market_id": rng.randrange(args.markets) + 1, "option": rng.randrange(2),
+                        "amount": 10, "shares": 10} for j in range(args.new)])
+
+    def incremental():
+        cache.apply(address, rounds.pop())
+        cache.take_changed(address)
+
+    best = {}
+    for label, step in (("rebuild", rebuild), ("delta", incremental)):
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            step()
+            times.append(time.perf_counter() - start)
+        best[label] = min(times)
+        print(f"   {label:9s} {best[label] * 1e3:9.3f} ms per round")
+    print(f"   speedup: {best['rebuild'] / best['delta']:7.1f}x")
+
+def encode_log(event: Dict, address: str) -> Dict:
+    """An eth_getLogs entry carrying a market event, ABI-encoded the way ChimeraProtocol.sol emits it"""
+
+    from market_logs import EVENT_TOPICS
+
+    def word(value: int) -> str:
+        return format(value % (1 << 256), "064x")
+
+    kind = event["event"]
+    topics = [EVENT_TOPICS[kind], "0x" + word(event["market_id"])]
+    if kind == "MarketCreated":
+        title = event["title"].encode().hex()
+        data = word(64) + word(event["market_type"]) + word(len(title) // 2) + title.ljust(-(-len(title) // 64) * 64, "0")
+        topics.append("0x" + word(1))
+    elif kind == "BetPlaced":
+        data = word(event["option"]) + word(event["amount"]) + word(event["shares"])
+        topics += ["0x" + word(1), "0x" + word(0)]
+    else:
+        data = word(event["outcome"]) + word(event["final_price"])
+        topics.append("0x" + word(1))
+    return {"address": address, "topics": topics, "data": "0x" + data, "removed": False,
+            "blockNumber": hex(event["block_number"]), "logIndex": hex(event["log_index"])}
+
+def bench_logs(args):
+    """Market state ingestion from eth_getLogs against a local stub JSON-RPC node, serial vs concurrent ranges"""
+
+    import asyncio
+    import bisect
+    import socket
+    from dataclasses import asdict
+
+    import aiohttp
+    from aiohttp import web
+    from market_logs import LogIngester
+    from market_state import MarketStateCache
+
+    address = "0x7a9d78d1e5fe688f80d4c2c06ca4c0407a967644"
+    start = 1000
+    rng = random.Random(7)
+
+    # Spread the generated blocks out so ranges matter, and resolve every tenth market at the end
+    events = generate_market_events(args.markets, args.bets, first_block=start)
+    for event in events:
+        event["block_number"] = start + (event["block_number"] - start) * args.spacing
+    head = events[-1]["block_number"] + args.spacing
+    events += [{"event": "MarketResolved", "block_number": head, "log_index": i, "market_id": market_id,
+                "outcome": rng.randrange(2), "final_price": rng.randrange(-10 ** 9, 10 ** 9)}
+               for i, market_id in enumerate(range(1, args.markets + 1, 10))]
+    chain = {"head": head, "logs": [encode_log(event, address) for event in events]}
+    blocks = [event["block_number"] for event in events]
+
+    def reply(request: Dict) -> Dict:
+        if request["method"] == "eth_blockNumber":
+            return {"jsonrpc": "2.0", "id": request["id"], "result": hex(chain["head"])}
+        query = request["params"][0]
+        first, last = int(query["fromBlock"], 16), int(query["toBlock"], 16)
+        if last - first + 1 > args.limit:
+            return {"jsonrpc": "2.0", "id": request["id"],
+                    "error": {"code": -32005, "message": f"block range too large, limit is {args.limit}"}}
+        logs = chain["logs"][bisect.bisect_left(blocks, first):bisect.bisect_right(blocks, last)]
+        return {"jsonrpc": "2.0", "id": request["id"], "result": logs}
+
+    async def node(request):
+        if args.delay:
+            await asyncio.sleep(args.delay / 1000)
+        return web.json_response(reply(await request.json()))
+
+    def snapshot(cache: MarketStateCache) -> List[Dict]:
+        return [dict(asdict(market), end_time=None) for market in cache.markets(address)]
+
+    expected = MarketStateCache()
+    expected.apply(address, events)
+
+    async def run():
+        app = web.Application(client_max_size=0)
+        app.router.add_post("/", node)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(runner, sock).start()
+        endpoint = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        session = aiohttp.ClientSession()
+
+        print(f"🧪 eth_getLogs ingestion of {len(events):,} events over {head - start:,} blocks"
+              f" (node limit {args.limit} blocks, {args.delay} ms per request)")
+        try:
+            for label, concurrency, range_blocks in (("serial", 1, args.limit),
+                                                     ("concurrent", args.concurrency, args.limit),
+                                                     ("adaptive", args.concurrency, args.limit * 16)):
+                cache = MarketStateCache()
+                ingester = LogIngester(lambda: session, endpoint, address, cache, start_block=start,
+                                       range_blocks=range_blocks, concurrency=concurrency, confirmations=0,
+                                       max_blocks=None)
+                begin = time.perf_counter()
+                applied = await ingester.ingest()
+                elapsed = time.perf_counter() - begin
+                check = "✓" if snapshot(cache) == snapshot(expected) else "✗ state differs"
+                print(f"   {label:10s} {elapsed * 1e3:9.1f} ms  {ingester.requests:5d} requests"
+                      f"  {applied:7,d} events  range now {ingester.range_blocks}  {check}")
+
+            # Later polls only cover the blocks since the cursor
+            new = [{"event": "BetPlaced", "block_number": head + 1 + i, "log_index": 0, "market_id": 1,
+                    "option": 0, "amount": 5, "shares": 5} for i in range(args.new)]
+            chain["logs"] += [encode_log(event, address) for event in new]
+            blocks.extend(event["block_number"] for event in new)
+            chain["head"] = head + args.new
+            ingester.requests = 0
+            begin = time.perf_counter()
+            applied = await ingester.ingest()
+            elapsed = time.perf_counter() - begin
+            print(f"   {'next poll':10s} {elapsed * 1e3:9.1f} ms  {ingester.requests:5d} requests  {applied:7,d} events")
+        finally:
+            await session.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+def bench_rounds(args):
+    """Periodic analysis rounds: markets one after another on the event loop, bounded concurrent pipelines, and one batch analysis then concurrent actions"""
+
+    import asyncio
+
+    markets = generate_markets(args.markets)
+    reasoner = metta_engine.MeTTaReasoner()
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+
+    def analyze(market: Dict):
+        # Heavier reasoning than the shipped rules need, as a larger knowledge base would
+        for _ in range(args.work):
+            reasoner.analyze_market(market)
+
+    async def act(index: int):
+        # Stand-in for placing a bet: network latency, and one market far slower than the rest
+        await asyncio.sleep(args.slow if index == 0 else args.latency / 1000)
+
+    async def serial():
+        for index, market in enumerate(markets):
+            analyze(market)
+            await act(index)
+
+    async def pipelines():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        loop = asyncio.get_running_loop()
+
+        async def pipeline(index: int, market: Dict):
+            async with semaphore:
+                await loop.run_in_executor(pool, analyze, market)
+                await act(index)
+
+        await asyncio.gather(*(pipeline(index, market) for index, market in enumerate(markets)))
+
+    def analyze_batch():
+        for _ in range(args.work):
+            reasoner.analyze_markets(markets)
+
+    async def batch():
+        # What the agent's round does: reason over every market at once, then act on each concurrently
+        semaphore = asyncio.Semaphore(args.concurrency)
+        await asyncio.get_running_loop().run_in_executor(pool, analyze_batch)
+
+        async def action(index: int):
+            async with semaphore:
+                await act(index)
+
+        await asyncio.gather(*(action(index) for index in range(len(markets))))
+
+    async def measure(label: str, round_: Callable):
+        stop, lags = asyncio.Event(), []
+        ticker = asyncio.create_task(loop_lag(stop, lags))
+        start = time.perf_counter()
+        await round_()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await ticker
+        print(f"   {label:9s} {elapsed * 1e3:9.1f} ms per round"
+              f"  {max(lags, default=0.0) * 1e3:7.3f} ms longest event loop stall")
+
+    async def run():
+        print(f"🧪 Analysis round over {args.markets} markets ({args.work} analyses and {args.latency} ms to act per market,"
+              f" one market taking {args.slow}s; {args.concurrency} pipelines, {args.workers} reasoning threads)")
+        await measure("serial", serial)
+        await measure("pipelines", pipelines)
+        await measure("batch", batch)
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "analyze": bench_analyze,
+    "match": bench_match,
+    "batch": bench_batch,
+    "stress": bench_stress,
+    "startup": bench_startup,
+    "reload": bench_reload,
+    "memory": bench_memory,
+    "stream": bench_stream,
+    "parallel": bench_parallel,
+    "numeric": bench_numeric,
+    "results": bench_results,
+    "deep": bench_deep,
+    "profile": bench_profile,
+    "http": bench_http,
+    "state": bench_state,
+    "logs": bench_logs,
+    "rounds": bench_rounds,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MeTTa reasoning engine")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parse_parser = subparsers.add_parser("parse", help=bench_parse.__doc__)
+    parse_parser.add_argument("--rules", type=int, default=500, help="Number of generated rules")
+    parse_parser.add_argument("--depths", type=int, nargs="+", default=[5, 20, 80], help="Nesting depths to test")
+    parse_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+
+    analyze_parser = subparsers.add_parser("analyze", help=bench_analyze.__doc__)
+    analyze_parser.add_argument("--markets", type=int, default=2000, help="Number of generated markets")
+    analyze_parser.add_argument("--baseline", help="Path to another metta_engine.py to compare against")
+    analyze_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+
+    match_parser = subparsers.add_parser("match", help=bench_match.__doc__)
+    match_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="Knowledge-base sizes")
+    match_parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+
+    batch_parser = subparsers.add_parser("batch", help=bench_batch.__doc__)
+    batch_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="Batch sizes")
+    batch_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+
+    stress_parser = subparsers.add_parser("stress", help=bench_stress.__doc__)
+    stress_parser.add_argument("--markets", type=int, default=5000, help="Number of concurrent analyses")
+    stress_parser.add_argument("--threads", type=int, default=16, help="Worker threads")
+    stress_parser.add_argument("--no-mutate", dest="mutate", action="store_false",
+                               help="Do not add facts while the analyses run")
+    stress_parser.add_argument("--baseline", help="Path to another metta_engine.py to stress instead")
+
+    startup_parser = subparsers.add_parser("startup", help=bench_startup.__doc__)
+    startup_parser.add_argument("--rules", type=int, default=200, help="Number of generated rules")
+    startup_parser.add_argument("--facts", type=int, nargs="+", default=[0, 10000, 50000], help="Knowledge-base sizes")
+    startup_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+
+    reload_parser = subparsers.add_parser("reload", help=bench_reload.__doc__)
+    reload_parser.add_argument("--rules", type=int, default=200, help="Number of generated rules")
+    reload_parser.add_argument("--facts", type=int, nargs="+", default=[0, 10000], help="Knowledge-base sizes")
+    reload_parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+
+    memory_parser = subparsers.add_parser("memory", help=bench_memory.__doc__)
+    memory_parser.add_argument("--atoms", type=int, default=100000, help="Approximate number of atoms to load")
+    memory_parser.add_argument("--rules", type=int, default=100, help="Number of generated rules")
+    memory_parser.add_argument("--baseline", help="Path to another metta_engine.py to compare against")
+
+    stream_parser = subparsers.add_parser("stream", help=bench_stream.__doc__)
+    stream_parser.add_argument("--megabytes", type=float, default=20, help="Size of the generated file")
+    stream_parser.add_argument("--chunk-size", type=int, default=1 << 20, help="Characters read per chunk")
+    stream_parser.add_argument("--rules", type=int, default=100, help="Generated rules per repeated block")
+    stream_parser.add_argument("--repeat", type=int, default=1, help="Runs per measurement (best is reported)")
+
+    parallel_parser = subparsers.add_parser("parallel", help=bench_parallel.__doc__)
+    parallel_parser.add_argument("--megabytes", type=float, default=20, help="Size of the generated file")
+    parallel_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8], help="Worker process counts")
+    parallel_parser.add_argument("--rules", type=int, default=100, help="Generated rules per repeated block")
+    parallel_parser.add_argument("--repeat", type=int, default=1, help="Runs per measurement (best is reported)")
+
+    numeric_parser = subparsers.add_parser("numeric", help=bench_numeric.__doc__)
+    numeric_parser.add_argument("--calls", type=int, default=100000, help="Calls per rule")
+    numeric_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+
+    results_parser = subparsers.add_parser("results", help=bench_results.__doc__)
+    results_parser.add_argument("--clauses", type=int, default=30, help="Matching clauses of the queried rule")
+    results_parser.add_argument("--calls", type=int, default=200, help="Queries per measurement")
+    results_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+
+    deep_parser = subparsers.add_parser("deep", help=bench_deep.__doc__)
+    deep_parser.add_argument("--depths", type=int, nargs="+", default=[10, 100, 1000], help="Nesting depths of the if chain")
+    deep_parser.add_argument("--countdown", type=int, default=10000, help="Tail-recursive calls per countdown")
+    deep_parser.add_argument("--baseline", help="Path to another metta_engine.py to compare against")
+    deep_parser.add_argument("--calls", type=int, default=20, help="Calls per measurement")
+    deep_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+
+    profile_parser = subparsers.add_parser("profile", help=bench_profile.__doc__)
+    profile_parser.add_argument("--markets", type=int, default=2000, help="Number of generated markets")
+    profile_parser.add_argument("--output", help="Write the profile to OUTPUT.json and OUTPUT.folded")
+    profile_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+
+    http_parser = subparsers.add_parser("http", help=bench_http.__doc__)
+    http_parser.add_argument("--requests", type=int, default=200, help="Requests per measurement")
+    http_parser.add_argument("--transactions", type=int, default=1000, help="Contract transactions on the explorer")
+    http_parser.add_argument("--new", type=int, default=10, help="Transactions added before the last poll")
+    http_parser.add_argument("--markets", type=int, default=50, help="Markets whose history is fetched")
+    http_parser.add_argument("--delay", type=float, default=0.0, help="Server-side delay per request, in ms")
+
+    state_parser = subparsers.add_parser("state", help=bench_state.__doc__)
+    state_parser.add_argument("--markets", type=int, default=1000, help="Markets on the contract")
+    state_parser.add_argument("--bets", type=int, default=20, help="Blocks of bets in the history, one bet per market each")
+    state_parser.add_argument("--new", type=int, default=50, help="Events since the previous round")
+    state_parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+
+    logs_parser = subparsers.add_parser("logs", help=bench_logs.__doc__)
+    logs_parser.add_argument("--markets", type=int, default=200, help="Markets on the contract")
+    logs_parser.add_argument("--bets", type=int, default=20, help="Blocks of bets, one bet per market each")
+    logs_parser.add_argument("--spacing", type=int, default=5000, help="Blocks between blocks with bets")
+    logs_parser.add_argument("--limit", type=int, default=1000, help="Widest eth_getLogs range the stub node accepts")
+    logs_parser.add_argument("--concurrency", type=int, default=4, help="Ranges in flight for the concurrent runs")
+    logs_parser.add_argument("--new", type=int, default=3, help="Blocks with new bets before the next poll")
+    logs_parser.add_argument("--delay", type=float, default=2.0, help="Stub node delay per request, in ms")
+
+    rounds_parser = subparsers.add_parser("rounds", help=bench_rounds.__doc__)
+    rounds_parser.add_argument("--markets", type=int, default=100, help="Changed markets in the round")
+    rounds_parser.add_argument("--work", type=int, default=500, help="analyze_market calls per market")
+    rounds_parser.add_argument("--latency", type=float, default=5.0, help="Time to act on one market, in ms")
+    rounds_parser.add_argument("--slow", type=float, default=0.5, help="Time to act on the one slow market, in s")
+    rounds_parser.add_argument("--concurrency", type=int, default=8, help="Pipelines running at once")
+    rounds_parser.add_argument("--workers", type=int, default=1, help="Reasoning threads")
+
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n👋 Benchmark cancelled by user")
+        sys.exit(1)
@@ -6,13 +6,16 @@ Uses MeTTa reasoning and direct contract data to make intelligent betting decisi
 import asyncio
 import json
 import os
-import requests
+import aiohttp
 import time
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 from uuid import uuid4
 
+from market_logs import LOG_START_BLOCK, LogIngester
+from market_state import MarketData, MarketStateCache, new_market
+
 # ASI Alliance imports (as specified in eth.md)
 from uagents import Agent, Context, Protocol, Model
 from uagents.setup import fund_agent_if_low
@@ -90,6 +93,9 @@ class MeTTaReasoner:
             from metta_engine import MeTTaReasoner as CustomMeTTaReasoner
             self.metta_engine = CustomMeTTaReasoner()
             self.metta_available = True
+            # Apply edits to metta_knowledge_base.metta without restarting the agent
+            if os.getenv("METTA_HOT_RELOAD", "1") != "0":
+                self.metta_engine.watch()
             print("✅ Custom MeTTa reasoning engine loaded with 32+ rules")
         except Exception as e:
             print(f"⚠️ Custom MeTTa engine not available: {e}")
@@ -142,61 +148,190 @@ class MeTTaReasoner:
         # Fallback to heuristic analysis
         return self._fallback_analysis(market_data)
 
-@dataclass
-class MarketData:
-    """Market data structure"""
-    id: int
-    title: str
-    total_pool: int
-    option_a_shares: int
-    option_b_shares: int
-    end_time: datetime
-    market_type: str
-    status: str
+    def analyze_markets_data(self, batch: List[Dict]) -> List[Dict]:
+        """Analyze a batch of markets in one vectorized MeTTa call; fallback to heuristic if needed."""
+
+        if self.metta_engine and self.metta_available:
+            try:
+                return self.metta_engine.analyze_markets(batch)
+
+            except Exception as e:
+                print(f"Custom MeTTa batch analysis error: {e}")
+
+        return [self._fallback_analysis(market_data) for market_data in batch]
+
+# Connection pool of the shared HTTP session used for RPC and explorer requests
+HTTP_POOL_LIMIT = 64             # Open connections in total
+HTTP_POOL_LIMIT_PER_HOST = 16    # Open connections to one host
+HTTP_KEEPALIVE_TIMEOUT = 60      # Seconds an idle connection is kept for reuse
+HTTP_DNS_CACHE_TTL = 300         # Seconds a resolved host name is cached
+HTTP_REQUEST_TIMEOUT = 30        # Seconds for a whole request, including reading the body
+HTTP_CONNECT_TIMEOUT = 10        # Seconds to get a connection from the pool and connect
+HTTP_HISTORY_CONCURRENCY = 8     # Market histories fetched at once by get_market_histories
+
+# Where market state and the last processed block are kept between runs
+MARKET_STATE_PATH = os.getenv("CHIMERA_MARKET_STATE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "market_state.json"))
+
+# Where markets come from: "logs" ingests contract events with eth_getLogs, "explorer" crawls transactions
+MARKET_SOURCE = os.getenv("CHIMERA_MARKET_SOURCE", "logs")
 
 class DirectRPCDataFetcher:
-    """Fetches market data directly from RPC"""
+    """Fetches market data directly from RPC
     
-    def __init__(self, rpc_endpoint: str):
+    All requests share one aiohttp session, created on first use in the
+    running event loop, so connections (and their TLS sessions) are kept
+    alive and reused across analysis rounds, queries and chat messages
+    instead of being set up for every call. close() releases it; the agent
+    calls it on shutdown.
+    
+    Markets live in a MarketStateCache, kept in a JSON file at state_path,
+    or only in memory if it is None, together with the last block processed
+    (the high-water mark). With the "logs" source, a LogIngester folds the
+    contract's MarketCreated, BetPlaced and MarketResolved logs since the
+    mark into it, so markets carry their real pools and shares. With the
+    "explorer" source, crawl_markets pages through the contract's
+    transactions newest first down to the mark and only discovers markets.
+    
+    The two sources track different deployments: the log ingester reads
+    the current ChimeraProtocol contract (contract_address, set with
+    CHIMERA_CONTRACT_ADDRESS) and the explorer crawl the earlier one it
+    was written for (explorer_address, set with CHIMERA_EXPLORER_ADDRESS).
+    """
+    
+    def __init__(self, rpc_endpoint: str, state_path: Optional[str] = MARKET_STATE_PATH, source: str = MARKET_SOURCE):
         self.endpoint = rpc_endpoint
         self.contract_address = os.getenv("CHIMERA_CONTRACT_ADDRESS", "0x7a9D78D1E5fe688F80D4C2c06Ca4C0407A967644")
+        self.explorer_address = os.getenv("CHIMERA_EXPLORER_ADDRESS", "0x7Bee0AB565e6aB33009647174Eb8cd55B56EcD7c")
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.markets = MarketStateCache(state_path)
+        self.source = source
+        self.log_ingester = LogIngester(self.session, self.endpoint, self.contract_address, self.markets,
+                                        start_block=int(os.getenv("CHIMERA_START_BLOCK", LOG_START_BLOCK)))
+        self._refresh_lock: Optional[asyncio.Lock] = None
     
-    async def get_active_markets(self) -> List[MarketData]:
-        """Fetch active markets from contract directly"""
+    @property
+    def market_address(self) -> str:
+        """The contract whose markets the configured source tracks"""
         
-        import aiohttp
-        import os
-        import time
+        return self.contract_address if self.source == "logs" else self.explorer_address
+    
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session, created with a tuned connection pool if there is none open"""
+        
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            )
+            timeout = aiohttp.ClientTimeout(total=HTTP_REQUEST_TIMEOUT, sock_connect=HTTP_CONNECT_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+    
+    async def close(self):
+        """Close the shared session and its pooled connections"""
         
-        try:
-            chimera_address = os.getenv("CHIMERA_CONTRACT_ADDRESS", "0x7Bee0AB565e6aB33009647174Eb8cd55B56EcD7c")
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    @staticmethod
+    def market_from_transaction(tx_hash: str) -> MarketData:
+        """The market created by a contract transaction"""
+        
+        return new_market(int(tx_hash[-8:], 16), f"Market {tx_hash[-8:]}")  # Convert hex to int
+    
+    async def crawl_markets(self) -> AsyncIterator[MarketData]:
+        """Yield markets created since the last complete crawl, newest first, as explorer pages arrive
+        
+        Follows the explorer's next_page_params cursor until it reaches a block
+        already processed or the contract's first transaction. Only a crawl that
+        runs to the end adds its markets to the cache and moves the mark; one
+        that fails or is abandoned by the caller is simply repeated on the next
+        poll. Transactions not yet in a block are left for a later crawl.
+        """
+        
+        mark = self.markets.cursor(self.explorer_address)
+        newest = None
+        created = []
+        
+        # Get contract transactions, newest first; the explorer picks the page size
+        url = f"{self.endpoint}/api/v2/addresses/{self.explorer_address}/transactions"
+        params = {}
+        while params is not None:
+            async with self.session().get(url, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
             
-            async with aiohttp.ClientSession() as session:
-                # Get contract transactions
-                url = f"{self.endpoint}/api/v2/addresses/{chimera_address}/transactions"
-                async with session.get(url, params={"limit": 100}) as response:
-                    data = await response.json()
-                    
-                    markets = []
-                    for tx in data.get("items", []):
-                        # Filter for market creation transactions
-                        if tx.get("method") == "createMarket" or int(tx.get("value", "0")) == 0:
-                            markets.append(MarketData(
-                                id=int(tx["hash"][-8:], 16),  # Convert hex to int
-                                title=f"Market {tx['hash'][-8:]}",
-                                total_pool=0,  # Will be calculated from bets
-                                option_a_shares=0,
-                                option_b_shares=0,
-                                end_time=datetime.fromtimestamp(time.time() + 86400),  # 24h from now
-                                market_type="binary",
-                                status="active"
-                            ))
-                    
-                    return markets[:10]  # Return first 10 markets
-                    
+            params = data.get("next_page_params") or None
+            for tx in data.get("items", []):
+                block_number = tx.get("block_number", tx.get("block"))
+                if block_number is None:
+                    continue
+                if mark is not None and block_number <= mark:
+                    params = None
+                    break
+                if newest is None:
+                    newest = (block_number, tx.get("timestamp"))
+                
+                # Filter for market creation transactions
+                if tx.get("method") == "createMarket" or int(tx.get("value", "0")) == 0:
+                    market = self.market_from_transaction(tx["hash"])
+                    created.append({
+                        "event": "MarketCreated",
+                        "block_number": block_number,
+                        "log_index": tx.get("position", 0),
+                        "timestamp": tx.get("timestamp"),
+                        "market_id": market.id,
+                        "title": market.title
+                    })
+                    yield market
+        
+        if newest is not None:
+            self.markets.apply(self.explorer_address, reversed(created))
+            self.markets.advance(self.explorer_address, *newest)
+            self.markets.save()
+    
+    async def refresh_markets(self):
+        """Bring the cached markets up to date with the contract
+        
+        Ingests only the logs or transactions since the previous refresh; a
+        log backfill covers at most LogIngester.max_blocks per call and
+        continues on the next one. Only the periodic analysis round calls
+        this. Refreshes never overlap: a caller arriving during one waits for
+        it, and its own then covers only what arrived meanwhile.
+        """
+        
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        
+        try:
+            async with self._refresh_lock:
+                if self.source == "logs":
+                    await self.log_ingester.ingest()
+                    if self.log_ingester.behind:
+                        print(f"Market logs backfill: {self.log_ingester.behind} blocks left for later rounds")
+                else:
+                    async for _ in self.crawl_markets():
+                        pass
         except Exception as e:
             print(f"Error fetching markets from RPC: {e}")
-            return []
+    
+    def get_active_markets(self) -> List[MarketData]:
+        """Every unresolved market in the cache, newest first, as of the last refresh_markets()"""
+        
+        return [market for market in self.markets.markets(self.market_address) if market.status == "active"]
+    
+    def take_changed_markets(self) -> List[MarketData]:
+        """Unresolved markets created or updated since the last call, for rounds that skip unchanged markets"""
+        
+        return [market for market in self.markets.take_changed(self.market_address) if market.status == "active"]
+    
+    def requeue_markets(self, markets: List[MarketData]):
+        """Return taken markets a round could not finish, so the next take_changed_markets() includes them"""
+        
+        self.markets.mark_changed(self.market_address, markets)
     
     async def get_market_history(self, market_id: int) -> List[Dict]:
         """Get betting history for a specific market"""
@@ -216,21 +351,36 @@ class DirectRPCDataFetcher:
         """
         
         try:
-            response = requests.post(
-                self.endpoint,
-                json={"query": query},
-                headers={"Content-Type": "application/json"}
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("data", {}).get("betPlacedEvents", [])
-            else:
-                return []
+            async with self.session().post(self.endpoint, json={"query": query}) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data.get("data", {}).get("betPlacedEvents", [])
+                else:
+                    return []
                 
+        except asyncio.TimeoutError:
+            print(f"Timed out fetching history of market {market_id}")
+            return []
         except Exception as e:
             print(f"Error fetching market history: {e}")
             return []
+    
+    async def get_market_histories(self, market_ids: List[int], concurrency: int = HTTP_HISTORY_CONCURRENCY) -> Dict[int, List[Dict]]:
+        """Get betting histories for many markets concurrently, at most `concurrency` requests at a time"""
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def fetch(market_id: int) -> List[Dict]:
+            async with semaphore:
+                return await self.get_market_history(market_id)
+        
+        histories = await asyncio.gather(*(fetch(market_id) for market_id in market_ids))
+        return dict(zip(market_ids, histories))
+
+# Periodic analysis rounds
+ANALYSIS_CONCURRENCY = 8         # Markets acted on at once
+ANALYSIS_WORKERS = 1             # Threads running MeTTa reasoning off the event loop; more only contend for the GIL
+MARKET_PIPELINE_TIMEOUT = 60     # Seconds acting on one market may take before its round moves on without it
 
 class ChimeraAgent:
     """Main ChimeraProtocol ASI Agent"""
@@ -264,6 +414,9 @@ class ChimeraAgent:
         self.min_confidence = 0.6  # Minimum confidence to place bet
         self.analysis_interval = 300  # Analyze markets every 5 minutes
         
+        # MeTTa reasoning is thread-safe; running it in a pool keeps chat and queries responsive
+        self.analysis_pool = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="metta-analysis")
+        
         # Setup protocols
         self.setup_protocols()
         
@@ -284,18 +437,27 @@ class ChimeraAgent:
         @market_analysis_protocol.on_interval(period=self.analysis_interval)
         async def analyze_markets(ctx: Context):
             """Periodic market analysis"""
+            
             ctx.logger.info("🔍 Starting market analysis...")
+            markets = []
             
             try:
-                # Fetch active markets
-                markets = await self.rpc_fetcher.get_active_markets()
-                ctx.logger.info(f"📊 Found {len(markets)} active markets")
+                # Fetch new events; only markets changed since the last round need another look
+                await self.rpc_fetcher.refresh_markets()
+                known = self.rpc_fetcher.get_active_markets()
+                markets = self.rpc_fetcher.take_changed_markets()
+                ctx.logger.info(f"📊 Found {len(known)} active markets, {len(markets)} changed")
                 
-                for market in markets:
-                    await self.analyze_single_market(ctx, market)
+                failed = await self.analyze_market_round(ctx, markets)
                     
             except Exception as e:
                 ctx.logger.error(f"❌ Error in market analysis: {e}")
+                failed = markets
+            
+            # Markets the round did not finish are looked at again in the next one
+            if failed:
+                ctx.logger.warning(f"🔁 {len(failed)} markets left for the next round")
+                self.rpc_fetcher.requeue_markets(failed)
         
         self.agent.include(market_analysis_protocol)
         
@@ -409,29 +571,68 @@ class ChimeraAgent:
 
         self.agent.include(chat_protocol)
     
-    async def analyze_single_market(self, ctx: Context, market: MarketData):
-        """Analyze a single market and potentially place bet"""
-        
-        ctx.logger.info(f"🎯 Analyzing market: {market.title}")
+    def build_market_data(self, market: MarketData) -> Optional[Dict]:
+        """Market snapshot for MeTTa analysis, or None if the market has no shares yet"""
         
         # Calculate market ratios
         total_shares = market.option_a_shares + market.option_b_shares
         if total_shares == 0:
-            return
+            return None
         
         option_a_ratio = market.option_a_shares / total_shares
         
-        market_data = {
+        return {
             "totalPool": market.total_pool,
+            "totalVolume": market.total_pool,  # What the MeTTa risk and recommendation rules read
             "optionARatio": option_a_ratio,
             "totalShares": total_shares,
             "marketType": market.market_type
         }
+    
+    async def analyze_market_round(self, ctx: Context, markets: List[MarketData]) -> List[MarketData]:
+        """Analyze a round's markets and act on them; returns the markets that failed
+        
+        MeTTa reasoning runs once for the whole batch in the worker pool,
+        vectorized where the engine can; only acting on the analyses, which
+        waits on the network, fans out per market.
+        """
         
-        # Get MeTTa analysis
-        analysis = self.metta_reasoner.analyze_market_data(market_data)
+        batch = []
+        for market in markets:
+            market_data = self.build_market_data(market)
+            if market_data is not None:
+                batch.append((market, market_data))
+        if not batch:
+            return []
+        
+        ctx.logger.info(f"🎯 Analyzing {len(batch)} markets")
+        loop = asyncio.get_running_loop()
+        analyses = await loop.run_in_executor(self.analysis_pool, self.metta_reasoner.analyze_markets_data,
+                                              [market_data for _, market_data in batch])
+        
+        # One pipeline per market, a bounded number running at once
+        semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+        done = await asyncio.gather(*(self.act_on_market(ctx, market, analysis, semaphore)
+                                      for (market, _), analysis in zip(batch, analyses)))
+        return [market for (market, _), ok in zip(batch, done) if not ok]
+    
+    async def act_on_market(self, ctx: Context, market: MarketData, analysis: Dict, semaphore: asyncio.Semaphore) -> bool:
+        """Act on one market of a round without letting it fail or stall the others; returns whether it finished"""
         
-        ctx.logger.info(f"🧠 Analysis: {analysis['recommendation']} "
+        async with semaphore:
+            try:
+                await asyncio.wait_for(self.act_on_analysis(ctx, market, analysis), MARKET_PIPELINE_TIMEOUT)
+                return True
+            except asyncio.TimeoutError:
+                ctx.logger.warning(f"⏱️ Market {market.id} took over {MARKET_PIPELINE_TIMEOUT}s, moving on")
+            except Exception as e:
+                ctx.logger.error(f"❌ Error acting on market {market.id}: {e}")
+            return False
+    
+    async def act_on_analysis(self, ctx: Context, market: MarketData, analysis: Dict):
+        """Log an analysis and place a bet if it is confident enough"""
+        
+        ctx.logger.info(f"🧠 Analysis of {market.title}: {analysis['recommendation']} "
                        f"(confidence: {analysis['confidence']:.2f})")
         ctx.logger.info(f"💭 Reasoning: {analysis['reasoning']}")
         
@@ -443,15 +644,15 @@ class ChimeraAgent:
             bet_amount = int(self.max_bet_amount * analysis["confidence"])
             option = 0 if analysis["recommendation"] == "BUY_A" else 1
             
-            await self.place_bet_via_lit(ctx, market.id, option, bet_amount, analysis)
+            await self.place_bet_direct(ctx, market.id, option, bet_amount, analysis)
     
     async def process_market_query(self, query: str, sender: str) -> ChimeraResponse:
         """Process natural language market analysis queries"""
         try:
             print(f"🔍 Processing query: {query}")
             
-            # Get active markets
-            markets = await self.rpc_fetcher.get_active_markets()
+            # Get active markets as of the last analysis round; queries never wait on a refresh
+            markets = self.rpc_fetcher.get_active_markets()
             
             if not markets:
                 return ChimeraResponse(
@@ -574,18 +775,21 @@ class ChimeraAgent:
             print(f"   Chat Protocol: {'✅ Available' if CHAT_AVAILABLE else '❌ Missing'}")
             print(f"   ACCESS_TOKEN: {'✅ Set' if os.getenv('ACCESS_TOKEN') else '❌ Missing'}")
             
-            # Test RPC connection
-            try:
-                markets = await self.rpc_fetcher.get_active_markets()
-                print(f"✅ RPC connection successful - Found {len(markets)} markets")
-            except Exception as e:
-                print(f"❌ RPC connection failed: {e}")
+            # Markets kept from the last run; the first analysis round brings them up to date
+            markets = self.rpc_fetcher.get_active_markets()
+            print(f"📦 Market state: {len(markets)} active markets up to block {self.rpc_fetcher.markets.cursor(self.rpc_fetcher.market_address)}")
             
             print("✅ Ready for market analysis and chat interactions!")
             print("👀 Waiting for messages...")
             
             ctx.logger.info("ChimeraProtocol ASI Agent startup complete")
         
+        @self.agent.on_event("shutdown")
+        async def shutdown_handler(ctx: Context):
+            # Release pooled RPC connections and the analysis threads
+            await self.rpc_fetcher.close()
+            self.analysis_pool.shutdown(wait=False)
+        
         print("🚀 Starting ChimeraProtocol ASI Agent...")
         self.agent.run()
 
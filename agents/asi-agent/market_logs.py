@@ -0,0 +1,260 @@
+"""
+Event-log ingestion for the ChimeraProtocol agent
+Pulls MarketCreated, BetPlaced and MarketResolved logs with eth_getLogs and folds them into market state
+"""
+
+import asyncio
+import itertools
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from market_state import MarketStateCache
+
+LOG_RANGE_BLOCKS = 1000          # Widest eth_getLogs range; Hedera's JSON-RPC relay rejects larger ones by default
+LOG_CONCURRENCY = 4              # eth_getLogs requests in flight at once
+LOG_CONFIRMATIONS = 12           # Blocks behind the head before logs are ingested, as in envio.config.yaml
+LOG_START_BLOCK = 26156847       # Deployment block of the contract, as in envio.config.yaml
+LOG_MAX_BLOCKS = 100000          # Most blocks one ingest() covers, so a backfill is spread over several calls
+LOG_RETRIES = 5                  # Retries of a rate-limited request before giving up
+LOG_BACKOFF = 0.5                # Seconds before the first retry; doubled for each further one
+LOG_GROW_AFTER = 16              # Accepted ranges in a row before a shrunk range width is doubled again
+
+# JSON-RPC error code providers use for any limit: ranges and result sizes, but also request rates
+LIMIT_EXCEEDED = -32005
+# Error code of the Hedera JSON-RPC relay's per-IP rate limit
+RATE_LIMITED = -32605
+HTTP_TOO_MANY_REQUESTS = 429
+
+# Error messages refusing an eth_getLogs range for its width or its number of results
+RANGE_ERRORS = ("block range", "range too", "range is too", "too many blocks",
+                "too many results", "too many logs", "returned more than", "response size")
+# Error messages throttling the client, whatever the range
+RATE_ERRORS = ("rate limit", "too many requests")
+
+class JSONRPCError(Exception):
+    """An error response to a JSON-RPC request"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"JSON-RPC error {code}: {message}")
+        self.code = code
+        self.message = message
+
+    @property
+    def rate_limited(self) -> bool:
+        """Whether the node is throttling requests; retrying later may succeed"""
+
+        message = self.message.lower()
+        return self.code in (RATE_LIMITED, HTTP_TOO_MANY_REQUESTS) or any(words in message for words in RATE_ERRORS)
+
+    @property
+    def range_too_large(self) -> bool:
+        """Whether the node refused an eth_getLogs range as too wide or too many results
+
+        Decided by the message: LIMIT_EXCEEDED is also used for rate limits.
+        """
+
+        message = self.message.lower()
+        return not self.rate_limited and any(words in message for words in RANGE_ERRORS)
+
+def _word(data: str, index: int) -> int:
+    """The index-th 32-byte word of hex-encoded ABI data, as an unsigned integer"""
+
+    return int(data[2 + 64 * index:2 + 64 * (index + 1)], 16)
+
+def _signed(value: int) -> int:
+    """An ABI word reinterpreted as a two's-complement signed integer"""
+
+    return value - (1 << 256) if value >> 255 else value
+
+def _string(data: str, index: int) -> str:
+    """The dynamic string whose offset is the index-th word of hex-encoded ABI data"""
+
+    start = 2 + 2 * _word(data, index)
+    length = int(data[start:start + 64], 16)
+    return bytes.fromhex(data[start + 64:start + 64 + 2 * length]).decode("utf-8", "replace")
+
+def _decode_market_created(log: Dict) -> Dict:
+    # MarketCreated(uint256 indexed marketId, string title, address indexed creator, MarketType marketType)
+    data = log["data"]
+    return {"event": "MarketCreated", "market_id": int(log["topics"][1], 16),
+            "title": _string(data, 0), "market_type": _word(data, 1)}
+
+def _decode_bet_placed(log: Dict) -> Dict:
+    # BetPlaced(uint256 indexed marketId, address indexed user, address indexed agent, uint8 option, uint256 amount, uint256 shares)
+    data = log["data"]
+    return {"event": "BetPlaced", "market_id": int(log["topics"][1], 16),
+            "option": _word(data, 0), "amount": _word(data, 1), "shares": _word(data, 2)}
+
+def _decode_market_resolved(log: Dict) -> Dict:
+    # MarketResolved(uint256 indexed marketId, uint8 outcome, address indexed resolver, int64 finalPrice)
+    data = log["data"]
+    return {"event": "MarketResolved", "market_id": int(log["topics"][1], 16),
+            "outcome": _word(data, 0), "final_price": _signed(_word(data, 1))}
+
+# keccak256 of each event signature: topic 0 of its logs
+EVENT_TOPICS = {
+    "MarketCreated": "0x06d87b89e7940705d41ad9741832374ef202320451e21252ed0a64e963891e3d",   # MarketCreated(uint256,string,address,uint8)
+    "BetPlaced": "0x98e7481db8a6cc6adbae9aec2dc338aebaccd5a3682101773363c6ead7da40f6",       # BetPlaced(uint256,address,address,uint8,uint256,uint256)
+    "MarketResolved": "0x9442ed846035aa12e2c3f55f06fd449bd0c83d5ccf21cf4073088f85bc591eaa",  # MarketResolved(uint256,uint8,address,int64)
+}
+
+# Topic 0 -> decoder of the logs of that event
+EVENT_DECODERS: Dict[str, Callable[[Dict], Dict]] = {
+    EVENT_TOPICS["MarketCreated"]: _decode_market_created,
+    EVENT_TOPICS["BetPlaced"]: _decode_bet_placed,
+    EVENT_TOPICS["MarketResolved"]: _decode_market_resolved,
+}
+
+def decode_log(log: Dict) -> Optional[Dict]:
+    """A market event for MarketStateCache.apply from an eth_getLogs entry, or None for other events"""
+
+    topics = log.get("topics")
+    decoder = EVENT_DECODERS.get(topics[0].lower()) if topics else None
+    if decoder is None or log.get("removed"):
+        return None
+    event = decoder(log)
+    event["block_number"] = int(log["blockNumber"], 16)
+    event["log_index"] = int(log["logIndex"], 16)
+    return event
+
+class LogIngester:
+    """Brings a contract's markets in a MarketStateCache up to date from its event logs
+
+    ingest() covers the blocks from the cache's cursor (or start_block) to
+    `confirmations` blocks behind the head, in eth_getLogs ranges of
+    range_blocks, but at most max_blocks of them per call (None for no
+    limit): a fresh deployment catches up over several calls instead of
+    backfilling the contract's whole history in one. Up to `concurrency` ranges are fetched at once, but they
+    are applied to the cache in block order and the cursor moves only past
+    complete ranges, so an interrupted ingest resumes where it stopped.
+
+    Range sizes adapt to the node: a range it refuses as too large is split
+    in half and retried, and the half becomes the widest range requested.
+    Ranges already in flight when that happens are split into pieces of the
+    new width if they are refused too. After LOG_GROW_AFTER accepted ranges
+    in a row the width doubles again, up to range_blocks, so one busy
+    stretch of the chain does not shrink every later request.
+
+    Rate limits are not range errors: a throttled request is retried after
+    a backoff that doubles each time (retries times, from backoff seconds),
+    without splitting anything.
+
+    session is a callable returning the aiohttp session to post with, such
+    as DirectRPCDataFetcher.session.
+    """
+
+    def __init__(self, session: Callable, endpoint: str, address: str, cache: MarketStateCache,
+                 start_block: int = LOG_START_BLOCK, range_blocks: int = LOG_RANGE_BLOCKS,
+                 concurrency: int = LOG_CONCURRENCY, confirmations: int = LOG_CONFIRMATIONS,
+                 max_blocks: Optional[int] = LOG_MAX_BLOCKS, retries: int = LOG_RETRIES,
+                 backoff: float = LOG_BACKOFF):
+        self.session = session
+        self.endpoint = endpoint
+        self.address = address
+        self.cache = cache
+        self.start_block = start_block
+        self.range_blocks = range_blocks
+        self.max_range_blocks = range_blocks
+        self.concurrency = concurrency
+        self.confirmations = confirmations
+        self.max_blocks = max_blocks
+        self.retries = retries
+        self.backoff = backoff
+        self._accepted = 0
+        self.behind = 0
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def rpc(self, method: str, params: List):
+        """The result of one JSON-RPC call; raises JSONRPCError for an error response
+
+        A rate-limited call is retried with exponential backoff; the wait
+        happens outside the concurrency limit.
+        """
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        for attempt in itertools.count():
+            try:
+                return await self._call(method, params)
+            except JSONRPCError as e:
+                if not e.rate_limited or attempt >= self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def _call(self, method: str, params: List):
+        request = {"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": params}
+        async with self._semaphore:
+            self.requests += 1
+            async with self.session().post(self.endpoint, json=request) as response:
+                if response.status == HTTP_TOO_MANY_REQUESTS:
+                    raise JSONRPCError(HTTP_TOO_MANY_REQUESTS, "Too many requests")
+                response.raise_for_status()
+                reply = await response.json()
+        if reply.get("error"):
+            raise JSONRPCError(reply["error"].get("code", 0), reply["error"].get("message", ""))
+        return reply["result"]
+
+    async def get_logs(self, from_block: int, to_block: int) -> List[Dict]:
+        """The contract's market event logs in a block range, splitting it while the node refuses it"""
+
+        try:
+            logs = await self.rpc("eth_getLogs", [{
+                "address": self.address,
+                "fromBlock": hex(from_block),
+                "toBlock": hex(to_block),
+                "topics": [list(EVENT_DECODERS)]
+            }])
+        except JSONRPCError as e:
+            if not e.range_too_large or from_block == to_block:
+                raise
+            blocks = to_block - from_block + 1
+            if blocks <= self.range_blocks:
+                self.range_blocks = (blocks + 1) // 2
+            self._accepted = 0
+            parts = await asyncio.gather(*(
+                self.get_logs(start, min(to_block, start + self.range_blocks - 1))
+                for start in range(from_block, to_block + 1, self.range_blocks)))
+            return [log for part in parts for log in part]
+
+        # Probe wider ranges again once the current width has been accepted for a while
+        self._accepted += 1
+        if self._accepted >= LOG_GROW_AFTER and self.range_blocks < self.max_range_blocks:
+            self.range_blocks = min(self.max_range_blocks, 2 * self.range_blocks)
+            self._accepted = 0
+        return logs
+
+    async def ingest(self) -> int:
+        """Apply new confirmed market events to the cache; returns how many were applied
+
+        Afterwards `behind` is the number of confirmed blocks left for later calls.
+        """
+
+        confirmed = int(await self.rpc("eth_blockNumber", []), 16) - self.confirmations
+        cursor = self.cache.cursor(self.address)
+        next_block = self.start_block if cursor is None else cursor + 1
+        head = confirmed if self.max_blocks is None else min(confirmed, next_block + self.max_blocks - 1)
+        self.behind = confirmed - head
+        pending = deque()
+        applied = 0
+
+        try:
+            while pending or next_block <= head:
+                # Keep the pipeline full: the next ranges are sized from what the node has accepted so far
+                while next_block <= head and len(pending) < 2 * self.concurrency:
+                    to_block = min(head, next_block + self.range_blocks - 1)
+                    pending.append((to_block, asyncio.ensure_future(self.get_logs(next_block, to_block))))
+                    next_block = to_block + 1
+
+                to_block, task = pending.popleft()
+                logs = await task
+                logs.sort(key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)))
+                applied += self.cache.apply(self.address, filter(None, map(decode_log, logs)))
+                self.cache.advance(self.address, to_block)
+        finally:
+            for _, task in pending:
+                task.cancel()
+            await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+            self.cache.save()
+        return applied
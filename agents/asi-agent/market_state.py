@@ -0,0 +1,211 @@
+"""
+Market state for the ChimeraProtocol agent
+Keeps each contract's markets current by applying only new contract events
+"""
+
+import os
+import json
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+@dataclass
+class MarketData:
+    """Market data structure"""
+    id: int
+    title: str
+    total_pool: int
+    option_a_shares: int
+    option_b_shares: int
+    end_time: datetime
+    market_type: str
+    status: str
+    outcome: Optional[int] = None
+
+# MarketType enum of ChimeraProtocol.sol, by value
+MARKET_TYPES = ("price_direction", "custom_event")
+
+# Bump when the layout of the state file changes; files in another format are ignored
+MARKET_STATE_FORMAT = 1
+
+def new_market(market_id: int, title: Optional[str] = None, market_type: str = "binary") -> MarketData:
+    """An active market with no bets yet"""
+
+    return MarketData(
+        id=market_id,
+        title=title or f"Market {market_id}",
+        total_pool=0,  # Will be calculated from bets
+        option_a_shares=0,
+        option_b_shares=0,
+        end_time=datetime.fromtimestamp(time.time() + 86400),  # 24h from now
+        market_type=market_type,
+        status="active"
+    )
+
+class MarketStateCache:
+    """Markets of each contract, brought up to date with only the events since the last processed block
+
+    An event is a dict naming the contract event ("MarketCreated", "BetPlaced"
+    or "MarketResolved"), its position (block_number, log_index), the
+    market_id and the event's own fields (title/market_type, option/amount/
+    shares, outcome). apply() folds events into the MarketData of the markets
+    they name and moves the contract's cursor to the last one. Events at or
+    before the cursor were applied by an earlier call and are skipped, so a
+    refresh costs in proportion to new activity rather than to the
+    contract's history. Markets changed since the last take_changed() are
+    remembered so an analysis round can look at only those; mark_changed()
+    puts back the ones a round could not finish.
+
+    With a path, every contract's cursor and markets are kept in a JSON file
+    between runs; save() writes it.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.contracts: Dict[str, Dict] = {}
+        self._changed: Dict[str, Dict[int, MarketData]] = {}
+        if path and os.path.exists(path):
+            self.load()
+
+    def contract(self, address: str) -> Dict:
+        """The state of one contract: its cursor, the timestamp of its block and its markets by id"""
+
+        return self.contracts.setdefault(address.lower(), {
+            "block_number": None,
+            "log_index": None,
+            "timestamp": None,
+            "markets": {}
+        })
+
+    def cursor(self, address: str) -> Optional[int]:
+        """The last block whose events have been applied for a contract, or None before the first"""
+
+        return self.contract(address)["block_number"]
+
+    def markets(self, address: str) -> List[MarketData]:
+        """Every known market of a contract, newest first"""
+
+        return list(reversed(self.contract(address)["markets"].values()))
+
+    def apply(self, address: str, events: Iterable[Dict]) -> int:
+        """Fold events, in chain order, into a contract's markets; returns how many were new"""
+
+        state = self.contract(address)
+        markets = state["markets"]
+        changed = self._changed.setdefault(address.lower(), {})
+        cursor = None
+        if state["block_number"] is not None:
+            # A cursor without a log index covers its whole block
+            cursor = (state["block_number"], state["log_index"] if state["log_index"] is not None else float("inf"))
+        applied = 0
+        last = cursor
+
+        for event in events:
+            position = (event["block_number"], event.get("log_index", 0))
+            if cursor is not None and position <= cursor:
+                continue
+            last = position
+            applied += 1
+
+            market_id = event["market_id"]
+            market = markets.get(market_id)
+            if market is None:
+                # Markets created before the first processed block are known only from their later events
+                market = markets[market_id] = new_market(market_id)
+
+            kind = event["event"]
+            if kind == "MarketCreated":
+                if event.get("title"):
+                    market.title = event["title"]
+                market_type = event.get("market_type")
+                if isinstance(market_type, int) and market_type < len(MARKET_TYPES):
+                    market.market_type = MARKET_TYPES[market_type]
+            elif kind == "BetPlaced":
+                if event["option"] == 0:
+                    market.option_a_shares += event["shares"]
+                else:
+                    market.option_b_shares += event["shares"]
+                market.total_pool += event["amount"]
+            elif kind == "MarketResolved":
+                market.status = "resolved"
+                market.outcome = event["outcome"]
+            changed.pop(market_id, None)
+            changed[market_id] = market
+
+            if event.get("timestamp") is not None:
+                state["timestamp"] = event["timestamp"]
+
+        if applied:
+            state["block_number"], state["log_index"] = last
+        return applied
+
+    def advance(self, address: str, block_number: int, timestamp=None):
+        """Record that every event of a contract up to block_number has been applied"""
+
+        state = self.contract(address)
+        if state["block_number"] is None or block_number > state["block_number"]:
+            state["block_number"], state["log_index"] = block_number, None
+            if timestamp is not None:
+                state["timestamp"] = timestamp
+
+    def take_changed(self, address: str) -> List[MarketData]:
+        """Markets of a contract changed since the last call, most recently changed first"""
+
+        return list(reversed(self._changed.pop(address.lower(), {}).values()))
+
+    def mark_changed(self, address: str, markets: Iterable[MarketData]):
+        """Hand taken markets to the next take_changed() again, after those changed since"""
+
+        changed = self._changed.get(address.lower(), {})
+        requeued = {market.id: market for market in markets if market.id not in changed}
+        requeued.update(changed)
+        self._changed[address.lower()] = requeued
+
+    def load(self):
+        """Replace the state with the contents of the JSON file"""
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read market state {self.path}: {e}")
+            return
+        if data.get("format") != MARKET_STATE_FORMAT:
+            return
+
+        self.contracts = {}
+        for address, state in data["contracts"].items():
+            markets = {}
+            for fields in state["markets"]:
+                fields["end_time"] = datetime.fromisoformat(fields["end_time"])
+                markets[fields["id"]] = MarketData(**fields)
+            self.contracts[address] = dict(state, markets=markets)
+
+    def save(self) -> bool:
+        """Write every contract's state to the JSON file, if there is one"""
+
+        if not self.path:
+            return False
+        contracts = {}
+        for address, state in self.contracts.items():
+            markets = []
+            for market in state["markets"].values():
+                fields = asdict(market)
+                fields["end_time"] = market.end_time.isoformat()
+                markets.append(fields)
+            contracts[address] = dict(state, markets=markets)
+
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump({"format": MARKET_STATE_FORMAT, "contracts": contracts}, f)
+            os.replace(temp_path, self.path)
+            return True
+        except OSError as e:
+            print(f"Could not write market state {self.path}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False
@@ -4,11 +4,35 @@ Based on SingularityNET MeTTa examples and symbolic reasoning
 """
 
 import re
+import gc
+import os
+import sys
 import json
-from typing import Dict, List, Any, Optional, Union
-from dataclasses import dataclass
+import math
+import mmap
+import struct
+import hashlib
+import marshal
+import functools
+import itertools
+import operator
+import threading
+import contextlib
+import time
+from array import array
+from concurrent.futures import Executor, ProcessPoolExecutor
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Any, Iterable, Iterator, NamedTuple, Optional, TextIO, Tuple, Union
 from enum import Enum
 
+# NumPy enables vectorized batch analysis; without it batches are analyzed one market at a time
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
 class MeTTaType(Enum):
     """MeTTa data types"""
     ATOM = "atom"
@@ -17,11 +41,29 @@ class MeTTaType(Enum):
     EXPRESSION = "expression"
     VARIABLE = "variable"
 
-@dataclass
 class MeTTaAtom:
-    """MeTTa atomic value"""
-    value: Any
-    type: MeTTaType
+    """MeTTa atomic value
+    
+    Atoms are immutable and hashable. The parser shares one object per
+    distinct token within a load and interns symbol names, so equal symbols
+    usually compare by identity.
+    """
+    
+    __slots__ = ('value', 'type')
+    
+    def __init__(self, value: Any, type: MeTTaType):
+        self.value = value
+        self.type = type
+    
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if other.__class__ is not MeTTaAtom:
+            return NotImplemented
+        return self.type is other.type and self.value == other.value
+    
+    def __hash__(self):
+        return hash((self.type._value_, self.value))
     
     def __str__(self):
         return str(self.value)
@@ -29,26 +71,373 @@ class MeTTaAtom:
     def __repr__(self):
         return f"MeTTaAtom({self.value}, {self.type})"
 
-@dataclass
 class MeTTaExpression:
-    """MeTTa expression (list of atoms)"""
-    atoms: List[Union[MeTTaAtom, 'MeTTaExpression']]
+    """MeTTa expression (tuple of atoms)
+    
+    Expressions are immutable and hashable, so identical subexpressions can
+    be shared (hash-consed) by the parser and the snapshot loader. The hash
+    is computed on first use and cached.
+    """
+    
+    __slots__ = ('atoms', '_hash')
+    
+    def __init__(self, atoms: Iterable[Union[MeTTaAtom, 'MeTTaExpression']]):
+        self.atoms = atoms if atoms.__class__ is tuple else tuple(atoms)
+        self._hash = None
+    
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if other.__class__ is not MeTTaExpression:
+            return NotImplemented
+        return hash(self) == hash(other) and self.atoms == other.atoms
+    
+    def __hash__(self):
+        if self._hash is None:
+            # Hash uncached subexpressions bottom-up so deep nesting does not recurse
+            pending = [self]
+            while pending:
+                expr = pending[-1]
+                children = [atom for atom in expr.atoms if atom.__class__ is MeTTaExpression and atom._hash is None]
+                if children:
+                    pending.extend(children)
+                else:
+                    expr._hash = hash(expr.atoms)
+                    pending.pop()
+        return self._hash
     
     def __str__(self):
-        return f"({' '.join(str(atom) for atom in self.atoms)})"
+        parts = []
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if item.__class__ is str:
+                parts.append(item)
+                continue
+            if parts and parts[-1] != '(':
+                parts.append(' ')
+            if item.__class__ is MeTTaExpression:
+                parts.append('(')
+                stack.append(')')
+                stack.extend(reversed(item.atoms))
+            else:
+                parts.append(str(item))
+        return ''.join(parts)
     
     def __repr__(self):
-        return f"MeTTaExpression({self.atoms})"
+        return f"MeTTaExpression({list(self.atoms)})"
+
+class MeTTaSyntaxError(ValueError):
+    """Raised when MeTTa source text cannot be parsed"""
+    
+    def __init__(self, message: str, line: int, column: int):
+        super().__init__(f"{message} at line {line}, column {column}")
+        self.line = line
+        self.column = column
+
+class MeTTaBudgetExceeded(RuntimeError):
+    """Raised when an evaluation runs past its step budget, depth limit or deadline"""
+    
+    def __init__(self, reason: str, budget: 'EvaluationBudget'):
+        super().__init__(f"MeTTa evaluation exceeded its {reason} "
+                         f"({budget.steps} steps, depth {budget.max_depth_reached}, {budget.elapsed() * 1000:.1f} ms)")
+        self.reason = reason
+        self.info = budget.info()
+
+class MeTTaToken(NamedTuple):
+    """Lexical token produced by MeTTaParser.tokenize"""
+    kind: str
+    text: str
+    line: int
+    column: int
+
+# Matches one token (or comment) at a time; whitespace between matches is skipped.
+# A lone '"' is only matched by the final catch-all, i.e. an unterminated string.
+_TOKEN_PATTERN = re.compile(r'[()]|"(?:[^"\\]|\\.)*"|;[^\n]*|[^\s()";]+|\S')
+
+# Token kind by first character; anything else is a symbol
+_TOKEN_KINDS = {'(': 'open', ')': 'close', '"': 'string', ';': 'comment'}
+
+_STRING_ESCAPE = re.compile(r'\\(.)', re.DOTALL)
+
+# Hash-consing tables are reset after a top-level form once they hold this many expressions
+_SHARING_LIMIT = 1 << 16
+
+# Characters that can begin a literal accepted by int()/float()
+_NUMBER_START = frozenset('0123456789+-. \t\n')
 
 class MeTTaParser:
-    """Parser for MeTTa expressions"""
+    """Parser for MeTTa expressions
     
-    def __init__(self):
+    The default "single-pass" mode tokenizes the source once and builds the
+    tree with an explicit stack, so parsing is linear in the input size and
+    nesting depth is not limited by Python's recursion limit. The original
+    substring-splitting parser is kept as "legacy" mode for comparison.
+    """
+    
+    MODES = ("single-pass", "legacy")
+    
+    def __init__(self, mode: str = "single-pass"):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown parser mode: {mode}")
+        self.mode = mode
         self.variables = {}
     
     def parse(self, text: str) -> Union[MeTTaAtom, MeTTaExpression]:
         """Parse MeTTa text into atoms/expressions"""
         
+        if self.mode == "legacy":
+            return self._parse_legacy(text)
+        
+        forms = self.parse_all(text)
+        if len(forms) != 1:
+            raise MeTTaSyntaxError(f"Expected a single expression, found {len(forms)}", 1, 1)
+        return forms[0]
+    
+    def parse_all(self, text: str) -> List[Union[MeTTaAtom, MeTTaExpression]]:
+        """Parse every top-level form in MeTTa source text"""
+        
+        return list(self.iter_forms(text))
+    
+    def tokenize(self, text: str) -> Iterator[MeTTaToken]:
+        """Split MeTTa source into tokens, skipping whitespace and comments"""
+        
+        line = 1
+        line_start = 0
+        scanned = 0
+        
+        for match in _TOKEN_PATTERN.finditer(text):
+            token = match.group()
+            kind = _TOKEN_KINDS.get(token[0], 'symbol')
+            if kind == 'comment':
+                continue
+            
+            start = match.start()
+            newlines = text.count('\n', scanned, start)
+            if newlines:
+                line += newlines
+                line_start = text.rindex('\n', scanned, start) + 1
+            scanned = start
+            
+            if token == '"':
+                raise MeTTaSyntaxError("Unterminated string", line, start - line_start + 1)
+            
+            yield MeTTaToken(kind, token, line, start - line_start + 1)
+    
+    def iter_forms(self, text: str) -> Iterator[Union[MeTTaAtom, MeTTaExpression]]:
+        """Yield top-level forms one at a time while scanning the source once"""
+        
+        return self._iter_batches([(text, _TOKEN_PATTERN.findall(text), 1, 1)])
+    
+    def iter_stream(self, stream: TextIO, chunk_size: int = 1 << 20) -> Iterator[Union[MeTTaAtom, MeTTaExpression]]:
+        """Yield top-level forms from a text stream, reading it chunk_size characters at a time
+        
+        Memory use is bounded by the chunk size and the largest single form,
+        not by the size of the source, so arbitrarily large files can be
+        loaded as long as the caller does not keep every form.
+        """
+        
+        return self._iter_batches(self._stream_batches(stream, chunk_size))
+    
+    @staticmethod
+    def _stream_batches(stream: TextIO, chunk_size: int) -> Iterator[Tuple[str, List[str], int, int]]:
+        """Split a stream into (text, tokens, line, column) batches that end on a token boundary
+        
+        Only string literals and comments can contain whitespace, so each
+        batch ends after the last whitespace read so far, or at the start of
+        a string or comment that is still open there. Only the newest chunk
+        is searched for that whitespace, and a batch held back by an open
+        string or comment is not tried again until a chunk could close it,
+        so the stream is scanned in linear time whether or not it has
+        newlines.
+        """
+        
+        pending = []
+        closer = None
+        line = column = 1
+        while True:
+            chunk = stream.read(chunk_size)
+            at_end = not chunk
+            
+            if at_end:
+                cut = None
+            else:
+                cut = max(chunk.rfind(space) for space in ' \n\t\r') + 1
+                if cut == 0 or closer is not None and closer not in chunk:
+                    pending.append(chunk)
+                    continue
+            
+            text = ''.join(pending) + chunk[:cut]
+            rest = chunk[cut:] if cut is not None else ''
+            tokens = _TOKEN_PATTERN.findall(text)
+            closer = None
+            
+            if not at_end and tokens:
+                # A lone '"' token is a string that may be closed by a later chunk
+                if '"' in tokens:
+                    closer = '"'
+                    for match in _TOKEN_PATTERN.finditer(text):
+                        if match.group() == '"':
+                            start = match.start()
+                            break
+                # A comment running to the end of the text may go on in the next chunk
+                elif tokens[-1][0] == ';' and text.endswith(tokens[-1]):
+                    closer = '\n'
+                    start = len(text) - len(tokens[-1])
+                if closer is not None:
+                    text, rest = text[:start], text[start:] + rest
+                    tokens = _TOKEN_PATTERN.findall(text)
+            
+            if text:
+                yield text, tokens, line, column
+                newlines = text.count('\n')
+                if newlines:
+                    line += newlines
+                    column = len(text) - text.rfind('\n')
+                else:
+                    column += len(text)
+            
+            pending = [rest] if rest else []
+            if at_end:
+                return
+    
+    def _iter_batches(self, batches: Iterable[Tuple[str, List[str], int, int]]) -> Iterator[Union[MeTTaAtom, MeTTaExpression]]:
+        """Build forms from consecutive token batches; a form may span batches
+        
+        Each batch is (text, tokens of text, line, column), where line and
+        column locate the start of text in the whole source for error
+        messages.
+        """
+        
+        # Each stack entry is (atoms of the enclosing expression, index of the open '(' token, its batch)
+        stack = []
+        atoms = None
+        parse_atom = self._parse_atom
+        
+        # Hash-consing: one atom per distinct token, and one expression per distinct list of
+        # children. Children are already shared, so their ids identify them structurally.
+        # The tables are reset between forms once they grow large, to bound memory on big sources.
+        shared_atoms = {}
+        shared_expressions = {}
+        
+        for batch in batches:
+            text, tokens, _, _ = batch
+            for index, token in enumerate(tokens):
+                first = token[0]
+                
+                if first == '(':
+                    stack.append((atoms, index, batch))
+                    atoms = []
+                    continue
+                elif first == ')':
+                    if not stack:
+                        self._raise_syntax_error("Unexpected ')'", batch, index)
+                    key = tuple(map(id, atoms))
+                    node = shared_expressions.get(key)
+                    if node is None:
+                        node = shared_expressions[key] = MeTTaExpression(atoms)
+                    atoms = stack.pop()[0]
+                elif first == ';':
+                    continue
+                else:
+                    node = shared_atoms.get(token)
+                    if node is None:
+                        if first == '"':
+                            if token == '"':
+                                self._raise_syntax_error("Unterminated string", batch, index)
+                            node = MeTTaAtom(_STRING_ESCAPE.sub(r'\1', token[1:-1]), MeTTaType.STRING)
+                        else:
+                            node = parse_atom(token)
+                        shared_atoms[token] = node
+                
+                if atoms is None:
+                    yield node
+                    if len(shared_expressions) > _SHARING_LIMIT:
+                        shared_atoms.clear()
+                        shared_expressions.clear()
+                else:
+                    atoms.append(node)
+        
+        if stack:
+            _, index, batch = stack[-1]
+            self._raise_syntax_error("Unclosed '('", batch, index)
+    
+    def split_forms(self, text: str) -> List[Tuple[str, bool]]:
+        """Canonical source of each top-level form, and whether it is an (= head body) rule
+        
+        The canonical source is the form's tokens joined by single spaces,
+        with comments dropped. Two forms parse to equal values exactly when
+        their canonical sources are equal, so these strings can be used to
+        diff MeTTa sources without parsing them.
+        """
+        
+        forms = []
+        tokens = []
+        depth = 0
+        opened = 0
+        elements = 0
+        
+        for index, token in enumerate(_TOKEN_PATTERN.findall(text)):
+            first = token[0]
+            if first == ';':
+                continue
+            if first == '(':
+                if depth == 0:
+                    opened = index
+                    elements = 0
+                elif depth == 1:
+                    elements += 1
+                depth += 1
+            elif first == ')':
+                if depth == 0:
+                    self._raise_syntax_error("Unexpected ')'", text, index)
+                depth -= 1
+            else:
+                if token == '"':
+                    self._raise_syntax_error("Unterminated string", text, index)
+                if depth == 1:
+                    elements += 1
+            tokens.append(token)
+            
+            if depth == 0:
+                is_rule = (first == ')' and elements == 3 and tokens[1] in ('=', '"="'))
+                forms.append((' '.join(tokens), is_rule))
+                tokens = []
+        
+        if depth:
+            self._raise_syntax_error("Unclosed '('", text, opened)
+        return forms
+    
+    @staticmethod
+    def _raise_syntax_error(message: str, source: Union[str, tuple], token_index: int):
+        """Raise MeTTaSyntaxError at the line/column of the n-th token
+        
+        source is either the whole text or a (text, tokens, line, column)
+        batch. Positions are only recovered here, on the error path, so the
+        fast path never has to track offsets.
+        """
+        
+        if isinstance(source, str):
+            text, start_line, start_column = source, 1, 1
+        else:
+            text, _, start_line, start_column = source
+        
+        for index, match in enumerate(_TOKEN_PATTERN.finditer(text)):
+            if index == token_index:
+                offset = match.start()
+                break
+        else:
+            offset = len(text)
+        
+        newlines = text.count('\n', 0, offset)
+        column = offset - (text.rfind('\n', 0, offset) + 1) + 1
+        if not newlines:
+            column += start_column - 1
+        raise MeTTaSyntaxError(message, start_line + newlines, column)
+    
+    def _parse_legacy(self, text: str) -> Union[MeTTaAtom, MeTTaExpression]:
+        """Parse using the original substring-splitting parser"""
+        
         text = text.strip()
         
         if text.startswith('(') and text.endswith(')'):
@@ -59,7 +448,7 @@ class MeTTaParser:
             return self._parse_atom(text)
     
     def _parse_expression(self, text: str) -> MeTTaExpression:
-        """Parse expression content"""
+        """Parse expression content (legacy mode)"""
         
         atoms = []
         current = ""
@@ -81,13 +470,13 @@ class MeTTaParser:
                 current += char
             elif char == ' ' and paren_count == 0 and not in_string:
                 if current.strip():
-                    atoms.append(self.parse(current.strip()))
+                    atoms.append(self._parse_legacy(current.strip()))
                 current = ""
             else:
                 current += char
         
         if current.strip():
-            atoms.append(self.parse(current.strip()))
+            atoms.append(self._parse_legacy(current.strip()))
         
         return MeTTaExpression(atoms)
     
@@ -96,38 +485,353 @@ class MeTTaParser:
         
         # Variable (starts with $)
         if text.startswith('$'):
-            return MeTTaAtom(text, MeTTaType.VARIABLE)
+            return MeTTaAtom(sys.intern(text), MeTTaType.VARIABLE)
         
         # String (quoted)
         if text.startswith('"') and text.endswith('"'):
             return MeTTaAtom(text[1:-1], MeTTaType.STRING)
         
-        # Number
-        try:
-            if '.' in text:
-                return MeTTaAtom(float(text), MeTTaType.NUMBER)
-            else:
-                return MeTTaAtom(int(text), MeTTaType.NUMBER)
-        except ValueError:
-            pass
+        # Number (only attempted when the text could start a numeric literal)
+        if text and text[0] in _NUMBER_START:
+            try:
+                if '.' in text:
+                    return MeTTaAtom(float(text), MeTTaType.NUMBER)
+                else:
+                    return MeTTaAtom(int(text), MeTTaType.NUMBER)
+            except ValueError:
+                pass
         
         # Atom
-        return MeTTaAtom(text, MeTTaType.ATOM)
+        return MeTTaAtom(sys.intern(text), MeTTaType.ATOM)
+
+IndexKey = Tuple[Any, int]
+
+# Suffix of the first-argument bucket holding facts whose first argument is a variable
+_VARIABLE_ARG = (MeTTaType.VARIABLE,)
+
+def _index_key(form: Union[MeTTaAtom, MeTTaExpression]) -> IndexKey:
+    """(head symbol, arity) of a form; bare atoms index as arity 0"""
+    
+    if isinstance(form, MeTTaAtom):
+        return (form.value, 0)
+    if form.atoms and isinstance(form.atoms[0], MeTTaAtom):
+        return (form.atoms[0].value, len(form.atoms) - 1)
+    return (None, len(form.atoms) - 1)
+
+def _is_variable(atom: Union[MeTTaAtom, MeTTaExpression]) -> bool:
+    return isinstance(atom, MeTTaAtom) and atom.type == MeTTaType.VARIABLE
+
+def _pattern_matches(pattern: Union[MeTTaAtom, MeTTaExpression],
+                     atom: Union[MeTTaAtom, MeTTaExpression], bindings: Dict) -> bool:
+    """One-sided match: $variables in the pattern bind consistently to sub-atoms"""
+    
+    if isinstance(pattern, MeTTaAtom):
+        if pattern.type == MeTTaType.VARIABLE:
+            if pattern.value in bindings:
+                return bindings[pattern.value] == atom
+            bindings[pattern.value] = atom
+            return True
+        return pattern == atom
+    
+    if not isinstance(atom, MeTTaExpression) or len(pattern.atoms) != len(atom.atoms):
+        return False
+    return all(_pattern_matches(p, a, bindings) for p, a in zip(pattern.atoms, atom.atoms))
+
+def _rule_head(rule: Union[MeTTaAtom, MeTTaExpression]) -> Optional[str]:
+    """Function name defined by an (= (name ...) body) rule"""
+    
+    if not MeTTaKnowledgeBase._is_rule(rule):
+        return None
+    head = rule.atoms[1]
+    if isinstance(head, MeTTaExpression) and head.atoms and isinstance(head.atoms[0], MeTTaAtom):
+        return head.atoms[0].value
+    return None
+
+def _called_heads(expr: Union[MeTTaAtom, MeTTaExpression]) -> set:
+    """Symbols in head position anywhere in an expression, i.e. everything it may call"""
+    
+    heads = set()
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, MeTTaExpression) and node.atoms:
+            first = node.atoms[0]
+            if isinstance(first, MeTTaAtom) and first.type == MeTTaType.ATOM:
+                heads.add(first.value)
+            stack.extend(node.atoms)
+    return heads
+
+def _walk(term: Union[MeTTaAtom, MeTTaExpression], side: int, bindings: Dict) -> Tuple[Any, int]:
+    """Follow variable bindings until reaching an unbound variable or a non-variable"""
+    
+    while isinstance(term, MeTTaAtom) and term.type == MeTTaType.VARIABLE:
+        bound = bindings.get((side, term.value))
+        if bound is None:
+            break
+        term, side = bound
+    return term, side
+
+def _occurs(variable: tuple, term: Union[MeTTaAtom, MeTTaExpression], side: int, bindings: Dict) -> bool:
+    """Whether a (side, name) variable occurs in a term, looking through bindings"""
+    
+    pending = [(term, side)]
+    while pending:
+        node, node_side = _walk(*pending.pop(), bindings)
+        if isinstance(node, MeTTaExpression):
+            pending.extend((atom, node_side) for atom in node.atoms)
+        elif node.type == MeTTaType.VARIABLE and (node_side, node.value) == variable:
+            return True
+    return False
+
+def _unify(left: Union[MeTTaAtom, MeTTaExpression], left_side: int,
+           right: Union[MeTTaAtom, MeTTaExpression], right_side: int, bindings: Dict) -> bool:
+    """Unify two terms, extending bindings in place
+    
+    Variables are keyed by (side, name), so the two terms' variables are
+    distinct even when they share a name. Bindings map a variable to a
+    (term, side) pair and are resolved lazily by _walk.
+    """
+    
+    pending = [(left, left_side, right, right_side)]
+    while pending:
+        a, a_side, b, b_side = pending.pop()
+        a, a_side = _walk(a, a_side, bindings)
+        b, b_side = _walk(b, b_side, bindings)
+        if a is b and a_side == b_side:
+            continue
+        
+        if isinstance(a, MeTTaAtom) and a.type == MeTTaType.VARIABLE:
+            a, a_side, b, b_side = b, b_side, a, a_side
+        if isinstance(b, MeTTaAtom) and b.type == MeTTaType.VARIABLE:
+            variable = (b_side, b.value)
+            if isinstance(a, MeTTaAtom) and a.type == MeTTaType.VARIABLE and (a_side, a.value) == variable:
+                continue
+            if isinstance(a, MeTTaExpression) and _occurs(variable, a, a_side, bindings):
+                return False
+            bindings[variable] = (a, a_side)
+            continue
+        
+        if isinstance(a, MeTTaAtom) or isinstance(b, MeTTaAtom):
+            if a != b:
+                return False
+            continue
+        if len(a.atoms) != len(b.atoms):
+            return False
+        pending.extend((x, a_side, y, b_side) for x, y in zip(a.atoms, b.atoms))
+    return True
+
+def _resolve(term: Union[MeTTaAtom, MeTTaExpression], side: int, bindings: Dict) -> Union[MeTTaAtom, MeTTaExpression]:
+    """Substitute bindings throughout a term; unbound variables are left in place"""
+    
+    term, side = _walk(term, side, bindings)
+    if isinstance(term, MeTTaExpression):
+        return MeTTaExpression([_resolve(atom, side, bindings) for atom in term.atoms])
+    return term
+
+def unify(left: Union[MeTTaAtom, MeTTaExpression], right: Union[MeTTaAtom, MeTTaExpression]) -> Optional[Dict[str, Union[MeTTaAtom, MeTTaExpression]]]:
+    """Most general unifier of two forms, as bindings for the left form's $variables
+    
+    Both forms may contain variables; they are kept apart even when they
+    share a name. Returns None when the forms do not unify.
+    """
+    
+    bindings = {}
+    if not _unify(left, 0, right, 1, bindings):
+        return None
+    return {name: _resolve(MeTTaAtom(name, MeTTaType.VARIABLE), 0, bindings)
+            for name in dict.fromkeys(_variables_in(left))}
+
+# Files smaller than this are always loaded serially; process startup would dominate
+PARALLEL_LOAD_MIN_BYTES = 1 << 20
+
+# Processes MeTTaReasoner parses its knowledge-base file with; serial unless METTA_LOAD_WORKERS is above 1
+DEFAULT_LOAD_WORKERS = int(os.environ.get("METTA_LOAD_WORKERS") or 1)
+
+# Binary snapshot layout: magic, format version, sha256 of the sources, then a marshal payload
+SNAPSHOT_MAGIC = b'MTKB'
+SNAPSHOT_FORMAT = 3
+_SNAPSHOT_HEADER = struct.Struct('<4sH32s')
+
+# Forms are stored as a postfix stream of ints. n >= 0 refers to entry n of a table of
+# distinct (type code, value) atoms. A negative item encodes m = -item - 1: an even m
+# closes an expression of the m // 2 items before it, an odd m repeats the (m // 2)-th
+# expression closed so far, so shared subexpressions are stored and rebuilt once.
+_TYPE_CODES = {member: code for code, member in enumerate(MeTTaType)}
+_CODE_TYPES = list(MeTTaType)
+
+def snapshot_hash(*sources: Union[str, bytes, None]) -> bytes:
+    """Digest identifying the source text a snapshot was built from"""
+    
+    digest = hashlib.sha256(b'%d' % SNAPSHOT_FORMAT)
+    for source in sources:
+        if source is None:
+            digest.update(b'\x00missing')
+            continue
+        data = source.encode('utf-8') if isinstance(source, str) else source
+        digest.update(b'\x00%d\x00' % len(data))
+        digest.update(data)
+    return digest.digest()
+
+def _encode_forms(forms: List[Union[MeTTaAtom, MeTTaExpression]], atom_table: Dict[tuple, int],
+                  expression_table: Dict[int, int]) -> bytes:
+    """Flatten forms into the postfix stream, adding new atoms and expressions to the tables
+    
+    expression_table maps id(expression) to its position in close order; it
+    is shared between calls so later streams can refer back to earlier ones.
+    """
+    
+    stream = array('i')
+    stack = [(form, False) for form in reversed(forms)]
+    while stack:
+        form, children_done = stack.pop()
+        if isinstance(form, MeTTaAtom):
+            # The value's class is part of the key so 1 and 1.0 stay distinct atoms
+            key = (_TYPE_CODES[form.type], form.value.__class__, form.value)
+            index = atom_table.get(key)
+            if index is None:
+                index = atom_table[key] = len(atom_table)
+            stream.append(index)
+        elif children_done:
+            expression_table[id(form)] = len(expression_table)
+            stream.append(-2 * len(form.atoms) - 1)
+        else:
+            index = expression_table.get(id(form))
+            if index is not None:
+                stream.append(-2 * index - 2)
+                continue
+            stack.append((form, True))
+            stack.extend((atom, False) for atom in reversed(form.atoms))
+    return stream.tobytes()
+
+def _decode_forms(data: bytes, atoms: List[MeTTaAtom], expressions: List[MeTTaExpression]) -> List[Union[MeTTaAtom, MeTTaExpression]]:
+    """Rebuild forms from the output of _encode_forms, appending new expressions to expressions"""
+    
+    stream = array('i')
+    stream.frombytes(data)
+    stack = []
+    push = stack.append
+    for item in stream:
+        if item >= 0:
+            push(atoms[item])
+            continue
+        marker = -item - 1
+        if marker & 1:
+            push(expressions[marker >> 1])
+            continue
+        count = marker >> 1
+        if count:
+            children = tuple(stack[-count:])
+            del stack[-count:]
+        else:
+            children = ()
+        expression = MeTTaExpression(children)
+        expressions.append(expression)
+        push(expression)
+    return stack
+
+def _decode_atoms(encoded: List[tuple]) -> List[MeTTaAtom]:
+    """Atom table of a snapshot or worker result; symbol names are interned like the parser does"""
+    
+    symbolic = (_TYPE_CODES[MeTTaType.ATOM], _TYPE_CODES[MeTTaType.VARIABLE])
+    return [MeTTaAtom(sys.intern(value) if code in symbolic else value, _CODE_TYPES[code])
+            for code, value in encoded]
+
+def _split_file(filename: str, parts: int) -> List[Tuple[int, int]]:
+    """Byte ranges of roughly equal size, each starting at a line that opens a form
+    
+    A cut can still land inside a multi-line form or string whose next line
+    starts with '('; the chunk before it then fails to parse on its own,
+    which the parallel loader treats as a signal to load serially.
+    """
+    
+    size = os.path.getsize(filename)
+    if size == 0 or parts <= 1:
+        return [(0, size)]
+    
+    bounds = [0]
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for part in range(1, parts):
+            target = max(size * part // parts, bounds[-1])
+            found = mapped.find(b'\n(', target)
+            if found < 0:
+                break
+            if found + 1 > bounds[-1]:
+                bounds.append(found + 1)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+def _parse_file_range(filename: str, start: int, end: int) -> Optional[bytes]:
+    """Worker for parallel loading: parse one byte range and return it snapshot-encoded
+    
+    Returns None if the range does not parse on its own.
+    """
+    
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    
+    try:
+        forms = MeTTaParser().parse_all(text)
+    except MeTTaSyntaxError:
+        return None
+    
+    atom_table = {}
+    stream = _encode_forms(forms, atom_table, {})
+    return marshal.dumps(([(code, value) for code, _, value in atom_table], len(forms), stream))
+
+def _encode_index(index: Dict[tuple, list], positions: Dict[int, int]) -> tuple:
+    """Index buckets as (keys, bucket sizes, concatenated list positions)"""
+    
+    keys = [tuple(_TYPE_CODES[part] if isinstance(part, MeTTaType) else part for part in key) for key in index]
+    sizes = array('i', (len(bucket) for bucket in index.values()))
+    members = array('i', (positions[id(atom)] for bucket in index.values() for atom in bucket))
+    return keys, sizes.tobytes(), members.tobytes()
+
+def _decode_index(encoded: tuple, forms: list, type_position: Optional[int] = None) -> Dict[tuple, list]:
+    keys, sizes, members = encoded
+    sizes = array('i', sizes)
+    members = [forms[i] for i in array('i', members)]
+    
+    index = {}
+    start = 0
+    for key, size in zip(keys, sizes):
+        if type_position is not None:
+            key = key[:type_position] + (_CODE_TYPES[key[type_position]],) + key[type_position + 1:]
+        index[key] = members[start:start + size]
+        start += size
+    return index
 
 class MeTTaKnowledgeBase:
-    """MeTTa knowledge base with rules and facts"""
+    """MeTTa knowledge base with rules and facts
+    
+    Besides the ordered rules/facts lists, every atom is indexed by its
+    (head symbol, arity), and facts additionally by their first argument,
+    so lookups stay proportional to the number of candidates rather than
+    the size of the knowledge base.
+    """
     
     def __init__(self):
         self.rules = []
         self.facts = []
         self.parser = MeTTaParser()
+        # Bumped on every modification so compiled rule tables know when to rebuild
+        self.version = 0
+        # Version at which each function (or 'match', for facts) last changed, so only those are rebuilt
+        self.head_versions: Dict[str, int] = {}
+        # Version of the last change that may touch any function (a snapshot load, an unnamed rule)
+        self.reset_version = 0
+        
+        # Rules are keyed by their head call, e.g. (= (risk-level $v $r) ...) -> ('risk-level', 2)
+        self._rule_index: Dict[IndexKey, List[MeTTaExpression]] = {}
+        self._fact_index: Dict[IndexKey, List[Union[MeTTaAtom, MeTTaExpression]]] = {}
+        self._fact_arg_index: Dict[tuple, List[MeTTaExpression]] = {}
     
     def add_rule(self, rule_text: str):
         """Add a rule to the knowledge base"""
         
         try:
             rule = self.parser.parse(rule_text)
-            self.rules.append(rule)
+            self._add_rule(rule)
         except Exception as e:
             print(f"Error parsing rule: {rule_text} - {e}")
     
@@ -136,343 +840,3036 @@ class MeTTaKnowledgeBase:
         
         try:
             fact = self.parser.parse(fact_text)
-            self.facts.append(fact)
+            self._add_fact(fact)
         except Exception as e:
             print(f"Error parsing fact: {fact_text} - {e}")
     
-    def load_from_file(self, filename: str):
-        """Load rules and facts from MeTTa file"""
+    def add_atom(self, form: Union[MeTTaAtom, MeTTaExpression]):
+        """Add an already-parsed form, classified as a rule or a fact by its head"""
         
-        try:
-            with open(filename, 'r') as f:
-                content = f.read()
-            
-            # Parse MeTTa file
-            lines = content.split('\n')
-            current_rule = ""
-            
-            for line in lines:
-                line = line.strip()
-                
-                # Skip comments and empty lines
-                if not line or line.startswith(';'):
-                    continue
-                
-                # Multi-line rules
-                if line.startswith('(=') or current_rule:
-                    current_rule += " " + line
-                    
-                    # Check if rule is complete
-                    if current_rule.count('(') == current_rule.count(')'):
-                        self.add_rule(current_rule.strip())
-                        current_rule = ""
-                else:
-                    # Single line fact
-                    self.add_fact(line)
-                    
-        except FileNotFoundError:
-            print(f"MeTTa file not found: {filename}")
-        except Exception as e:
-            print(f"Error loading MeTTa file: {e}")
-
-class MeTTaReasoner:
-    """MeTTa reasoning engine"""
+        if self._is_rule(form):
+            self._add_rule(form)
+        else:
+            self._add_fact(form)
     
-    def __init__(self):
-        self.kb = MeTTaKnowledgeBase()
-        self.parser = MeTTaParser()
-        self.bindings = {}
+    def _add_rule(self, rule: Union[MeTTaAtom, MeTTaExpression]):
+        self.rules.append(rule)
+        self._rule_index.setdefault(self._rule_key(rule), []).append(rule)
+        self.version += 1
+        self._touch(_rule_head(rule))
+    
+    def _add_fact(self, fact: Union[MeTTaAtom, MeTTaExpression]):
+        self.facts.append(fact)
+        self._fact_index.setdefault(_index_key(fact), []).append(fact)
         
-        # Load market analysis rules
-        self._load_market_rules()
+        arg_key = self._arg_index_key(fact)
+        if arg_key is not None:
+            self._fact_arg_index.setdefault(arg_key, []).append(fact)
+        self.version += 1
+        # Rules that (match ...) against the facts depend on them like on a function
+        self._touch('match')
     
-    def _load_market_rules(self):
-        """Load built-in market analysis rules"""
-        
-        # Contrarian strategy rules
-        self.kb.add_rule("""
-        (= (contrarian-signal $ratio)
-           (if (> $ratio 0.75) high-contrarian
-               (if (> $ratio 0.65) medium-contrarian
-                   low-contrarian)))
-        """)
-        
-        self.kb.add_rule("""
-        (= (risk-level $volume $ratio)
-           (if (< $volume 1000) high-risk
-               (if (and (> $volume 5000) (< $ratio 0.6) (> $ratio 0.4)) low-risk
-                   medium-risk)))
-        """)
-        
-        self.kb.add_rule("""
-        (= (confidence $ratio $volume)
-           (let $contrarian (contrarian-signal $ratio)
-                $risk (risk-level $volume $ratio)
-                (if (and (== $contrarian high-contrarian) (== $risk low-risk)) 0.9
-                    (if (== $contrarian medium-contrarian) 0.7
-                        0.5))))
-        """)
-        
-        # Betting recommendation rules
-        self.kb.add_rule("""
-        (= (betting-recommendation $ratio $volume)
-           (let $contrarian (contrarian-signal $ratio)
-                (if (== $contrarian high-contrarian)
-                    (if (> $ratio 0.5) BUY_B BUY_A)
-                    HOLD)))
-        """)
+    def _touch(self, head: Optional[str]):
+        """Record that the function named head changed at the current version"""
         
-        # Load from external file if available
-        try:
-            self.kb.load_from_file("metta_knowledge_base.metta")
-        except:
-            pass
+        if head is None:
+            self.reset_version = self.version
+        else:
+            self.head_versions[head] = self.version
     
-    def query(self, query_text: str) -> List[Any]:
-        """Execute MeTTa query"""
+    def changed_heads(self, version: int) -> Optional[set]:
+        """Functions changed since a version, or None if anything may have"""
         
-        try:
-            query = self.parser.parse(query_text)
-            return self._evaluate(query)
-        except Exception as e:
-            print(f"Error executing query: {query_text} - {e}")
-            return []
+        if self.reset_version > version:
+            return None
+        return {head for head, changed in self.head_versions.items() if changed > version}
     
-    def _evaluate(self, expr: Union[MeTTaAtom, MeTTaExpression]) -> List[Any]:
-        """Evaluate MeTTa expression"""
+    def replace_forms(self, old_forms: List[Union[MeTTaAtom, MeTTaExpression]],
+                      new_forms: List[Union[MeTTaAtom, MeTTaExpression]]):
+        """Replace a group of previously added forms (e.g. one file's contents) with new ones
         
-        if isinstance(expr, MeTTaAtom):
-            return [self._evaluate_atom(expr)]
+        The new rules take the place of the first old rule, and the new facts
+        the place of the first old fact, so definition order is kept. Objects
+        present in both lists are left alone; only index buckets touched by
+        removed or added forms are rebuilt. The lists and indexes are built
+        aside and assigned at the end, so concurrent readers see either the
+        old or the new contents.
+        """
         
-        elif isinstance(expr, MeTTaExpression):
-            return self._evaluate_expression(expr)
+        old_ids = {id(form) for form in old_forms}
+        new_ids = {id(form) for form in new_forms}
+        changed = ([form for form in old_forms if id(form) not in new_ids]
+                   + [form for form in new_forms if id(form) not in old_ids])
         
-        return []
-    
-    def _evaluate_atom(self, atom: MeTTaAtom) -> Any:
-        """Evaluate atomic value"""
+        rules = self._splice(self.rules, old_ids, [form for form in new_forms if self._is_rule(form)])
+        facts = self._splice(self.facts, old_ids, [form for form in new_forms if not self._is_rule(form)])
         
-        if atom.type == MeTTaType.VARIABLE:
-            return self.bindings.get(atom.value, atom.value)
-        else:
-            return atom.value
-    
-    def _evaluate_expression(self, expr: MeTTaExpression) -> List[Any]:
-        """Evaluate expression"""
+        rule_keys = {self._rule_key(form) for form in changed if self._is_rule(form)}
+        fact_keys = {_index_key(form) for form in changed if not self._is_rule(form)}
+        arg_keys = {self._arg_index_key(form) for form in changed if not self._is_rule(form)} - {None}
         
-        if not expr.atoms:
-            return []
+        rule_index = {key: bucket for key, bucket in self._rule_index.items() if key not in rule_keys}
+        for rule in rules:
+            key = self._rule_key(rule)
+            if key in rule_keys:
+                rule_index.setdefault(key, []).append(rule)
         
-        # Get function name
-        func_atom = expr.atoms[0]
-        if not isinstance(func_atom, MeTTaAtom):
-            return []
+        fact_index = {key: bucket for key, bucket in self._fact_index.items() if key not in fact_keys}
+        fact_arg_index = {key: bucket for key, bucket in self._fact_arg_index.items() if key not in arg_keys}
+        for fact in facts:
+            key = _index_key(fact)
+            if key in fact_keys:
+                fact_index.setdefault(key, []).append(fact)
+                arg_key = self._arg_index_key(fact)
+                if arg_key in arg_keys:
+                    fact_arg_index.setdefault(arg_key, []).append(fact)
         
-        func_name = func_atom.value
-        args = expr.atoms[1:]
+        self.rules, self.facts = rules, facts
+        self._rule_index, self._fact_index, self._fact_arg_index = rule_index, fact_index, fact_arg_index
+        self.version += 1
+        for form in changed:
+            self._touch(_rule_head(form) if self._is_rule(form) else 'match')
+    
+    @staticmethod
+    def _splice(current: list, old_ids: set, replacement: list) -> list:
+        kept = []
+        position = None
+        for form in current:
+            if id(form) in old_ids:
+                if position is None:
+                    position = len(kept)
+            else:
+                kept.append(form)
+        if position is None:
+            position = len(kept)
+        kept[position:position] = replacement
+        return kept
+    
+    @classmethod
+    def _rule_key(cls, rule: Union[MeTTaAtom, MeTTaExpression]) -> IndexKey:
+        return _index_key(rule.atoms[1]) if cls._is_rule(rule) else _index_key(rule)
+    
+    @staticmethod
+    def _arg_index_key(fact: Union[MeTTaAtom, MeTTaExpression]) -> Optional[tuple]:
+        """First-argument bucket a fact is filed under
         
-        # Built-in functions
-        if func_name == '>':
-            return self._builtin_gt(args)
-        elif func_name == '<':
-            return self._builtin_lt(args)
-        elif func_name == '==':
-            return self._builtin_eq(args)
-        elif func_name == 'and':
-            return self._builtin_and(args)
-        elif func_name == 'or':
-            return self._builtin_or(args)
-        elif func_name == 'if':
-            return self._builtin_if(args)
-        elif func_name == 'let':
-            return self._builtin_let(args)
-        
-        # User-defined functions
-        return self._evaluate_user_function(func_name, args)
-    
-    def _builtin_gt(self, args: List) -> List[bool]:
-        """Greater than comparison"""
-        if len(args) >= 2:
-            val1 = self._get_numeric_value(args[0])
-            val2 = self._get_numeric_value(args[1])
-            return [val1 > val2]
-        return [False]
+        Facts whose first argument is a variable share one bucket per
+        (head, arity), which unification has to search alongside the
+        bucket of the concrete first argument.
+        """
+        
+        if isinstance(fact, MeTTaExpression) and len(fact.atoms) > 1:
+            first = fact.atoms[1]
+            if isinstance(first, MeTTaAtom):
+                if first.type == MeTTaType.VARIABLE:
+                    return _index_key(fact) + _VARIABLE_ARG
+                return _index_key(fact) + (first.type, first.value)
+        return None
     
-    def _builtin_lt(self, args: List) -> List[bool]:
-        """Less than comparison"""
-        if len(args) >= 2:
-            val1 = self._get_numeric_value(args[0])
-            val2 = self._get_numeric_value(args[1])
-            return [val1 < val2]
-        return [False]
+    @staticmethod
+    def _first_arg_key(form: Union[MeTTaAtom, MeTTaExpression]) -> Optional[tuple]:
+        """(type, value) of a ground atomic first argument, if there is one"""
+        
+        if isinstance(form, MeTTaExpression) and len(form.atoms) > 1:
+            first = form.atoms[1]
+            if isinstance(first, MeTTaAtom) and first.type != MeTTaType.VARIABLE:
+                return (first.type, first.value)
+        return None
     
-    def _builtin_eq(self, args: List) -> List[bool]:
-        """Equality comparison"""
-        if len(args) >= 2:
-            val1 = self._evaluate(args[0])[0] if self._evaluate(args[0]) else None
-            val2 = self._evaluate(args[1])[0] if self._evaluate(args[1]) else None
-            return [val1 == val2]
-        return [False]
+    def rules_for(self, head: str, arity: int) -> List[MeTTaExpression]:
+        """Rules whose head call is (head arg1 ... argN), in definition order"""
+        
+        return self._rule_index.get((head, arity), [])
     
-    def _builtin_and(self, args: List) -> List[bool]:
-        """Logical AND"""
-        results = []
-        for arg in args:
-            result = self._evaluate(arg)
-            if not result or not result[0]:
-                return [False]
-            results.extend(result)
-        return [True]
+    def candidates(self, pattern: Union[MeTTaAtom, MeTTaExpression]) -> List[Union[MeTTaAtom, MeTTaExpression]]:
+        """Narrowest indexed bucket that can contain atoms matching the pattern
+        
+        A pattern of the form (= head body) searches the rules; anything else
+        searches the facts. Patterns whose head is a variable cannot use the
+        index and fall back to the full list.
+        """
+        
+        if self._is_rule(pattern):
+            head = pattern.atoms[1]
+            if _is_variable(head) or (isinstance(head, MeTTaExpression) and head.atoms and _is_variable(head.atoms[0])):
+                return self.rules
+            return self._rule_index.get(_index_key(head), [])
+        
+        if _is_variable(pattern):
+            return self.facts + self.rules
+        if isinstance(pattern, MeTTaExpression) and pattern.atoms and _is_variable(pattern.atoms[0]):
+            return self.facts
+        
+        key = _index_key(pattern)
+        first_arg = self._first_arg_key(pattern)
+        if first_arg is not None:
+            return self._fact_arg_index.get(key + first_arg, [])
+        return self._fact_index.get(key, [])
     
-    def _builtin_or(self, args: List) -> List[bool]:
-        """Logical OR"""
-        for arg in args:
-            result = self._evaluate(arg)
-            if result and result[0]:
-                return [True]
-        return [False]
+    def match(self, pattern: Union[MeTTaAtom, MeTTaExpression, str]) -> List[Union[MeTTaAtom, MeTTaExpression]]:
+        """Atoms in the knowledge base matching a pattern with $variables"""
+        
+        if isinstance(pattern, str):
+            pattern = self.parser.parse(pattern)
+        return [atom for atom in self.candidates(pattern) if _pattern_matches(pattern, atom, {})]
     
-    def _builtin_if(self, args: List) -> List[Any]:
-        """Conditional expression"""
-        if len(args) >= 3:
-            condition = self._evaluate(args[0])
-            if condition and condition[0]:
-                return self._evaluate(args[1])
-            else:
-                return self._evaluate(args[2])
-        return []
+    def unify_candidates(self, pattern: Union[MeTTaAtom, MeTTaExpression]) -> Iterator[Union[MeTTaAtom, MeTTaExpression]]:
+        """Atoms that may unify with the pattern
+        
+        Like candidates(), but atoms in the knowledge base can contain
+        variables too, so a concrete first argument in the pattern also
+        has to consider facts whose first argument is a variable; those
+        come after the facts filed under the concrete argument.
+        """
+        
+        if not self._is_rule(pattern) and not _is_variable(pattern):
+            arg_key = self._arg_index_key(pattern)
+            if arg_key is not None and arg_key[2] != MeTTaType.VARIABLE:
+                key = _index_key(pattern)
+                return itertools.chain(self._fact_arg_index.get(arg_key, ()),
+                                       self._fact_arg_index.get(key + _VARIABLE_ARG, ()))
+        return iter(self.candidates(pattern))
     
-    def _builtin_let(self, args: List) -> List[Any]:
-        """Let binding"""
-        if len(args) >= 3:
-            # Simple let implementation
-            var_name = args[0]
-            var_value = self._evaluate(args[1])
-            
-            # Save old binding
-            old_binding = self.bindings.get(var_name, None)
-            
-            # Set new binding
-            if var_value:
-                self.bindings[var_name] = var_value[0]
-            
-            # Evaluate body
-            result = self._evaluate(args[2])
-            
-            # Restore old binding
-            if old_binding is not None:
-                self.bindings[var_name] = old_binding
-            elif var_name in self.bindings:
-                del self.bindings[var_name]
-            
-            return result
-        return []
-    
-    def _evaluate_user_function(self, func_name: str, args: List) -> List[Any]:
-        """Evaluate user-defined function"""
-        
-        # Simple pattern matching for market analysis functions
-        if func_name == 'contrarian-signal':
-            if args:
-                ratio = self._get_numeric_value(args[0])
-                if ratio > 0.75:
-                    return ['high-contrarian']
-                elif ratio > 0.65:
-                    return ['medium-contrarian']
-                else:
-                    return ['low-contrarian']
+    def unify(self, pattern: Union[MeTTaAtom, MeTTaExpression, str]) -> Iterator[Dict[str, Union[MeTTaAtom, MeTTaExpression]]]:
+        """Binding sets for the pattern's $variables, one per unifying atom, produced lazily"""
         
-        elif func_name == 'risk-level':
-            if len(args) >= 2:
-                volume = self._get_numeric_value(args[0])
-                ratio = self._get_numeric_value(args[1])
-                
-                if volume < 1000:
-                    return ['high-risk']
-                elif volume > 5000 and 0.4 < ratio < 0.6:
-                    return ['low-risk']
-                else:
-                    return ['medium-risk']
+        if isinstance(pattern, str):
+            pattern = self.parser.parse(pattern)
         
-        elif func_name == 'betting-recommendation':
-            if len(args) >= 2:
-                ratio = self._get_numeric_value(args[0])
-                volume = self._get_numeric_value(args[1])
-                
-                # Apply contrarian strategy
-                if ratio > 0.75 and volume > 1000:
-                    return ['BUY_B']
-                elif ratio < 0.25 and volume > 1000:
-                    return ['BUY_A']
-                else:
-                    return ['HOLD']
+        names = list(dict.fromkeys(_variables_in(pattern)))
+        for atom in self.unify_candidates(pattern):
+            bindings = {}
+            if _unify(pattern, 0, atom, 1, bindings):
+                yield {name: _resolve(MeTTaAtom(name, MeTTaType.VARIABLE), 0, bindings) for name in names}
+    
+    def load_from_file(self, filename: str, chunk_size: int = 1 << 20, workers: int = 1,
+                       executor: Optional[Executor] = None) -> bool:
+        """Load rules and facts from MeTTa file
+        
+        The file is streamed in chunks, so only the knowledge base itself
+        grows with the size of the file. With workers > 1 (or an executor)
+        large files are parsed in parallel processes instead; the resulting
+        knowledge base is identical to a serial load.
+        """
         
-        return []
+        if (workers > 1 or executor is not None) and os.path.exists(filename) \
+                and os.path.getsize(filename) >= PARALLEL_LOAD_MIN_BYTES:
+            try:
+                if self._load_parallel(filename, workers, executor):
+                    return True
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"⚠️ Parallel load of {filename} failed, loading serially: {e}")
+        
+        try:
+            with open(filename, 'r') as f:
+                # Forms are classified by their head: (= ...) is a rule, anything else a fact
+                for form in self.parser.iter_stream(f, chunk_size):
+                    self.add_atom(form)
+            return True
+        except FileNotFoundError:
+            print(f"MeTTa file not found: {filename}")
+        except MeTTaSyntaxError as e:
+            print(f"Syntax error in MeTTa file {filename}: {e}")
+        except Exception as e:
+            print(f"Error loading MeTTa file: {e}")
+        return False
     
-    def _get_numeric_value(self, expr) -> float:
-        """Get numeric value from expression"""
+    def _load_parallel(self, filename: str, workers: int, executor: Optional[Executor]) -> bool:
+        """Parse byte ranges of the file in worker processes and add the forms in file order
         
-        if isinstance(expr, MeTTaAtom):
-            if expr.type == MeTTaType.NUMBER:
-                return float(expr.value)
-            elif expr.type == MeTTaType.VARIABLE:
-                val = self.bindings.get(expr.value, 0)
-                return float(val) if isinstance(val, (int, float)) else 0
+        Workers return their forms snapshot-encoded, which is cheaper to
+        transfer and rebuild than pickled objects. Nothing is added unless
+        every range parsed on its own; otherwise the caller loads serially,
+        which also reports any real syntax error.
+        """
+        
+        workers = workers if workers > 1 else (os.cpu_count() or 1)
+        # A few ranges per worker evens out forms of uneven size
+        ranges = _split_file(filename, workers * 4)
+        
+        starts, ends = zip(*ranges)
         
-        result = self._evaluate(expr)
-        if result and isinstance(result[0], (int, float)):
-            return float(result[0])
+        pool = executor or ProcessPoolExecutor(max_workers=workers)
+        try:
+            results = list(pool.map(_parse_file_range, itertools.repeat(filename, len(ranges)), starts, ends))
+        finally:
+            if executor is None:
+                pool.shutdown()
+        
+        if any(result is None for result in results):
+            return False
         
-        return 0.0
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for result in results:
+                atoms, _, stream = marshal.loads(result)
+                for form in _decode_forms(stream, _decode_atoms(atoms), []):
+                    self.add_atom(form)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return True
     
-    def analyze_market(self, market_data: Dict) -> Dict:
-        """Analyze market using MeTTa reasoning"""
+    def load_source(self, content: str, filename: str = "<string>") -> bool:
+        """Load rules and facts from MeTTa source text; False if it could not be fully loaded"""
         
         try:
-            option_a_ratio = float(market_data.get("optionARatio", 0.5))
-            total_volume = float(market_data.get("totalVolume", 0))
-            
-            # Set variables for reasoning
-            self.bindings['$ratio'] = option_a_ratio
-            self.bindings['$volume'] = total_volume
-            
-            # Execute MeTTa queries
-            contrarian_result = self.query(f"(contrarian-signal {option_a_ratio})")
-            risk_result = self.query(f"(risk-level {total_volume} {option_a_ratio})")
-            recommendation_result = self.query(f"(betting-recommendation {option_a_ratio} {total_volume})")
-            
-            # Calculate confidence
-            confidence = 0.5
-            if contrarian_result and contrarian_result[0] == 'high-contrarian':
-                confidence = 0.8
-            elif contrarian_result and contrarian_result[0] == 'medium-contrarian':
-                confidence = 0.6
-            
-            # Adjust confidence based on risk
-            if risk_result and risk_result[0] == 'low-risk':
-                confidence = min(0.95, confidence * 1.2)
-            elif risk_result and risk_result[0] == 'high-risk':
-                confidence *= 0.7
-            
-            recommendation = recommendation_result[0] if recommendation_result else 'HOLD'
-            risk_level = risk_result[0] if risk_result else 'medium-risk'
-            contrarian_signal = contrarian_result[0] if contrarian_result else 'low-contrarian'
-            
-            reasoning = f"MeTTa analysis: {contrarian_signal} detected with {option_a_ratio:.1%} ratio, {risk_level}"
-            
-            return {
-                "recommendation": recommendation,
-                "confidence": confidence,
-                "reasoning": reasoning,
-                "risk_level": risk_level.replace('-', '_').upper(),
-                "metta_analysis": f"Applied MeTTa reasoning with {len(self.kb.rules)} rules",
-                "contrarian_signal": contrarian_signal,
-                "variables_used": dict(self.bindings)
-            }
-            
+            # Forms are classified by their head: (= ...) is a rule, anything else a fact
+            for form in self.parser.iter_forms(content):
+                self.add_atom(form)
+            return True
+        except MeTTaSyntaxError as e:
+            print(f"Syntax error in MeTTa file {filename}: {e}")
         except Exception as e:
-            print(f"MeTTa analysis error: {e}")
-            return self._fallback_analysis(market_data)
+            print(f"Error loading MeTTa file: {e}")
+        return False
+    
+    def save_snapshot(self, path: str, source_hash: bytes) -> bool:
+        """Write rules, facts and indexes to a binary snapshot tagged with source_hash
+        
+        The file is written next to its final path and renamed into place, so
+        a concurrently starting process never maps a half-written snapshot.
+        """
+        
+        rule_positions = {id(rule): i for i, rule in enumerate(self.rules)}
+        fact_positions = {id(fact): i for i, fact in enumerate(self.facts)}
+        atom_table = {}
+        expression_table = {}
+        rules = _encode_forms(self.rules, atom_table, expression_table)
+        facts = _encode_forms(self.facts, atom_table, expression_table)
+        payload = marshal.dumps((
+            [(code, value) for code, _, value in atom_table],
+            len(self.rules),
+            rules,
+            len(self.facts),
+            facts,
+            _encode_index(self._rule_index, rule_positions),
+            _encode_index(self._fact_index, fact_positions),
+            _encode_index(self._fact_arg_index, fact_positions),
+        ))
+        
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, source_hash))
+                f.write(payload)
+            os.replace(temp_path, path)
+            return True
+        except OSError as e:
+            print(f"Could not write MeTTa snapshot {path}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False
+    
+    def load_snapshot(self, path: str, source_hash: bytes) -> bool:
+        """Replace the contents with a snapshot written by save_snapshot
+        
+        Returns False, leaving the knowledge base untouched, when the snapshot
+        is missing, was built from different sources, or cannot be decoded.
+        """
+        
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if len(mapped) < _SNAPSHOT_HEADER.size:
+                    return False
+                magic, version, digest = _SNAPSHOT_HEADER.unpack_from(mapped)
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT or digest != source_hash:
+                    return False
+                with memoryview(mapped) as view:
+                    payload = marshal.loads(view[_SNAPSHOT_HEADER.size:])
+        except (OSError, ValueError, EOFError, TypeError):
+            return False
+        
+        # Decoding allocates only acyclic objects, so pausing the cyclic GC just skips wasted passes
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            atoms, rule_count, rules, fact_count, facts, rule_index, fact_index, fact_arg_index = payload
+            atoms = _decode_atoms(atoms)
+            expressions = []
+            rules = _decode_forms(rules, atoms, expressions)
+            facts = _decode_forms(facts, atoms, expressions)
+            if len(rules) != rule_count or len(facts) != fact_count:
+                return False
+            rule_index = _decode_index(rule_index, rules)
+            fact_index = _decode_index(fact_index, facts)
+            fact_arg_index = _decode_index(fact_arg_index, facts, type_position=2)
+        except (ValueError, TypeError, IndexError):
+            return False
+        finally:
+            if gc_enabled:
+                gc.enable()
+        
+        self.rules = rules
+        self.facts = facts
+        self._rule_index = rule_index
+        self._fact_index = fact_index
+        self._fact_arg_index = fact_arg_index
+        self.version += 1
+        self.reset_version = self.version
+        return True
+    
+    @staticmethod
+    def _is_rule(form: Union[MeTTaAtom, MeTTaExpression]) -> bool:
+        """Check whether a parsed form is an (= head body) rule"""
+        
+        return (isinstance(form, MeTTaExpression) and len(form.atoms) == 3
+                and isinstance(form.atoms[0], MeTTaAtom) and form.atoms[0].value == '=')
+
+def _to_atom(value: Any) -> Union[MeTTaAtom, MeTTaExpression]:
+    """Convert an evaluated Python value back into a MeTTa atom"""
+    
+    if isinstance(value, (MeTTaAtom, MeTTaExpression)):
+        return value
+    if isinstance(value, bool):
+        return MeTTaAtom(str(value), MeTTaType.ATOM)
+    if isinstance(value, (int, float)):
+        return MeTTaAtom(value, MeTTaType.NUMBER)
+    if isinstance(value, str) and value.startswith('$'):
+        return MeTTaAtom(value, MeTTaType.VARIABLE)
+    return MeTTaAtom(value, MeTTaType.ATOM)
+
+def _from_atom(atom: Union[MeTTaAtom, MeTTaExpression]) -> Any:
+    """The value an atom evaluates to (the inverse of _to_atom); expressions stay as data"""
+    
+    return atom.value if isinstance(atom, MeTTaAtom) else atom
+
+def _residual(name: str, values: Iterable[Any]) -> MeTTaExpression:
+    """An application that does not reduce, returned as data"""
+    
+    return MeTTaExpression([MeTTaAtom(name, MeTTaType.ATOM)] + [_to_atom(value) for value in values])
+
+def _memo_key(name: str, args: tuple) -> tuple:
+    """Memo table key of an application: True, 1 and 1.0 are equal but must not share results"""
+    
+    return (name, tuple((arg.__class__, arg) for arg in args))
+
+def _is_true(value: Any) -> bool:
+    """Whether a condition selects its then-branch: only True does, never a residual or other data"""
+    
+    return value is True or (value.__class__ is str and value == 'True')
+
+def _substitute(expr: Union[MeTTaAtom, MeTTaExpression], env: Any) -> Union[MeTTaAtom, MeTTaExpression]:
+    """Replace the $variables bound in env by their values"""
+    
+    if isinstance(expr, MeTTaExpression):
+        atoms = [_substitute(atom, env) for atom in expr.atoms]
+        if all(new is old for new, old in zip(atoms, expr.atoms)):
+            return expr
+        return MeTTaExpression(atoms)
+    if expr.type == MeTTaType.VARIABLE:
+        value = env.get(expr.value, _MISSING)
+        if value is not _MISSING:
+            return _to_atom(value)
+    return expr
+
+def _lazy_product(iterables: List[Iterable[Any]]) -> Iterator[tuple]:
+    """Cartesian product that pulls from its inputs only as combinations are consumed
+    
+    Unlike itertools.product nothing is materialized up front, so the first
+    combination costs one result from each input. Results of the later
+    inputs are remembered on the first pass and replayed after that.
+    """
+    
+    if not iterables:
+        yield ()
+        return
+    
+    head, rest = iterables[0], iterables[1:]
+    replay = None
+    for value in head:
+        if replay is None:
+            replay = []
+            for values in _lazy_product(rest):
+                replay.append(values)
+                yield (value,) + values
+        else:
+            for values in replay:
+                yield (value,) + values
+
+# Arithmetic and math builtins, applied to plain Python numbers
+NUMERIC_FUNCTIONS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '%': operator.mod,
+    'pow': math.pow,
+    'abs': abs,
+    'min': min,
+    'max': max,
+    'sqrt': math.sqrt,
+    'exp': math.exp,
+    'log': math.log,
+    'floor': math.floor,
+    'ceil': math.ceil,
+    'round': round,
+}
+
+# Errors a numeric builtin raises for operands it cannot apply to (wrong arity, division by zero, domain)
+_NUMERIC_ERRORS = (ArithmeticError, TypeError, ValueError)
+
+# Exact types taken by the numeric fast path; bools are not numbers here
+_NUMBER_TYPES = frozenset([int, float] + ([np.int32, np.int64, np.float32, np.float64] if NUMPY_AVAILABLE else []))
+
+def _apply_numeric(name: str, function: Callable, *values: Any) -> Any:
+    """Apply a numeric builtin to evaluated values, or leave the application unreduced"""
+    
+    if all(type(value) in _NUMBER_TYPES for value in values):
+        try:
+            return function(*values)
+        except _NUMERIC_ERRORS:
+            pass
+    return _residual(name, values)
+
+def _compare_numeric(name: str, compare: Callable[[float, float], bool], *values: Any) -> Any:
+    """Compare the first two evaluated values if both are numbers, or leave the comparison unreduced"""
+    
+    if len(values) < 2:
+        return False
+    if type(values[0]) in _NUMBER_TYPES and type(values[1]) in _NUMBER_TYPES:
+        return compare(values[0], values[1])
+    return _residual(name, values)
+
+# Builtins that evaluate all their arguments, as functions of the evaluated values
+VALUE_BUILTINS = {
+    '>': functools.partial(_compare_numeric, '>', operator.gt),
+    '<': functools.partial(_compare_numeric, '<', operator.lt),
+    '<=': functools.partial(_compare_numeric, '<=', operator.le),
+    '>=': functools.partial(_compare_numeric, '>=', operator.ge),
+    '==': lambda *values: len(values) >= 2 and values[0] == values[1],
+    '!=': lambda *values: len(values) >= 2 and values[0] != values[1],
+}
+VALUE_BUILTINS.update((name, functools.partial(_apply_numeric, name, function))
+                      for name, function in NUMERIC_FUNCTIONS.items())
+
+# Default bound on the results gathered from one nondeterministic evaluation
+MAX_RESULTS = 1000
+
+class _Lazy:
+    """A `let` binding that is evaluated the first time it is looked up"""
+    
+    __slots__ = ('compute', 'env', 'value')
+    
+    def __init__(self, compute: Callable[[Any], Any], env: Any):
+        self.compute = compute
+        self.env = env
+        self.value = None
+    
+    def force(self) -> Any:
+        if self.compute is not None:
+            self.value = self.compute(self.env)
+            self.compute = self.env = None
+        return self.value
+
+class Scope:
+    """Immutable chain of variable bindings for one evaluation
+    
+    A scope holds its own bindings plus a parent (another Scope or a plain
+    dict). Nothing is ever written into an existing scope: `let` creates a
+    child and every rule call starts from a fresh parameter dict, so
+    concurrent evaluations sharing one reasoner never see each other's
+    variables and need no locks. A binding may be a _Lazy, which `get`
+    forces on first use.
+    """
+    
+    __slots__ = ('bindings', 'parent')
+    
+    def __init__(self, bindings: Dict[str, Any], parent: Optional[Union['Scope', Dict]] = None):
+        self.bindings = bindings
+        self.parent = parent
+    
+    def get(self, name: str, default: Any = None) -> Any:
+        scope = self
+        while isinstance(scope, Scope):
+            if name in scope.bindings:
+                value = scope.bindings[name]
+                return value.force() if type(value) is _Lazy else value
+            scope = scope.parent
+        return default if scope is None else scope.get(name, default)
+    
+    def child(self, bindings: Dict[str, Any]) -> 'Scope':
+        return Scope(bindings, self)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Flatten the chain into one dict; inner bindings shadow outer ones"""
+        
+        chain = []
+        scope = self
+        while isinstance(scope, Scope):
+            chain.append(scope.bindings)
+            scope = scope.parent
+        flat = dict(scope) if scope is not None else {}
+        for bindings in reversed(chain):
+            flat.update(bindings)
+        return {name: value.force() if type(value) is _Lazy else value for name, value in flat.items()}
+    
+    def __repr__(self):
+        return f"Scope({self.to_dict()})"
+
+_MISSING = object()
+
+# Evaluation limits applied to every query and analyze_market call unless configured otherwise
+DEFAULT_MAX_STEPS = 100000
+# Nesting of rule calls; past _CLOSURE_DEPTH they run on MeTTaInterpreter's stack, not Python's
+DEFAULT_MAX_DEPTH = 10000
+# Wall-clock limit in seconds; off unless METTA_TIMEOUT is set, since a loaded machine would fail healthy rules
+DEFAULT_TIMEOUT = float(os.environ["METTA_TIMEOUT"]) if os.environ.get("METTA_TIMEOUT") else None
+
+class EvaluationBudget:
+    """Step, depth and wall-clock limits for one evaluation, and what it used
+    
+    A step is one rule application that is actually evaluated (tabled
+    results cost nothing); depth is how deeply rule applications nest. The
+    deadline is only checked every 64 steps, so the clock is read rarely.
+    A budget belongs to one evaluation in one thread.
+    """
+    
+    __slots__ = ('max_steps', 'max_depth', 'started', 'deadline', 'steps', 'depth', 'max_depth_reached', 'observer')
+    
+    def __init__(self, max_steps: Optional[int] = DEFAULT_MAX_STEPS, max_depth: Optional[int] = DEFAULT_MAX_DEPTH,
+                 timeout: Optional[float] = DEFAULT_TIMEOUT, observer: Optional[Any] = None):
+        # Told about every rule application of the evaluation when set: a MeTTaProfiler or MeTTaDerivation
+        self.observer = observer
+        self.max_steps = max_steps if max_steps is not None else float('inf')
+        self.max_depth = max_depth if max_depth is not None else float('inf')
+        self.started = time.perf_counter()
+        self.deadline = self.started + timeout if timeout is not None else None
+        self.steps = 0
+        self.depth = 0
+        self.max_depth_reached = 0
+    
+    def step(self):
+        self.steps += 1
+        if self.steps > self.max_steps:
+            raise MeTTaBudgetExceeded("step budget", self)
+        if self.deadline is not None and not self.steps & 63 and time.perf_counter() > self.deadline:
+            raise MeTTaBudgetExceeded("deadline", self)
+    
+    def enter(self):
+        """Count a nested rule application; the caller decrements `depth` when it returns"""
+        
+        self.depth += 1
+        if self.depth > self.max_depth_reached:
+            self.max_depth_reached = self.depth
+            if self.depth > self.max_depth:
+                raise MeTTaBudgetExceeded("depth limit", self)
+        self.step()
+    
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+    
+    def info(self) -> Dict[str, Any]:
+        return {"steps": self.steps, "max_depth": self.max_depth_reached,
+                "elapsed_ms": (time.perf_counter() - self.started) * 1000}
+
+class _EvaluationState(threading.local):
+    # Budget of the evaluation running in this thread, if any
+    budget = None
+
+_evaluation = _EvaluationState()
+
+class _ProfileNode:
+    """One call path in a profile: rule name, children by name, calls and self time"""
+    
+    __slots__ = ('name', 'children', 'calls', 'time')
+    
+    def __init__(self, name: Optional[str]):
+        self.name = name
+        self.children = {}
+        self.calls = 0
+        self.time = 0.0
+
+class MeTTaProfiler:
+    """Per-rule call counts, time and table hits, gathered while attached to a reasoner
+    
+    Attach one with MeTTaReasoner.profile(); while none is attached the
+    evaluator only checks for it. Every evaluated rule application records
+    its self time and inclusive time (counted once for recursive rules),
+    per rule and per call stack, and tabled results count as table hits.
+    Applications made on the nondeterministic results() path are counted
+    but not timed. stats() and to_json() summarize per rule; collapsed()
+    lists the call stacks in the folded format read by flamegraph.pl,
+    speedscope and similar tools, weighted by self time in microseconds.
+    One profiler may watch many threads at once.
+    
+    The evaluator reports to the observer on its budget: enter(rule, args)
+    when an application starts, result(value) and exit() when it returns,
+    hit(rule, args, value) for a tabled result and count(rule) for an
+    untimed application; depth() and unwind() close what an exception
+    left open. MeTTaDerivation implements the same methods.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+    
+    def reset(self):
+        """Forget everything recorded so far"""
+        
+        with self._lock:
+            # Rule name -> [calls, table hits, inclusive seconds, self seconds]
+            self.rules: Dict[str, List] = {}
+            self._root = _ProfileNode(None)
+    
+    def _frames(self) -> list:
+        local = self._local
+        frames = getattr(local, 'frames', None)
+        if frames is None or local.root is not self._root:
+            frames = local.frames = []
+            local.root = self._root
+            local.active = {}
+        return frames
+    
+    def _rule(self, name: str) -> List:
+        stats = self.rules.get(name)
+        if stats is None:
+            stats = self.rules[name] = [0, 0, 0.0, 0.0]
+        return stats
+    
+    def enter(self, name: str, args: tuple = ()):
+        """A rule application starts; every enter() is matched by an exit()"""
+        
+        frames = self._frames()
+        parent = frames[-1][0] if frames else self._local.root
+        node = parent.children.get(name)
+        if node is None:
+            node = parent.children.setdefault(name, _ProfileNode(name))
+        active = self._local.active
+        active[name] = active.get(name, 0) + 1
+        frames.append([node, time.perf_counter(), 0.0])
+    
+    def result(self, value: Any):
+        pass
+    
+    def exit(self):
+        """The innermost rule application returns"""
+        
+        frames = self._frames()
+        if not frames:
+            return  # reset() while it ran
+        node, started, children = frames.pop()
+        elapsed = time.perf_counter() - started
+        if frames:
+            frames[-1][2] += elapsed
+        active = self._local.active
+        active[node.name] -= 1
+        with self._lock:
+            node.calls += 1
+            node.time += elapsed - children
+            stats = self._rule(node.name)
+            stats[0] += 1
+            stats[3] += elapsed - children
+            if not active[node.name]:
+                stats[2] += elapsed
+    
+    def depth(self) -> int:
+        """Applications in progress in this thread, for unwind()"""
+        
+        return len(self._frames())
+    
+    def unwind(self, depth: int):
+        """Close the applications an exception left open above `depth`"""
+        
+        while len(self._frames()) > depth:
+            self.exit()
+    
+    def hit(self, name: str, args: tuple = (), value: Any = None):
+        """A rule application was answered from the table"""
+        
+        with self._lock:
+            self._rule(name)[1] += 1
+    
+    def count(self, name: str):
+        """A rule application that is not timed"""
+        
+        with self._lock:
+            self._rule(name)[0] += 1
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-rule calls, table hits, inclusive and self time, most expensive first"""
+        
+        with self._lock:
+            rules = sorted(self.rules.items(), key=lambda item: item[1][2], reverse=True)
+            return {
+                name: {"calls": calls, "table_hits": hits, "total_ms": total * 1000, "self_ms": own * 1000}
+                for name, (calls, hits, total, own) in rules
+            }
+    
+    def collapsed(self) -> List[str]:
+        """One 'rule;rule;rule microseconds' line per call stack"""
+        
+        lines = []
+        with self._lock:
+            pending = [((), node) for node in self._root.children.values()]
+            while pending:
+                path, node = pending.pop()
+                path += (node.name,)
+                if node.calls:
+                    lines.append(f"{';'.join(path)} {max(1, round(node.time * 1e6))}")
+                pending.extend((path, child) for child in node.children.values())
+        return sorted(lines)
+    
+    def to_json(self) -> str:
+        return json.dumps({"rules": self.stats()}, indent=2)
+    
+    def write_json(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+    
+    def write_collapsed(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(line + '\n' for line in self.collapsed())
+
+class MeTTaDerivation:
+    """The rule applications behind one evaluation's results, as a tree
+    
+    Attached to a budget like a profiler, it records each application in
+    evaluation order as a (depth, rule, arguments, result, tabled) node,
+    keeping at most `max_nodes`; runaway evaluations only bump `omitted`.
+    Nothing else is captured while evaluating: render() works out which
+    parameters each rule bound by matching its clauses again, so an
+    explanation is only paid for when it is read. Events are passed on to
+    `observer` (e.g. a MeTTaProfiler) when one is given.
+    """
+    
+    __slots__ = ('nodes', 'omitted', 'max_nodes', 'observer', '_open')
+    
+    def __init__(self, observer: Optional[Any] = None, max_nodes: int = 64):
+        self.nodes = []
+        self.omitted = 0
+        self.max_nodes = max_nodes
+        self.observer = observer
+        # Node of each application in progress, or None once past max_nodes
+        self._open = []
+    
+    def _record(self, name: str, args: tuple, result: Any, tabled: bool) -> Optional[List]:
+        if len(self.nodes) >= self.max_nodes:
+            self.omitted += 1
+            return None
+        node = [len(self._open), name, args, result, tabled]
+        self.nodes.append(node)
+        return node
+    
+    def enter(self, name: str, args: tuple = ()):
+        self._open.append(self._record(name, args, None, False))
+        if self.observer is not None:
+            self.observer.enter(name, args)
+    
+    def result(self, value: Any):
+        if self._open:
+            node = self._open[-1]
+            if node is not None:
+                node[3] = value
+    
+    def exit(self):
+        if self._open:
+            self._open.pop()
+        if self.observer is not None:
+            self.observer.exit()
+    
+    def depth(self) -> int:
+        return len(self._open)
+    
+    def unwind(self, depth: int):
+        if self.observer is not None:
+            self.observer.unwind(self.observer.depth() - (len(self._open) - depth))
+        del self._open[depth:]
+    
+    def hit(self, name: str, args: tuple = (), value: Any = None):
+        self._record(name, args, value, True)
+        if self.observer is not None:
+            self.observer.hit(name, args, value)
+    
+    def count(self, name: str):
+        if self.observer is not None:
+            self.observer.count(name)
+    
+    def fired(self) -> List[str]:
+        """Names of the rules applied, in order; tabled results are marked"""
+        
+        return [f"{name} (tabled)" if tabled else name for _, name, _, _, tabled in self.nodes]
+    
+    def render(self, functions: Optional[Dict[str, 'MeTTaFunction']] = None) -> str:
+        """One line: `rule($param=value, ...) ⇒ result`, callees in brackets after their caller
+        
+        Parameters are named from `functions` (the reasoner's rule table);
+        without it, or when no clause matches any more, arguments are listed
+        as they were passed. Tabled and evaluated applications read the same.
+        """
+        
+        if functions is None:
+            functions = {}
+        parts = []
+        previous = 0
+        for index, (depth, name, args, result, _) in enumerate(self.nodes):
+            if depth > previous:
+                parts.append(" [")
+            elif index:
+                parts.append("]" * (previous - depth) + "; ")
+            function = functions.get(name)
+            bindings = function.bindings(args) if function is not None else None
+            if bindings is not None:
+                arguments = ", ".join([variable + "=" + _render_value(value) for variable, value in bindings.items()])
+            else:
+                arguments = ", ".join([_render_value(value) for value in args])
+            parts.append(f"{name}({arguments}) ⇒ {_render_value(result)}")
+            previous = depth
+        parts.append("]" * previous)
+        if self.omitted:
+            parts.append(f"; … {self.omitted} more")
+        return "".join(parts)
+    
+    def __str__(self):
+        return self.render()
+
+def _render_value(value: Any) -> str:
+    """Compact text for a value in an explanation: 15000 rather than 15000.0, 0.8534 rather than 0.85341234"""
+    
+    cls = value.__class__
+    if cls is str:
+        return value
+    if cls is float:
+        if value.is_integer() and -1e15 < value < 1e15:
+            return str(int(value))
+        return str(round(value, 4))
+    return str(value)
+
+# Rule calls nested this deep (and expressions nested this deep within one rule) leave the
+# compiled closures for MeTTaInterpreter; each level of closures costs several Python frames
+_CLOSURE_DEPTH = 32
+_COMPILE_DEPTH = 64
+
+class MeTTaFunction:
+    """All (= (name ...) body) clauses for one head symbol, compiled to Python
+    
+    Calling the function with evaluated arguments tries the clauses in
+    definition order and runs the body of the first one whose parameters
+    match. When no clause matches, the call reduces to itself as data.
+    results() is the nondeterministic counterpart: it yields the results of
+    every matching clause in turn.
+    
+    Rule bodies only see their own parameters and the language has no side
+    effects, so every application is a pure function of its arguments.
+    With a table attached, results are memoized per (head, arguments),
+    keyed by each argument's type as well as its value; applications with
+    unhashable arguments are not tabled.
+    """
+    
+    def __init__(self, name: str, table: Optional['MemoTable'] = None, interpreter: Optional['MeTTaInterpreter'] = None):
+        self.name = name
+        self.clauses = []
+        self.table = table
+        self.interpreter = interpreter
+    
+    def add_clause(self, params: List[Union[MeTTaAtom, MeTTaExpression]], body: Callable[[Dict], Any],
+                   results: Optional[Callable[[Dict], Iterable[Any]]] = None,
+                   source: Optional[Union[MeTTaAtom, MeTTaExpression]] = None):
+        """Add a compiled clause; params are the head's argument patterns
+        
+        `body` computes the clause's first result and `results` all of them;
+        without `results` the clause has exactly the one result. `source` is
+        the body expression, which the interpreter evaluates when calls nest
+        too deeply for the compiled closures.
+        """
+        
+        if results is None:
+            results = lambda env: (body(env),)
+        self.clauses.append((len(params), self._compile_matcher(params), body, results, source))
+    
+    def __call__(self, *args) -> Any:
+        table = self.table
+        if table is None:
+            return self._apply(args)
+        
+        key = _memo_key(self.name, args)
+        try:
+            result = table.get(key, _MISSING)
+        except TypeError:
+            return self._apply(args)
+        
+        if result is _MISSING:
+            result = self._apply(args)
+            table.put(key, result)
+        else:
+            budget = _evaluation.budget
+            if budget is not None and budget.observer is not None:
+                budget.observer.hit(self.name, args, result)
+        return result
+    
+    def _apply(self, args: tuple) -> Any:
+        budget = _evaluation.budget
+        observer = None
+        if budget is not None:
+            if budget.depth >= _CLOSURE_DEPTH and self.interpreter is not None:
+                return self.interpreter.call(self, args)
+            budget.enter()
+            observer = budget.observer
+            if observer is not None:
+                observer.enter(self.name, args)
+        try:
+            arity = len(args)
+            for clause_arity, match, body, _, _ in self.clauses:
+                if clause_arity != arity:
+                    continue
+                env = match(args)
+                if env is not None:
+                    result = body(env)
+                    break
+            else:
+                result = _residual(self.name, args)
+            
+            if observer is not None:
+                observer.result(result)
+            return result
+        finally:
+            if budget is not None:
+                budget.depth -= 1
+                if observer is not None:
+                    observer.exit()
+    
+    def bindings(self, args: tuple) -> Optional[Dict]:
+        """Parameter bindings of the clause an application to these arguments selects, if any"""
+        
+        for clause_arity, match, _, _, _ in self.clauses:
+            if clause_arity == len(args):
+                env = match(args)
+                if env is not None:
+                    return env
+        return None
+    
+    def results(self, *args) -> Iterator[Any]:
+        """Results of every clause matching the arguments, in definition order (not tabled)
+        
+        Once calls nest past _CLOSURE_DEPTH, the interpreter is tried first:
+        if the evaluation never reaches a choice point its single result is
+        the only one, computed without nesting generators.
+        """
+        
+        budget = _evaluation.budget
+        if budget is None:
+            yield from self._results(args)
+            return
+        
+        budget.step()
+        if budget.depth >= _CLOSURE_DEPTH and self.interpreter is not None:
+            try:
+                result = self.interpreter.call(self, args, strict=True)
+            except _ChoicePoint:
+                pass
+            else:
+                yield result
+                return
+        
+        if budget.observer is not None:
+            budget.observer.count(self.name)
+        
+        # Depth counts the calls running right now, so it is given back while a result is handed out
+        budget.enter()
+        try:
+            for result in self._results(args):
+                budget.depth -= 1
+                try:
+                    yield result
+                finally:
+                    budget.depth += 1
+        finally:
+            budget.depth -= 1
+    
+    def _results(self, args: tuple) -> Iterator[Any]:
+        arity = len(args)
+        matched = False
+        for clause_arity, match, _, results, _ in self.clauses:
+            if clause_arity != arity:
+                continue
+            env = match(args)
+            if env is not None:
+                matched = True
+                yield from results(env)
+        
+        if not matched:
+            yield _residual(self.name, args)
+    
+    @staticmethod
+    def _compile_matcher(params: List[Union[MeTTaAtom, MeTTaExpression]]) -> Callable[[tuple], Optional[Dict]]:
+        """Build a function that binds call arguments to parameters, or returns None"""
+        
+        names = [param.value for param in params
+                 if isinstance(param, MeTTaAtom) and param.type == MeTTaType.VARIABLE]
+        
+        # Common case: distinct variables only, so every call matches
+        if len(names) == len(params) and len(set(names)) == len(names):
+            return lambda args: dict(zip(names, args))
+        
+        def match(args):
+            env = {}
+            for param, arg in zip(params, args):
+                if isinstance(param, MeTTaExpression):
+                    # Patterns like (pair $a $b) bind the variables nested in them
+                    bindings = unify(param, _to_atom(arg))
+                    if bindings is None:
+                        return None
+                    for name, atom in bindings.items():
+                        value = _from_atom(atom)
+                        if name in env and env[name] != value:
+                            return None
+                        env[name] = value
+                elif param.type == MeTTaType.VARIABLE:
+                    if param.value in env and env[param.value] != arg:
+                        return None
+                    env[param.value] = arg
+                elif param.value != arg:
+                    return None
+            return env
+        
+        return match
+
+class MeTTaCompiler:
+    """Compiles MeTTa expressions into Python closures taking an environment
+    
+    The environment is a read-only mapping of variable bindings (a dict or
+    a Scope). Built-in forms are looked up in a dispatch table when
+    compiling; any other head is called through `self.functions` at run
+    time, so swapping in a recompiled function table is picked up by
+    existing closures without recompiling them.
+    
+    compile() builds closures returning the first result of an expression.
+    compile_all() builds the nondeterministic form, returning an iterator
+    over every result: each matching clause of a rule, each element of a
+    (superpose ...), each knowledge-base atom a (match ...) unifies with.
+    Results are produced lazily, and no argument contributes more than
+    `max_results` of them, so combinations cannot grow without bound.
+    """
+    
+    def __init__(self, functions: Optional[Dict[str, MeTTaFunction]] = None,
+                 kb: Optional['MeTTaKnowledgeBase'] = None, max_results: int = MAX_RESULTS):
+        self.functions = functions if functions is not None else {}
+        self.kb = kb
+        self.max_results = max_results
+        self.interpreter = MeTTaInterpreter(self)
+        self._nesting = threading.local()
+        self.special_forms = {
+            'if': self._compile_all_if,
+            'and': self._compile_all_and,
+            'or': self._compile_all_or,
+            'let': self._compile_all_let,
+            'superpose': self._compile_all_superpose,
+            'collapse': self._compile_all_collapse,
+            'match': self._compile_all_match,
+        }
+        self.builtins = {
+            '>': self._compile_gt,
+            '<': self._compile_lt,
+            '<=': self._compile_le,
+            '>=': self._compile_ge,
+            '==': self._compile_eq,
+            '!=': self._compile_ne,
+            'and': self._compile_and,
+            'or': self._compile_or,
+            'if': self._compile_if,
+            'let': self._compile_let,
+        }
+        for name, function in NUMERIC_FUNCTIONS.items():
+            self.builtins[name] = functools.partial(self._compile_numeric, name, function)
+        for name in ('superpose', 'collapse', 'match'):
+            self.builtins[name] = functools.partial(self._compile_first, name)
+    
+    def compile(self, expr: Union[MeTTaAtom, MeTTaExpression]) -> Callable[[Dict], Any]:
+        """Compile an expression into a closure evaluating it under some bindings
+        
+        Subexpressions nested more than _COMPILE_DEPTH levels down are left
+        to the iterative interpreter, so compiling and running them does not
+        recurse once per level.
+        """
+        
+        if isinstance(expr, MeTTaAtom):
+            return self._compile_atom(expr)
+        
+        depth = getattr(self._nesting, 'depth', 0)
+        if depth >= _COMPILE_DEPTH:
+            interpreter = self.interpreter
+            return lambda env: interpreter.evaluate(expr, env)
+        
+        self._nesting.depth = depth + 1
+        try:
+            return self._compile_expression(expr)
+        finally:
+            self._nesting.depth = depth
+    
+    def compile_rules(self, rules: List[MeTTaExpression], table: Optional['MemoTable'] = None) -> Dict[str, MeTTaFunction]:
+        """Compile rules into a new function table, leaving the live one untouched"""
+        
+        functions = {}
+        for rule in rules:
+            try:
+                self.compile_rule(rule, functions, table)
+            except Exception as e:
+                print(f"Error compiling rule: {rule} - {e}")
+        return functions
+    
+    def compile_rule(self, rule: MeTTaExpression, functions: Optional[Dict[str, MeTTaFunction]] = None,
+                     table: Optional['MemoTable'] = None):
+        """Compile an (= (head params...) body) rule into a function table"""
+        
+        if functions is None:
+            functions = self.functions
+        
+        head = rule.atoms[1]
+        if not (isinstance(head, MeTTaExpression) and head.atoms and isinstance(head.atoms[0], MeTTaAtom)):
+            return
+        
+        name = head.atoms[0].value
+        function = functions.get(name)
+        if function is None:
+            function = functions[name] = MeTTaFunction(name, table, self.interpreter)
+        function.add_clause(head.atoms[1:], self.compile(rule.atoms[2]), self._compile_all_lazily(rule.atoms[2]),
+                            rule.atoms[2])
+    
+    def _compile_atom(self, atom: MeTTaAtom) -> Callable[[Dict], Any]:
+        """Constants fold to their value; variables read the bindings"""
+        
+        if atom.type == MeTTaType.VARIABLE:
+            name = atom.value
+            return lambda env: env.get(name, name)
+        value = atom.value
+        return lambda env: value
+    
+    def _compile_expression(self, expr: MeTTaExpression) -> Callable[[Dict], Any]:
+        """Dispatch on the head symbol: built-in form, or function call"""
+        
+        if not expr.atoms:
+            return lambda env: expr
+        
+        head = expr.atoms[0]
+        args = expr.atoms[1:]
+        
+        if not isinstance(head, MeTTaAtom) or head.type != MeTTaType.ATOM:
+            return self._compile_data(expr)
+        
+        builtin = self.builtins.get(head.value)
+        if builtin is not None:
+            return builtin(args)
+        
+        return self._compile_call(head.value, [self.compile(arg) for arg in args])
+    
+    @staticmethod
+    def _compile_data(expr: MeTTaExpression) -> Callable[[Dict], MeTTaExpression]:
+        """An expression that is not an application evaluates to itself, with its bound variables filled in"""
+        
+        if not _variables_in(expr):
+            return lambda env: expr
+        return lambda env: _substitute(expr, env)
+    
+    def _compile_call(self, name: str, args: List[Callable[[Dict], Any]]) -> Callable[[Dict], Any]:
+        """Call a rule-defined function with evaluated arguments"""
+        
+        compiler = self
+        
+        def call(env):
+            values = [arg(env) for arg in args]
+            function = compiler.functions.get(name)
+            if function is None:
+                return _residual(name, values)
+            return function(*values)
+        
+        return call
+    
+    def _compile_comparison(self, name: str, args: List, compare: Callable[[float, float], bool]) -> Callable[[Dict], Any]:
+        """Numeric comparison; a literal right-hand side is checked once here
+        
+        Like arithmetic, a comparison with an operand that is not a number
+        (a symbol, an unbound variable, an unreduced call) is left unreduced
+        rather than counting the operand as 0.
+        """
+        if len(args) != 2:
+            if len(args) < 2:
+                return lambda env: False
+            operands = [self.compile(arg) for arg in args]
+            return lambda env: _compare_numeric(name, compare, *(operand(env) for operand in operands))
+        left = self.compile(args[0])
+        
+        if isinstance(args[1], MeTTaAtom) and type(args[1].value) in _NUMBER_TYPES:
+            constant = args[1].value
+            
+            def compare_constant(env):
+                value = left(env)
+                if type(value) in _NUMBER_TYPES:
+                    return compare(value, constant)
+                return _residual(name, (value, constant))
+            
+            return compare_constant
+        
+        right = self.compile(args[1])
+        return lambda env: _compare_numeric(name, compare, left(env), right(env))
+    
+    def _compile_gt(self, args: List) -> Callable[[Dict], Any]:
+        """Greater than comparison"""
+        return self._compile_comparison('>', args, operator.gt)
+    
+    def _compile_lt(self, args: List) -> Callable[[Dict], Any]:
+        """Less than comparison"""
+        return self._compile_comparison('<', args, operator.lt)
+    
+    def _compile_le(self, args: List) -> Callable[[Dict], Any]:
+        """Less than or equal comparison"""
+        return self._compile_comparison('<=', args, operator.le)
+    
+    def _compile_ge(self, args: List) -> Callable[[Dict], Any]:
+        """Greater than or equal comparison"""
+        return self._compile_comparison('>=', args, operator.ge)
+    
+    def _compile_eq(self, args: List) -> Callable[[Dict], bool]:
+        """Equality comparison"""
+        if len(args) < 2:
+            return lambda env: False
+        left, right = self.compile(args[0]), self.compile(args[1])
+        return lambda env: left(env) == right(env)
+    
+    def _compile_ne(self, args: List) -> Callable[[Dict], bool]:
+        """Inequality comparison"""
+        if len(args) < 2:
+            return lambda env: False
+        left, right = self.compile(args[0]), self.compile(args[1])
+        return lambda env: left(env) != right(env)
+    
+    def _compile_numeric(self, name: str, function: Callable, args: List) -> Callable[[Dict], Any]:
+        """Arithmetic and math builtins over plain Python numbers
+        
+        Operands evaluate to ints/floats and are combined directly, so no
+        MeTTaAtom is allocated for intermediate results, and calls whose
+        arguments are all literals are folded here. Non-numeric operands,
+        or arguments the function rejects (wrong arity, division by zero,
+        log of a negative), leave the expression unreduced.
+        """
+        numbers = _NUMBER_TYPES
+        
+        if all(isinstance(arg, MeTTaAtom) and arg.type == MeTTaType.NUMBER for arg in args):
+            try:
+                value = function(*(arg.value for arg in args))
+                return lambda env: value
+            except _NUMERIC_ERRORS:
+                pass
+        
+        operands = [self.compile(arg) for arg in args]
+        
+        if len(operands) == 1:
+            operand = operands[0]
+            
+            def unary(env):
+                value = operand(env)
+                if type(value) in numbers:
+                    try:
+                        return function(value)
+                    except _NUMERIC_ERRORS:
+                        pass
+                return _residual(name, (value,))
+            
+            return unary
+        
+        if len(operands) == 2 and isinstance(args[1], MeTTaAtom) and args[1].type == MeTTaType.NUMBER:
+            left, constant = operands[0], args[1].value
+            
+            def binary_constant(env):
+                value = left(env)
+                if type(value) in numbers:
+                    try:
+                        return function(value, constant)
+                    except _NUMERIC_ERRORS:
+                        pass
+                return _residual(name, (value, constant))
+            
+            return binary_constant
+        
+        if len(operands) == 2:
+            left, right = operands
+            
+            def binary(env):
+                a, b = left(env), right(env)
+                if type(a) in numbers and type(b) in numbers:
+                    try:
+                        return function(a, b)
+                    except _NUMERIC_ERRORS:
+                        pass
+                return _residual(name, (a, b))
+            
+            return binary
+        
+        return lambda env: _apply_numeric(name, function, *[operand(env) for operand in operands])
+    
+    def _compile_and(self, args: List) -> Callable[[Dict], bool]:
+        """Logical AND"""
+        operands = [self.compile(arg) for arg in args]
+        if len(operands) == 2:
+            first, second = operands
+            return lambda env: _is_true(first(env)) and _is_true(second(env))
+        return lambda env: all(_is_true(operand(env)) for operand in operands)
+    
+    def _compile_or(self, args: List) -> Callable[[Dict], bool]:
+        """Logical OR"""
+        operands = [self.compile(arg) for arg in args]
+        if len(operands) == 2:
+            first, second = operands
+            return lambda env: _is_true(first(env)) or _is_true(second(env))
+        return lambda env: any(_is_true(operand(env)) for operand in operands)
+    
+    def _compile_if(self, args: List) -> Callable[[Dict], Any]:
+        """Conditional expression"""
+        if len(args) < 3:
+            return lambda env: None
+        condition, then, otherwise = (self.compile(arg) for arg in args[:3])
+        return lambda env: then(env) if _is_true(condition(env)) else otherwise(env)
+    
+    def _compile_let(self, args: List) -> Callable[[Dict], Any]:
+        """Let binding: (let $a value-a $b value-b ... body)
+        
+        Bindings are lazy: each value is computed on its first lookup, so
+        one the body never reaches costs nothing. Literals and plain
+        variable references are bound directly. A value sees the bindings
+        before it; consecutive bindings that do not refer to each other
+        share a single Scope.
+        """
+        if len(args) < 3 or len(args) % 2 == 0:
+            return lambda env: None
+        
+        groups = []
+        for target, value in zip(args[:-1:2], args[1:-1:2]):
+            name = target.value if isinstance(target, MeTTaAtom) else str(target)
+            if not groups or name in groups[-1] or not groups[-1].keys().isdisjoint(_variables_in(value)):
+                groups.append({})
+            groups[-1][name] = (isinstance(value, MeTTaAtom), self.compile(value))
+        groups = [tuple((name, eager, compute) for name, (eager, compute) in group.items()) for group in groups]
+        body = self.compile(args[-1])
+        
+        if len(groups) == 1 and len(groups[0]) == 1:
+            (name, eager, compute), = groups[0]
+            if eager:
+                return lambda env: body(Scope({name: compute(env)}, env))
+            return lambda env: body(Scope({name: _Lazy(compute, env)}, env))
+        
+        def let(env):
+            for group in groups:
+                env = Scope({name: compute(env) if eager else _Lazy(compute, env)
+                             for name, eager, compute in group}, env)
+            return body(env)
+        
+        return let
+
+    def compile_all(self, expr: Union[MeTTaAtom, MeTTaExpression]) -> Callable[[Dict], Iterable[Any]]:
+        """Compile an expression into a closure yielding all of its results
+        
+        Subexpressions past _COMPILE_DEPTH levels of nesting are first
+        interpreted strictly; only one that reaches a choice point there is
+        compiled, when it is first evaluated.
+        """
+        
+        if isinstance(expr, MeTTaAtom):
+            if expr.type == MeTTaType.VARIABLE:
+                name = expr.value
+                return lambda env: (env.get(name, name),)
+            value = (expr.value,)
+            return lambda env: value
+        
+        depth = getattr(self._nesting, 'depth', 0)
+        if depth >= _COMPILE_DEPTH:
+            interpreter = self.interpreter
+            compiled = None
+            
+            def results(env):
+                nonlocal compiled
+                if compiled is None:
+                    try:
+                        return (interpreter.evaluate(expr, env, strict=True),)
+                    except _ChoicePoint:
+                        compiled = self._compile_all_expression(expr)
+                return compiled(env)
+            
+            return results
+        
+        self._nesting.depth = depth + 1
+        try:
+            return self._compile_all_expression(expr)
+        finally:
+            self._nesting.depth = depth
+    
+    def _compile_all_expression(self, expr: MeTTaExpression) -> Callable[[Dict], Iterable[Any]]:
+        """Dispatch on the head symbol: special form, builtin, or every clause of a rule"""
+        
+        if not expr.atoms or not isinstance(expr.atoms[0], MeTTaAtom) or expr.atoms[0].type != MeTTaType.ATOM:
+            data = self._compile_data(expr)
+            return lambda env: (data(env),)
+        
+        name = expr.atoms[0].value
+        args = expr.atoms[1:]
+        
+        special_form = self.special_forms.get(name)
+        if special_form is not None:
+            return special_form(args)
+        
+        operands = [self.compile_all(arg) for arg in args]
+        limit = self.max_results
+        builtin = VALUE_BUILTINS.get(name)
+        compiler = self
+        
+        def results(env):
+            for values in _lazy_product([itertools.islice(operand(env), limit) for operand in operands]):
+                if builtin is not None:
+                    yield builtin(*values)
+                    continue
+                function = compiler.functions.get(name)
+                if function is None:
+                    yield _residual(name, values)
+                else:
+                    yield from function.results(*values)
+        
+        return results
+    
+    def _compile_all_lazily(self, expr: Union[MeTTaAtom, MeTTaExpression]) -> Callable[[Dict], Iterable[Any]]:
+        """compile_all, deferred to the first call: most rule bodies are only ever asked for one result"""
+        
+        compiled = None
+        
+        def results(env):
+            nonlocal compiled
+            if compiled is None:
+                compiled = self.compile_all(expr)
+            return compiled(env)
+        
+        return results
+    
+    def _compile_first(self, name: str, args: List) -> Callable[[Dict], Any]:
+        """First result of a nondeterministic builtin, or () when it has none"""
+        
+        results = self.special_forms[name](args)
+        empty = MeTTaExpression([])
+        return lambda env: next(iter(results(env)), empty)
+    
+    def _compile_all_if(self, args: List) -> Callable[[Dict], Iterable[Any]]:
+        """Conditional: only the branch selected by each condition result is evaluated"""
+        if len(args) < 3:
+            return lambda env: (None,)
+        condition, then, otherwise = (self.compile_all(arg) for arg in args[:3])
+        
+        def results(env):
+            for value in condition(env):
+                yield from (then if _is_true(value) else otherwise)(env)
+        
+        return results
+    
+    def _compile_all_and(self, args: List) -> Callable[[Dict], Iterable[bool]]:
+        """Logical AND; later operands are evaluated only for true results of earlier ones"""
+        if not args:
+            return lambda env: (True,)
+        first, rest = self.compile_all(args[0]), self._compile_all_and(args[1:])
+        
+        def results(env):
+            for value in first(env):
+                if _is_true(value):
+                    for other in rest(env):
+                        yield _is_true(other)
+                else:
+                    yield False
+        
+        return results
+    
+    def _compile_all_or(self, args: List) -> Callable[[Dict], Iterable[bool]]:
+        """Logical OR; later operands are evaluated only for false results of earlier ones"""
+        if not args:
+            return lambda env: (False,)
+        first, rest = self.compile_all(args[0]), self._compile_all_or(args[1:])
+        
+        def results(env):
+            for value in first(env):
+                if _is_true(value):
+                    yield True
+                else:
+                    for other in rest(env):
+                        yield _is_true(other)
+        
+        return results
+    
+    def _compile_all_let(self, args: List) -> Callable[[Dict], Iterable[Any]]:
+        """Let binding: the body is evaluated once per combination of binding results"""
+        if len(args) < 3 or len(args) % 2 == 0:
+            return lambda env: (None,)
+        
+        bindings = [(target.value if isinstance(target, MeTTaAtom) else str(target), self.compile_all(value))
+                    for target, value in zip(args[:-1:2], args[1:-1:2])]
+        body = self.compile_all(args[-1])
+        limit = self.max_results
+        
+        def bind(index, env):
+            if index == len(bindings):
+                yield from body(env)
+                return
+            name, value = bindings[index]
+            for result in itertools.islice(value(env), limit):
+                yield from bind(index + 1, Scope({name: result}, env))
+        
+        return lambda env: bind(0, env)
+    
+    def _compile_all_superpose(self, args: List) -> Callable[[Dict], Iterable[Any]]:
+        """(superpose (a b c)): the results of each element in turn"""
+        if not args:
+            return lambda env: ()
+        
+        # A literal tuple is not itself evaluated, its elements are; a builtin form such as collapse is
+        tuple_literal = isinstance(args[0], MeTTaExpression) and not (
+            args[0].atoms and isinstance(args[0].atoms[0], MeTTaAtom)
+            and (args[0].atoms[0].value in self.special_forms or args[0].atoms[0].value in VALUE_BUILTINS))
+        if tuple_literal:
+            elements = [self.compile_all(element) for element in args[0].atoms]
+            return lambda env: itertools.chain.from_iterable(element(env) for element in elements)
+        
+        # Otherwise the argument evaluates to a tuple, e.g. a variable bound to a collapse
+        argument = self.compile_all(args[0])
+        
+        def results(env):
+            for value in argument(env):
+                if isinstance(value, MeTTaExpression):
+                    yield from map(_from_atom, value.atoms)
+                else:
+                    yield value
+        
+        return results
+    
+    def _compile_all_collapse(self, args: List) -> Callable[[Dict], Iterable[MeTTaExpression]]:
+        """(collapse expr): one tuple of expr's results, at most max_results long"""
+        if not args:
+            return lambda env: (MeTTaExpression([]),)
+        argument = self.compile_all(args[0])
+        limit = self.max_results
+        return lambda env: (MeTTaExpression([_to_atom(value) for value in itertools.islice(argument(env), limit)]),)
+    
+    def _compile_all_match(self, args: List) -> Callable[[Dict], Iterable[Any]]:
+        """(match &self pattern template): the template once per knowledge-base atom unifying with pattern
+        
+        Variables of the pattern already bound in the environment are
+        substituted first; the rest are bound by unification while the
+        template is evaluated.
+        """
+        if len(args) < 3 or self.kb is None:
+            return lambda env: ()
+        pattern = args[1]
+        template = self.compile_all(args[2])
+        kb = self.kb
+        
+        def results(env):
+            for bindings in kb.unify(_substitute(pattern, env)):
+                yield from template(Scope({name: _from_atom(value) for name, value in bindings.items()}, env))
+        
+        return results
+
+# Continuation opcodes of MeTTaInterpreter
+_EVAL, _IF, _AND, _OR, _APPLY, _CALL, _RETURN = range(7)
+
+# Forms the interpreter evaluates itself; any other builtin goes through a compiled closure
+_INTERPRETED_FORMS = frozenset(['if', 'and', 'or', 'let'])
+
+# Forms that may have several results, which a strict evaluation gives up on
+_CHOICE_FORMS = frozenset(['superpose', 'match'])
+
+# Expressions at most this tall that call no rules run as one compiled closure
+_LEAF_HEIGHT = 8
+
+class _ChoicePoint(Exception):
+    """A strict interpretation reached an expression that may have more than one result"""
+
+class MeTTaInterpreter:
+    """Evaluates expressions iteratively, on an explicit continuation stack
+    
+    Compiled closures nest a few Python frames per level of an expression
+    and per rule call, which is fast but ties how deep a rule chain can go
+    to Python's recursion limit. Here pending work lives on a list instead:
+    an expression pushes its arguments followed by a continuation that
+    combines their values. The branches of `if`, the body of `let` and a
+    rule body are in tail position and simply replace their continuation,
+    and a rule call made in tail position shares the caller's return, so
+    tail-recursive rules run in constant space.
+    
+    The compiler hands over expressions nested too deeply to compile, and
+    MeTTaFunction switches over once rule calls nest past _CLOSURE_DEPTH,
+    so shallow evaluations keep the closures' speed; small subexpressions
+    that call no rules, such as the condition of an `if`, run as compiled
+    closures here too. Results match compile(): first results, lazy let
+    bindings, tabled rule calls. A strict evaluation instead raises
+    _ChoicePoint on reaching a superpose, a match or a call with several
+    matching clauses, so what it returns is the expression's only result.
+    """
+    
+    def __init__(self, compiler: 'MeTTaCompiler'):
+        self.compiler = compiler
+        # Closures for forms delegated back to the compiler (let values, superpose, collapse, match, ...)
+        self._closures = LRUCache(4096)
+        # Expression -> closure running it whole, or None when it has to be interpreted
+        self._leaves = {}
+    
+    def evaluate(self, expr: Union[MeTTaAtom, MeTTaExpression], env: Any, strict: bool = False) -> Any:
+        """First result of an expression under some bindings; with `strict`, its only result"""
+        
+        return self._run([(_EVAL, expr, env)], [], strict)
+    
+    def call(self, function: MeTTaFunction, args: tuple, strict: bool = False) -> Any:
+        """First result of applying a rule to evaluated arguments; with `strict`, its only result"""
+        
+        return self._run([(_CALL, (function.name, len(args)), function)], list(args), strict)
+    
+    def _closure(self, expr: MeTTaExpression) -> Callable[[Any], Any]:
+        closure = self._closures.get(expr)
+        if closure is None:
+            closure = self.compiler.compile(expr)
+            self._closures.put(expr, closure)
+        return closure
+    
+    def _leaf(self, expr: MeTTaExpression) -> Optional[Callable[[Any], Any]]:
+        leaf = self.compiler.compile(expr) if self._is_leaf(expr, _LEAF_HEIGHT) else None
+        if len(self._leaves) >= 65536:
+            self._leaves.clear()
+        self._leaves[expr] = leaf
+        return leaf
+    
+    @classmethod
+    def _is_leaf(cls, expr: Union[MeTTaAtom, MeTTaExpression], height: int) -> bool:
+        if expr.__class__ is MeTTaAtom:
+            return True
+        head = expr.atoms[0] if expr.atoms else None
+        if head.__class__ is not MeTTaAtom or head.type is not MeTTaType.ATOM:
+            return True
+        if height == 0 or not (head.value in VALUE_BUILTINS or head.value in _INTERPRETED_FORMS):
+            return False
+        return all(cls._is_leaf(arg, height - 1) for arg in expr.atoms[1:])
+    
+    def _run(self, stack: list, values: list, strict: bool = False) -> Any:
+        budget = _evaluation.budget
+        if budget is None:
+            budget = EvaluationBudget(None, None, None)
+        base_depth = budget.depth
+        observer = budget.observer
+        if observer is not None:
+            base_frames = observer.depth()
+        functions = self.compiler.functions
+        builtins = self.compiler.builtins
+        leaves = self._leaves
+        
+        try:
+            while stack:
+                op, item, env = stack.pop()
+                
+                if op == _EVAL:
+                    if item.__class__ is MeTTaAtom:
+                        if item.type is MeTTaType.VARIABLE:
+                            values.append(env.get(item.value, item.value))
+                        else:
+                            values.append(item.value)
+                        continue
+                    
+                    leaf = leaves.get(item, _MISSING)
+                    if leaf is _MISSING:
+                        leaf = self._leaf(item)
+                    if leaf is not None:
+                        values.append(leaf(env))
+                        continue
+                    
+                    atoms = item.atoms
+                    head = atoms[0] if atoms else None
+                    if head.__class__ is not MeTTaAtom or head.type is not MeTTaType.ATOM:
+                        values.append(_substitute(item, env))
+                        continue
+                    
+                    name = head.value
+                    args = atoms[1:]
+                    if strict and name in _CHOICE_FORMS:
+                        raise _ChoicePoint(name)
+                    if name in _INTERPRETED_FORMS:
+                        if name == 'if':
+                            if len(args) < 3:
+                                values.append(None)
+                            else:
+                                stack.append((_IF, args, env))
+                                stack.append((_EVAL, args[0], env))
+                        elif name == 'let':
+                            if len(args) < 3 or len(args) % 2 == 0:
+                                values.append(None)
+                                continue
+                            # Same bindings as the compiled let: literals and variables now, the rest lazily
+                            for target, value in zip(args[:-1:2], args[1:-1:2]):
+                                if value.__class__ is MeTTaAtom:
+                                    bound = env.get(value.value, value.value) if value.type is MeTTaType.VARIABLE else value.value
+                                elif strict:
+                                    bound = _Lazy(functools.partial(self._strict_value, value), env)
+                                else:
+                                    bound = _Lazy(self._closure(value), env)
+                                env = Scope({target.value if target.__class__ is MeTTaAtom else str(target): bound}, env)
+                            stack.append((_EVAL, args[-1], env))
+                        elif not args:
+                            values.append(name == 'and')
+                        else:
+                            stack.append((_AND if name == 'and' else _OR, (args, 0), env))
+                            stack.append((_EVAL, args[0], env))
+                        continue
+                    
+                    if name in VALUE_BUILTINS:
+                        stack.append((_APPLY, (name, len(args)), None))
+                    elif name in builtins:
+                        values.append(self._closure(item)(env))
+                        continue
+                    else:
+                        stack.append((_CALL, (name, len(args)), None))
+                    stack.extend((_EVAL, arg, env) for arg in reversed(args))
+                
+                elif op == _IF:
+                    stack.append((_EVAL, item[1] if _is_true(values.pop()) else item[2], env))
+                
+                elif op == _AND or op == _OR:
+                    args, index = item
+                    value = _is_true(values.pop())
+                    if (not value) if op == _AND else value:
+                        values.append(op == _OR)
+                    elif index + 1 == len(args):
+                        values.append(value)
+                    else:
+                        stack.append((op, (args, index + 1), env))
+                        stack.append((_EVAL, args[index + 1], env))
+                
+                elif op == _APPLY:
+                    name, count = item
+                    args = values[len(values) - count:]
+                    del values[len(values) - count:]
+                    values.append(VALUE_BUILTINS[name](*args))
+                
+                elif op == _CALL:
+                    name, count = item
+                    args = tuple(values[len(values) - count:])
+                    del values[len(values) - count:]
+                    
+                    function = env if env is not None else functions.get(name)
+                    if function is None:
+                        values.append(_residual(name, args))
+                        continue
+                    
+                    # Tables hold first results, which a strict evaluation cannot take on trust
+                    table = None if strict else function.table
+                    key = None
+                    if table is not None:
+                        key = _memo_key(name, args)
+                        try:
+                            result = table.get(key, _MISSING)
+                        except TypeError:
+                            result, key = _MISSING, None
+                        if result is not _MISSING:
+                            if observer is not None:
+                                observer.hit(name, args, result)
+                            values.append(result)
+                            continue
+                    
+                    clauses = iter(function.clauses)
+                    for clause_arity, match, body, _, source in clauses:
+                        if clause_arity != count:
+                            continue
+                        clause_env = match(args)
+                        if clause_env is not None:
+                            break
+                    else:
+                        budget.step()
+                        result = _residual(name, args)
+                        if observer is not None:
+                            observer.enter(name, args)
+                            observer.result(result)
+                            observer.exit()
+                        values.append(result)
+                        continue
+                    
+                    if strict and (source is None or any(clause[0] == count and clause[1](args) is not None
+                                                         for clause in clauses)):
+                        raise _ChoicePoint(name)
+                    
+                    if stack and stack[-1][0] == _RETURN:
+                        # Tail call: the caller returns whatever this returns, so share its continuation
+                        budget.step()
+                        stack[-1][1].append((table, key))
+                    else:
+                        budget.enter()
+                        stack.append((_RETURN, [(table, key)], None))
+                    if observer is not None:
+                        observer.enter(name, args)
+                    
+                    if source is None:
+                        values.append(body(clause_env))
+                    else:
+                        stack.append((_EVAL, source, clause_env))
+                
+                else:  # _RETURN
+                    value = values[-1]
+                    for table, key in item:
+                        if key is not None:
+                            table.put(key, value)
+                        if observer is not None:
+                            observer.result(value)
+                            observer.exit()
+                    budget.depth -= 1
+        finally:
+            budget.depth = base_depth
+            if observer is not None:
+                observer.unwind(base_frames)
+        
+        return values[-1]
+    
+    def _strict_value(self, expr: MeTTaExpression, env: Any) -> Any:
+        return self._run([(_EVAL, expr, env)], [], True)
+
+class _NotVectorizable(Exception):
+    """Raised when an expression cannot be evaluated over whole arrays"""
+
+def _is_numeric(value: Any) -> bool:
+    if NUMPY_AVAILABLE and isinstance(value, np.ndarray):
+        return value.dtype.kind in 'biuf'
+    return isinstance(value, (int, float))
+
+# Elementwise counterparts of NUMERIC_FUNCTIONS: ufunc and arity (None folds two or more arguments)
+VECTOR_FUNCTIONS = {
+    '+': (np.add, 2),
+    '-': (np.subtract, 2),
+    '*': (np.multiply, 2),
+    '/': (np.true_divide, 2),
+    '%': (np.mod, 2),
+    'pow': (np.power, 2),
+    'abs': (np.abs, 1),
+    'min': (np.minimum, None),
+    'max': (np.maximum, None),
+    'sqrt': (np.sqrt, 1),
+    'exp': (np.exp, 1),
+    'log': (np.log, 1),
+    'floor': (np.floor, 1),
+    'ceil': (np.ceil, 1),
+    'round': (np.round, 1),
+} if NUMPY_AVAILABLE else {}
+
+# Elementwise _is_true for object arrays, which may mix bools, symbols and numbers
+_vector_is_true = np.frompyfunc(_is_true, 1, 1) if NUMPY_AVAILABLE else None
+
+class MeTTaVectorEvaluator:
+    """Evaluates rules over NumPy arrays of arguments in a single pass
+    
+    Comparisons broadcast over arrays, `if` becomes np.where and `and`/`or`
+    reduce elementwise, all with the scalar path's notion of truth
+    (_is_true), so the rule AST is interpreted once per batch
+    instead of once per market. A rule call is vectorizable when the first
+    clause of its arity binds only distinct variables, since that clause is
+    the one every element would select; anything else raises
+    _NotVectorizable and the caller falls back to per-market evaluation.
+    
+    Under an evaluation budget (see MeTTaReasoner.evaluation()) each rule
+    application costs one step and one level of depth for the whole batch,
+    as it would for a single market.
+    """
+    
+    def __init__(self, kb: 'MeTTaKnowledgeBase'):
+        self.kb = kb
+        self.builtins = {
+            '>': self._vector_gt,
+            '<': self._vector_lt,
+            '<=': self._vector_le,
+            '>=': self._vector_ge,
+            '==': self._vector_eq,
+            '!=': self._vector_ne,
+            'and': self._vector_and,
+            'or': self._vector_or,
+            'if': self._vector_if,
+            'let': self._vector_let,
+        }
+        if NUMPY_AVAILABLE:
+            for name, (function, arity) in VECTOR_FUNCTIONS.items():
+                self.builtins[name] = functools.partial(self._vector_numeric, function, arity)
+    
+    def call(self, name: str, *args) -> Any:
+        """Apply a rule to array (or scalar) arguments"""
+        
+        rules = self.kb.rules_for(name, len(args))
+        if not rules:
+            raise _NotVectorizable(f"No rule for ({name}) with {len(args)} arguments")
+        
+        head, body = rules[0].atoms[1], rules[0].atoms[2]
+        params = head.atoms[1:]
+        names = [param.value for param in params if _is_variable(param)]
+        if len(names) != len(params) or len(set(names)) != len(names):
+            raise _NotVectorizable(f"First clause of {name} matches on literal arguments")
+        
+        budget = _evaluation.budget
+        if budget is None:
+            return self.evaluate(body, dict(zip(names, args)))
+        
+        budget.enter()
+        if budget.observer is not None:
+            budget.observer.count(name)
+        try:
+            return self.evaluate(body, dict(zip(names, args)))
+        finally:
+            budget.depth -= 1
+    
+    def evaluate(self, expr: Union[MeTTaAtom, MeTTaExpression], env: Dict) -> Any:
+        """Evaluate an expression where variables may be bound to arrays"""
+        
+        if isinstance(expr, MeTTaAtom):
+            if expr.type == MeTTaType.VARIABLE:
+                return env.get(expr.value, expr.value)
+            return expr.value
+        
+        if not expr.atoms or not isinstance(expr.atoms[0], MeTTaAtom):
+            raise _NotVectorizable(f"Cannot vectorize {expr}")
+        
+        name = expr.atoms[0].value
+        args = expr.atoms[1:]
+        
+        builtin = self.builtins.get(name)
+        if builtin is not None:
+            return builtin(args, env)
+        
+        return self.call(name, *(self.evaluate(arg, env) for arg in args))
+    
+    def _number(self, value: Any) -> Any:
+        """A comparison operand; anything the scalar path would leave unreduced falls back"""
+        
+        if type(value) in _NUMBER_TYPES or isinstance(value, np.ndarray) and value.dtype.kind in 'iuf':
+            return value
+        raise _NotVectorizable("Non-numeric operand")
+    
+    def _vector_gt(self, args: List, env: Dict) -> Any:
+        if len(args) < 2:
+            return False
+        return np.greater(self._number(self.evaluate(args[0], env)), self._number(self.evaluate(args[1], env)))
+    
+    def _vector_lt(self, args: List, env: Dict) -> Any:
+        if len(args) < 2:
+            return False
+        return np.less(self._number(self.evaluate(args[0], env)), self._number(self.evaluate(args[1], env)))
+    
+    def _vector_le(self, args: List, env: Dict) -> Any:
+        if len(args) < 2:
+            return False
+        return np.less_equal(self._number(self.evaluate(args[0], env)), self._number(self.evaluate(args[1], env)))
+    
+    def _vector_ge(self, args: List, env: Dict) -> Any:
+        if len(args) < 2:
+            return False
+        return np.greater_equal(self._number(self.evaluate(args[0], env)), self._number(self.evaluate(args[1], env)))
+    
+    def _vector_eq(self, args: List, env: Dict) -> Any:
+        if len(args) < 2:
+            return False
+        left, right = self.evaluate(args[0], env), self.evaluate(args[1], env)
+        if isinstance(left, np.ndarray) or isinstance(right, np.ndarray):
+            return np.asarray(left, dtype=object) == np.asarray(right, dtype=object)
+        return left == right
+    
+    def _vector_ne(self, args: List, env: Dict) -> Any:
+        return np.logical_not(self._vector_eq(args, env)) if len(args) >= 2 else False
+    
+    def _vector_numeric(self, function: Callable, arity: Optional[int], args: List, env: Dict) -> Any:
+        """Elementwise arithmetic; anything the scalar path would leave unreduced falls back"""
+        
+        values = [self.evaluate(arg, env) for arg in args]
+        if not values or not all(type(value) in _NUMBER_TYPES or isinstance(value, np.ndarray) and value.dtype.kind in 'iuf'
+                                 for value in values):
+            raise _NotVectorizable("Non-numeric operand")
+        if arity is None and len(values) < 2 or arity is not None and len(values) != arity:
+            raise _NotVectorizable(f"Wrong number of arguments: {len(values)}")
+        
+        # Division by zero, overflow and domain errors raise per market instead of producing inf/nan
+        with np.errstate(all='raise'):
+            try:
+                return functools.reduce(function, values) if arity is None else function(*values)
+            except _NUMERIC_ERRORS:
+                raise _NotVectorizable("Numeric error in batch")
+    
+    @staticmethod
+    def _truth(value: Any) -> Any:
+        """Vector counterpart of _is_true: a bool array for an array, else a bool"""
+        
+        if not isinstance(value, np.ndarray):
+            return _is_true(value)
+        if value.dtype.kind == 'b':
+            return value
+        return _vector_is_true(value).astype(bool)
+    
+    def _vector_and(self, args: List, env: Dict) -> Any:
+        # Stop as soon as an operand is false for every element
+        values = []
+        for arg in args:
+            value = self._truth(self.evaluate(arg, env))
+            if not (value.any() if isinstance(value, np.ndarray) else value):
+                return False
+            values.append(value)
+        return functools.reduce(np.logical_and, values) if values else True
+    
+    def _vector_or(self, args: List, env: Dict) -> Any:
+        # Stop as soon as an operand is true for every element
+        values = []
+        for arg in args:
+            value = self._truth(self.evaluate(arg, env))
+            if value.all() if isinstance(value, np.ndarray) else value:
+                return True
+            values.append(value)
+        return functools.reduce(np.logical_or, values) if values else False
+    
+    def _vector_if(self, args: List, env: Dict) -> Any:
+        if len(args) < 3:
+            raise _NotVectorizable("Incomplete if")
+        
+        condition = self._truth(self.evaluate(args[0], env))
+        if isinstance(condition, np.ndarray) and (condition.all() or not condition.any()):
+            condition = bool(condition.all())
+        if not isinstance(condition, np.ndarray):
+            return self.evaluate(args[1] if condition else args[2], env)
+        
+        then, otherwise = self.evaluate(args[1], env), self.evaluate(args[2], env)
+        if not (_is_numeric(then) and _is_numeric(otherwise)):
+            # Keep symbols as Python objects; np.where would otherwise coerce numbers to strings
+            then, otherwise = self._objects(then), self._objects(otherwise)
+        return np.where(condition, then, otherwise)
+    
+    @staticmethod
+    def _objects(value: Any) -> Any:
+        if isinstance(value, np.ndarray):
+            return value.astype(object)
+        array = np.empty((), dtype=object)
+        array[()] = value
+        return array
+    
+    def _vector_let(self, args: List, env: Dict) -> Any:
+        if len(args) < 3 or len(args) % 2 == 0:
+            raise _NotVectorizable("Incomplete let")
+        for target, value in zip(args[:-1:2], args[1:-1:2]):
+            name = target.value if isinstance(target, MeTTaAtom) else str(target)
+            env = Scope({name: _Lazy(functools.partial(self.evaluate, value), env)}, env)
+        return self.evaluate(args[-1], env)
+
+# Base confidence per contrarian signal, then scaled by the market's risk level
+CONTRARIAN_CONFIDENCE = {'high-contrarian': 0.8, 'medium-contrarian': 0.6}
+RISK_CONFIDENCE_FACTOR = {'low-risk': 1.2, 'high-risk': 0.7}
+DEFAULT_CONFIDENCE = 0.5
+MAX_CONFIDENCE = 0.95
+
+class LRUCache:
+    """Thread-safe bounded mapping with least-recently-used eviction
+    
+    Hit and miss counters are kept so callers can size the cache from
+    real traffic (see info()).
+    """
+    
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key: Any, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def info(self) -> Dict[str, int]:
+        """Hit/miss counters and current size"""
+        
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
+class MemoTable:
+    """Bounded memo table for rule applications
+    
+    Reads are a single dict lookup with no locking, which keeps lookups
+    cheaper than re-evaluating even small rules. When the table is full
+    the oldest quarter of the entries is evicted in insertion order
+    (FIFO); evicting in bulk keeps the cost amortized, and only eviction
+    takes the lock.
+    """
+    
+    def __init__(self, maxsize: int = 16384):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key: Any, default: Any = None) -> Any:
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+    
+    def put(self, key: Any, value: Any):
+        data = self._data
+        data[key] = value
+        if len(data) > self.maxsize:
+            with self._lock:
+                while len(data) > self.maxsize:
+                    try:
+                        oldest = list(itertools.islice(data, max(1, self.maxsize // 4)))
+                    except RuntimeError:
+                        # Another thread inserted mid-iteration; retry with a fresh iterator
+                        continue
+                    for stale in oldest:
+                        data.pop(stale, None)
+    
+    def clear(self):
+        self._data.clear()
+    
+    def copy(self, exclude: Optional[set] = None) -> 'MemoTable':
+        """New table with the same entries and counters, minus those for heads in exclude"""
+        
+        table = MemoTable(self.maxsize)
+        table.hits, table.misses = self.hits, self.misses
+        data = self._data.copy()
+        table._data = {key: value for key, value in data.items() if key[0] not in exclude} if exclude else data
+        return table
+    
+    def info(self) -> Dict[str, int]:
+        """Hit/miss counters and current size"""
+        
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
+class MeTTaQuery:
+    """A parsed and compiled query whose $variables are bound at run time
+    
+    Created by MeTTaReasoner.query_template; run() evaluates it without any
+    string formatting or re-parsing:
+    
+        risk = reasoner.query_template("(risk-level $volume $ratio)")
+        risk.run(volume=8000, ratio=0.55)
+    
+    run() returns every result, iter() yields them lazily, and first()
+    takes the fast path that only ever computes the first one.
+    """
+    
+    def __init__(self, reasoner: 'MeTTaReasoner', text: str, expr: Union[MeTTaAtom, MeTTaExpression],
+                 compiled: Callable[[Dict], Any], results: Callable[[Dict], Iterable[Any]]):
+        self.reasoner = reasoner
+        self.text = text
+        self.compiled = compiled
+        self.results = results
+        self.variables = frozenset(_variables_in(expr))
+    
+    def run(self, **bindings) -> List[Any]:
+        """Evaluate with keyword bindings; `time_remaining` also binds `$time-remaining`"""
+        
+        env = self._scope(bindings)
+        try:
+            return list(self.reasoner._results(self.results, env))
+        except MeTTaBudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error executing query: {self.text} - {e}")
+            return []
+    
+    def iter(self, **bindings) -> Iterator[Any]:
+        """Results one at a time; evaluation stops when the caller does"""
+        
+        env = self._scope(bindings)
+        try:
+            yield from self.reasoner._results(self.results, env)
+        except MeTTaBudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error executing query: {self.text} - {e}")
+    
+    def first(self, **bindings) -> Any:
+        """The first result only, or None if evaluation fails (running out of budget still raises)"""
+        
+        env = self._scope(bindings)
+        try:
+            return self.reasoner._first(self.compiled, env)
+        except MeTTaBudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error executing query: {self.text} - {e}")
+            return None
+    
+    def _scope(self, bindings: Dict[str, Any]) -> Scope:
+        values = {}
+        for name, value in bindings.items():
+            variable = '$' + name
+            if variable not in self.variables:
+                variable = '$' + name.replace('_', '-')
+                if variable not in self.variables:
+                    raise TypeError(f"Query {self.text} has no variable ${name}")
+            values[variable] = value
+        return Scope(values, self.reasoner.bindings)
+    
+    def __repr__(self):
+        return f"MeTTaQuery({self.text!r})"
+
+def _variables_in(expr: Union[MeTTaAtom, MeTTaExpression]) -> List[str]:
+    """Names of all $variables in an expression, in order of appearance"""
+    
+    names = []
+    pending = [expr]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, MeTTaExpression):
+            pending.extend(reversed(node.atoms))
+        elif node.type == MeTTaType.VARIABLE:
+            names.append(node.value)
+    return names
+
+# Built-in market analysis rules, loaded before metta_knowledge_base.metta
+MARKET_RULES = (
+    # Contrarian strategy rules
+    """
+    (= (contrarian-signal $ratio)
+       (if (> $ratio 0.75) high-contrarian
+           (if (> $ratio 0.65) medium-contrarian
+               low-contrarian)))
+    """,
+    """
+    (= (risk-level $volume $ratio)
+       (if (< $volume 1000) high-risk
+           (if (and (> $volume 5000) (< $ratio 0.6) (> $ratio 0.4)) low-risk
+               medium-risk)))
+    """,
+    """
+    (= (confidence $ratio $volume)
+       (let $contrarian (contrarian-signal $ratio)
+            $risk (risk-level $volume $ratio)
+            (if (and (== $contrarian high-contrarian) (== $risk low-risk)) 0.9
+                (if (== $contrarian medium-contrarian) 0.7
+                    0.5))))
+    """,
+    # Betting recommendation rules
+    """
+    (= (betting-recommendation $ratio $volume)
+       (if (and (> $ratio 0.75) (> $volume 1000)) BUY_B
+           (if (and (< $ratio 0.25) (> $volume 1000)) BUY_A
+               HOLD)))
+    """,
+)
+
+# Snapshots live next to the knowledge-base file, e.g. metta_knowledge_base.metta.cache
+SNAPSHOT_SUFFIX = '.cache'
+
+class MeTTaReasoner:
+    """MeTTa reasoning engine
+    
+    A loaded reasoner can be shared by many threads: evaluation never
+    writes to shared state (each call gets its own Scope), and a rule
+    table rebuilt after a knowledge-base change is swapped in atomically.
+    `bindings` holds global defaults visible to every query; the engine
+    only reads it. reload() (or a watch() thread) applies edits to the
+    knowledge-base file while the reasoner is in use.
+    
+    Every query and analyze_market call runs under an EvaluationBudget
+    built from max_steps, max_depth and timeout (seconds, none unless
+    METTA_TIMEOUT is set); a runaway rule raises MeTTaBudgetExceeded,
+    logged with what the evaluation used, instead of recursing until the
+    interpreter gives up, and analyze_market falls back to its heuristic
+    analysis.
+    Deeply nested rules and calls continue on MeTTaInterpreter's explicit
+    stack, so max_depth rather than Python's recursion limit bounds them.
+    
+    With load_workers > 1 (METTA_LOAD_WORKERS), a knowledge-base file of at
+    least PARALLEL_LOAD_MIN_BYTES that has no current snapshot is parsed in
+    that many processes.
+    
+    profile() attaches a MeTTaProfiler to measure which rules the time goes
+    to. analyze_market records the rules it applies as a MeTTaDerivation
+    and explains its decision with it in `reasoning`; the last
+    `derivation_history` of them are kept in `derivations` (0 disables
+    recording). With trace_rules, `metta_analysis` lists the rules fired.
+    """
+    
+    def __init__(self, query_cache_size: int = 1024, table_size: int = 16384,
+                 knowledge_base_file: str = "metta_knowledge_base.metta", use_snapshot: bool = True,
+                 max_results: int = MAX_RESULTS, max_steps: Optional[int] = DEFAULT_MAX_STEPS,
+                 max_depth: Optional[int] = DEFAULT_MAX_DEPTH, timeout: Optional[float] = DEFAULT_TIMEOUT,
+                 trace_rules: bool = False, derivation_history: int = 256, load_workers: int = DEFAULT_LOAD_WORKERS):
+        self.kb = MeTTaKnowledgeBase()
+        self.knowledge_base_file = knowledge_base_file
+        self.use_snapshot = use_snapshot
+        self.load_workers = load_workers
+        self.parser = MeTTaParser()
+        self.bindings = {}
+        
+        # Query text -> compiled closure, so repeated queries skip parsing and compilation
+        self.query_cache = LRUCache(query_cache_size)
+        
+        # (rule head, arguments) -> result of that pure rule application; 0 disables tabling
+        self.table_size = table_size
+        self.table = MemoTable(table_size) if table_size > 0 else None
+        
+        # Rule heads -> compiled functions, rebuilt whenever the knowledge base changes
+        self.functions: Dict[str, MeTTaFunction] = {}
+        # Bound on the results of one query, and on those gathered by one argument or collapse
+        self.max_results = max_results
+        self.compiler = MeTTaCompiler(self.functions, self.kb, max_results)
+        
+        # Limits of each query / analyze_market call; None disables a limit
+        self.max_steps = max_steps
+        self.max_depth = max_depth
+        self.timeout = timeout
+        # Profiler attached by profile(), if any; trace_rules reports fired rules in analyze_market results
+        self.profiler: Optional[MeTTaProfiler] = None
+        self.trace_rules = trace_rules
+        # Ring buffer of analyze_market's most recent derivations, newest last
+        self.derivations = deque(maxlen=derivation_history) if derivation_history > 0 else None
+        self._compiled_version = -1
+        self._compile_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        self.vector_evaluator = MeTTaVectorEvaluator(self.kb)
+        
+        # Load market analysis rules
+        self._load_market_rules()
+        self._compile_rules()
+        
+        # Queries issued by analyze_market, with the market's numbers bound per call
+        self._contrarian_query = self.query_template("(contrarian-signal $ratio)")
+        self._risk_query = self.query_template("(risk-level $volume $ratio)")
+        self._recommendation_query = self.query_template("(betting-recommendation $ratio $volume)")
+    
+    def _load_market_rules(self):
+        """Load built-in market analysis rules
+        
+        When snapshots are enabled, a binary snapshot of the parsed rules is
+        kept next to the knowledge-base file and reused as long as neither the
+        built-in rules nor the file have changed.
+        """
+        
+        try:
+            with open(self.knowledge_base_file, 'rb') as f:
+                source = f.read()
+        except OSError:
+            source = None
+        
+        snapshot_path = self.knowledge_base_file + SNAPSHOT_SUFFIX
+        source_hash = snapshot_hash(*MARKET_RULES, source)
+        if not (self.use_snapshot and self.kb.load_snapshot(snapshot_path, source_hash)):
+            self._parse_sources(source, source_hash)
+        
+        # Built-in rules come first; everything after them came from the file and is what reload() diffs
+        self._file_rules = self.kb.rules[len(MARKET_RULES):]
+        self._file_facts = list(self.kb.facts)
+        self._file_source = source
+        self._file_keys = None
+        self._source_hash = source_hash
+    
+    def _parse_sources(self, source: Optional[bytes], source_hash: bytes):
+        """Parse the built-in rules and the knowledge-base file, then snapshot them"""
+        
+        for rule in MARKET_RULES:
+            self.kb.add_rule(rule)
+        
+        # Load from external file if available
+        if source is None:
+            print(f"MeTTa file not found: {self.knowledge_base_file}")
+            return
+        if self.load_workers > 1 and len(source) >= PARALLEL_LOAD_MIN_BYTES:
+            loaded = self.kb.load_from_file(self.knowledge_base_file, workers=self.load_workers)
+        else:
+            try:
+                loaded = self.kb.load_source(source.decode('utf-8'), self.knowledge_base_file)
+            except UnicodeDecodeError as e:
+                print(f"Error loading MeTTa file: {e}")
+                return
+        
+        # A file with errors is never snapshotted, so the error is reported on every start
+        if loaded and self.use_snapshot:
+            self.kb.save_snapshot(self.knowledge_base_file + SNAPSHOT_SUFFIX, source_hash)
+    
+    def reload(self) -> Dict[str, int]:
+        """Re-read the knowledge-base file and apply only what changed
+        
+        New forms are diffed against the loaded ones by structure; unchanged
+        rules keep their compiled functions, changed ones are recompiled and
+        swapped in atomically, and tabled results are dropped only for the
+        changed functions and their callers. A file that fails to parse
+        leaves the current rules in place. Returns the number of forms added
+        and removed.
+        """
+        
+        with self._reload_lock:
+            try:
+                with open(self.knowledge_base_file, 'rb') as f:
+                    source = f.read()
+            except OSError as e:
+                print(f"⚠️ Could not reload MeTTa file {self.knowledge_base_file}: {e}")
+                return {"added": 0, "removed": 0}
+            
+            source_hash = snapshot_hash(*MARKET_RULES, source)
+            if source_hash == self._source_hash:
+                return {"added": 0, "removed": 0}
+            
+            try:
+                sources = self.kb.parser.split_forms(source.decode('utf-8'))
+            except (MeTTaSyntaxError, UnicodeDecodeError) as e:
+                print(f"⚠️ Keeping current MeTTa rules, {self.knowledge_base_file} has errors: {e}")
+                return {"added": 0, "removed": 0}
+            
+            # Forms whose source is unchanged keep their loaded object; only the rest are parsed
+            loaded = {}
+            rule_keys, fact_keys = self._loaded_keys()
+            for key, form in itertools.chain(zip(reversed(rule_keys), reversed(self._file_rules)),
+                                             zip(reversed(fact_keys), reversed(self._file_facts))):
+                loaded.setdefault(key, []).append(form)
+            
+            new_rules, new_facts = [], []
+            new_rule_keys, new_fact_keys = [], []
+            for key, _ in sources:
+                matches = loaded.get(key)
+                form = matches.pop() if matches else self.kb.parser.parse(key)
+                if self.kb._is_rule(form):
+                    new_rules.append(form)
+                    new_rule_keys.append(key)
+                else:
+                    new_facts.append(form)
+                    new_fact_keys.append(key)
+            
+            old_forms = self._file_rules + self._file_facts
+            new_forms = new_rules + new_facts
+            old_ids = {id(form) for form in old_forms}
+            new_ids = {id(form) for form in new_forms}
+            removed = [form for form in old_forms if id(form) not in new_ids]
+            added = [form for form in new_forms if id(form) not in old_ids]
+            changed_heads = {_rule_head(form) for form in removed + added} - {None}
+            # Rules that (match ...) against the facts depend on them like on a function
+            if any(not self.kb._is_rule(form) for form in removed + added):
+                changed_heads.add('match')
+            
+            with self._compile_lock:
+                up_to_date = self._compiled_version == self.kb.version
+                self.kb.replace_forms(old_forms, new_forms)
+                # Otherwise the next query recompiles everything anyway
+                if up_to_date:
+                    self._recompile_functions(changed_heads)
+            
+            self._file_rules, self._file_facts = new_rules, new_facts
+            self._file_keys = (new_rule_keys, new_fact_keys)
+            self._file_source = source
+            self._source_hash = source_hash
+            if self.use_snapshot:
+                self.kb.save_snapshot(self.knowledge_base_file + SNAPSHOT_SUFFIX, source_hash)
+            
+            print(f"🔄 Reloaded {self.knowledge_base_file}: {len(added)} added, {len(removed)} removed")
+            return {"added": len(added), "removed": len(removed)}
+    
+    def _loaded_keys(self) -> Tuple[List[str], List[str]]:
+        """Canonical sources of the loaded file rules and facts, in load order
+        
+        Computed on the first reload from the source the forms were loaded
+        from. If that source did not load cleanly the forms cannot be paired
+        with it, and nothing is reused.
+        """
+        
+        if self._file_keys is None:
+            try:
+                sources = self.kb.parser.split_forms(self._file_source.decode('utf-8')) if self._file_source else []
+            except (MeTTaSyntaxError, UnicodeDecodeError):
+                return [], []
+            rule_keys = [key for key, is_rule in sources if is_rule]
+            fact_keys = [key for key, is_rule in sources if not is_rule]
+            if len(rule_keys) != len(self._file_rules) or len(fact_keys) != len(self._file_facts):
+                return [], []
+            self._file_keys = (rule_keys, fact_keys)
+        return self._file_keys
+    
+    def watch(self, interval: float = 1.0) -> threading.Thread:
+        """Reload the knowledge-base file from a background thread whenever it changes"""
+        
+        if self._watcher is not None and self._watcher.is_alive():
+            return self._watcher
+        
+        stop = self._stop_watching = threading.Event()
+        
+        def poll():
+            last = self._file_signature()
+            while not stop.wait(interval):
+                signature = self._file_signature()
+                if signature == last:
+                    continue
+                last = signature
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"⚠️ MeTTa reload failed: {e}")
+        
+        self._watcher = threading.Thread(target=poll, name="metta-watch", daemon=True)
+        self._watcher.start()
+        return self._watcher
+    
+    def stop_watching(self):
+        """Stop the thread started by watch()"""
+        
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+    
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.knowledge_base_file)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def _recompile_functions(self, names: set):
+        """Recompile only the named functions and swap in the new table; call with _compile_lock held
+        
+        Every other function keeps its compiled clauses. Tabled results are
+        kept too, except for the named functions and anything calling them,
+        directly or not.
+        """
+        
+        rules = self.kb.rules
+        if names:
+            callers = {}
+            for rule in rules:
+                head = _rule_head(rule)
+                if head is not None:
+                    for callee in _called_heads(rule.atoms[2]):
+                        callers.setdefault(callee, set()).add(head)
+            
+            stale = set(names)
+            pending = list(names)
+            while pending:
+                for caller in callers.get(pending.pop(), ()):
+                    if caller not in stale:
+                        stale.add(caller)
+                        pending.append(caller)
+            
+            table = self.table.copy(exclude=stale) if self.table is not None else None
+            functions = {}
+            for name, function in self.functions.items():
+                if name not in names:
+                    clone = functions[name] = MeTTaFunction(name, table, function.interpreter)
+                    clone.clauses = list(function.clauses)
+            for rule in rules:
+                if _rule_head(rule) in names:
+                    try:
+                        self.compiler.compile_rule(rule, functions, table)
+                    except Exception as e:
+                        print(f"Error compiling rule: {rule} - {e}")
+            
+            self.compiler.functions = self.functions = functions
+            self.table = table
+        
+        self._compiled_version = self.kb.version
+    
+    def _compile_rules(self):
+        """Bring the compiled function table up to date with the knowledge base and swap it in
+        
+        After the first compilation only the functions whose rules changed
+        since are recompiled, as by reload(); the rest keep their clauses
+        and tabled results. Calls already running keep the old table and its
+        memo table, so they finish consistently and cannot leave stale
+        results in the new one.
+        """
+        
+        with self._compile_lock:
+            version = self.kb.version
+            if version == self._compiled_version:
+                return
+            
+            changed = self.kb.changed_heads(self._compiled_version) if self._compiled_version >= 0 else None
+            if changed is not None:
+                self._recompile_functions(changed)
+                self._compiled_version = version
+                return
+            
+            table = None
+            if self.table_size > 0:
+                table = MemoTable(self.table_size)
+                if self.table is not None:
+                    table.hits, table.misses = self.table.hits, self.table.misses
+            
+            functions = self.compiler.compile_rules(list(self.kb.rules), table)
+            self.compiler.functions = self.functions = functions
+            self.table = table
+            self._compiled_version = version
+    
+    def query(self, query_text: str) -> List[Any]:
+        """Execute MeTTa query, returning all of its results (at most max_results)
+        
+        Raises MeTTaBudgetExceeded if the evaluation runs out of budget.
+        """
+        
+        try:
+            return list(self._results(self._compile_query(query_text)[2], self.bindings))
+        except MeTTaBudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error executing query: {query_text} - {e}")
+            return []
+    
+    def iter_query(self, query_text: str) -> Iterator[Any]:
+        """Execute MeTTa query, producing results lazily
+        
+        `next(reasoner.iter_query(text))` evaluates only as far as the first
+        result; later ones are computed as the caller asks for them.
+        """
+        
+        try:
+            yield from self._results(self._compile_query(query_text)[2], self.bindings)
+        except MeTTaBudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error executing query: {query_text} - {e}")
+    
+    def new_budget(self) -> EvaluationBudget:
+        """A fresh budget with this reasoner's limits"""
+        
+        return EvaluationBudget(self.max_steps, self.max_depth, self.timeout, self.profiler)
+    
+    def explain(self, derivation: Optional[MeTTaDerivation] = None) -> str:
+        """Render a derivation (by default the latest analyze_market's) with parameters named"""
+        
+        if derivation is None:
+            if not self.derivations:
+                return ""
+            derivation = self.derivations[-1]
+        return derivation.render(self.functions)
+    
+    @contextlib.contextmanager
+    def profile(self, profiler: Optional[MeTTaProfiler] = None) -> Iterator[MeTTaProfiler]:
+        """Profile every evaluation started inside the block, in any thread
+        
+            with reasoner.profile() as profiler:
+                reasoner.analyze_market(market)
+            profiler.stats()  # {'contrarian-signal': {'calls': 1, 'table_hits': 0, ...}, ...}
+            profiler.write_collapsed("metta.folded")
+        """
+        
+        if profiler is None:
+            profiler = MeTTaProfiler()
+        previous, self.profiler = self.profiler, profiler
+        try:
+            yield profiler
+        finally:
+            self.profiler = previous
+    
+    @contextlib.contextmanager
+    def evaluation(self, budget: Optional[EvaluationBudget] = None) -> Iterator[EvaluationBudget]:
+        """Run every query inside the block under one budget, e.g. to read its counters
+        
+            with reasoner.evaluation() as budget:
+                reasoner.query("(kelly-bet-size 0.2 2.0)")
+            budget.info()  # {'steps': 1, 'max_depth': 1, 'elapsed_ms': ...}
+        """
+        
+        if budget is None:
+            budget = self.new_budget()
+        previous, _evaluation.budget = _evaluation.budget, budget
+        try:
+            yield budget
+        finally:
+            _evaluation.budget = previous
+    
+    def query_template(self, query_text: str) -> MeTTaQuery:
+        """Parse and compile a query once; bind its $variables per run()"""
+        
+        return MeTTaQuery(self, query_text, *self._compile_query(query_text))
+    
+    def match(self, pattern: Union[MeTTaAtom, MeTTaExpression, str]) -> Iterator[Dict[str, Union[MeTTaAtom, MeTTaExpression]]]:
+        """Unify a pattern against the knowledge base, yielding one binding set per match
+        
+            >>> for bindings in reasoner.match("(correlated bitcoin $other $weight)"):
+            ...     print(bindings["$other"], bindings["$weight"])
+            ethereum 0.8
+        
+        Results are produced lazily from the indexed candidates, so callers
+        can stop early without materializing the whole result set.
+        """
+        
+        return self.kb.unify(pattern)
+    
+    def query_cache_info(self) -> Dict[str, int]:
+        """Hit/miss counters of the parsed-query cache"""
+        
+        return self.query_cache.info()
+    
+    def table_info(self) -> Dict[str, int]:
+        """Hit/miss counters of the rule-application table"""
+        
+        return self.table.info() if self.table is not None else {"hits": 0, "misses": 0, "size": 0, "maxsize": 0}
+    
+    def _compile_query(self, query_text: str) -> Tuple[Union[MeTTaAtom, MeTTaExpression], Callable[[Dict], Any],
+                                                       Callable[[Dict], Iterable[Any]]]:
+        """Parsed expression plus first-result and all-results closures for a query, cached by its text"""
+        
+        entry = self.query_cache.get(query_text)
+        if entry is None:
+            expr = self.parser.parse(query_text)
+            entry = (expr, self.compiler.compile(expr), self.compiler.compile_all(expr))
+            self.query_cache.put(query_text, entry)
+        return entry
+    
+    def _first(self, compiled: Callable[[Dict], Any], env: Dict) -> Any:
+        """Evaluate a compiled expression's first result under the given bindings
+        
+        Runs under the thread's current budget, or a new one for this call.
+        """
+        
+        if self._compiled_version != self.kb.version:
+            self._compile_rules()
+        
+        budget = _evaluation.budget
+        owner = budget is None
+        if owner:
+            budget = _evaluation.budget = self.new_budget()
+        try:
+            return compiled(env)
+        except RecursionError:
+            error = MeTTaBudgetExceeded("Python recursion limit", budget)
+            if owner:
+                print(f"⚠️ {error}")
+            raise error from None
+        except MeTTaBudgetExceeded as e:
+            # A caller that installed its own budget reports it; see analyze_market
+            if owner:
+                print(f"⚠️ {e}")
+            raise
+        finally:
+            if owner:
+                _evaluation.budget = None
+    
+    def _results(self, results: Callable[[Dict], Iterable[Any]], env: Dict) -> Iterator[Any]:
+        """Lazily evaluate all results of a compiled expression, at most max_results of them
+        
+        The budget is installed only while a result is being computed, so
+        the caller can do other work between results.
+        """
+        
+        if self._compiled_version != self.kb.version:
+            self._compile_rules()
+        
+        owner = _evaluation.budget is None
+        budget = _evaluation.budget or self.new_budget()
+        iterator = iter(results(env))
+        for _ in range(self.max_results):
+            previous, _evaluation.budget = _evaluation.budget, budget
+            try:
+                value = next(iterator, _MISSING)
+            except RecursionError:
+                error = MeTTaBudgetExceeded("Python recursion limit", budget)
+                if owner:
+                    print(f"⚠️ {error}")
+                raise error from None
+            except MeTTaBudgetExceeded as e:
+                if owner:
+                    print(f"⚠️ {e}")
+                raise
+            finally:
+                _evaluation.budget = previous
+            if value is _MISSING:
+                return
+            yield value
+    
+    def analyze_market(self, market_data: Dict) -> Dict:
+        """Analyze market using MeTTa reasoning"""
+        
+        try:
+            option_a_ratio = float(market_data.get("optionARatio", 0.5))
+            total_volume = float(market_data.get("totalVolume", 0))
+            
+            # Variables for this call only; nothing is written to shared reasoner state
+            variables = {'$ratio': option_a_ratio, '$volume': total_volume}
+            
+            # Execute MeTTa queries under one budget; only the first result of each is needed
+            budget = self.new_budget()
+            derivation = None
+            if self.derivations is not None or self.trace_rules:
+                derivation = budget.observer = MeTTaDerivation(budget.observer)
+            previous, _evaluation.budget = _evaluation.budget, budget
+            try:
+                contrarian_signal = self._contrarian_query.first(ratio=option_a_ratio)
+                risk_level = self._risk_query.first(volume=total_volume, ratio=option_a_ratio)
+                recommendation = self._recommendation_query.first(ratio=option_a_ratio, volume=total_volume)
+            finally:
+                _evaluation.budget = previous
+            
+            if recommendation is None:
+                recommendation = 'HOLD'
+            if risk_level is None:
+                risk_level = 'medium-risk'
+            if contrarian_signal is None:
+                contrarian_signal = 'low-contrarian'
+            
+            # Calculate confidence, adjusted by risk
+            confidence = CONTRARIAN_CONFIDENCE.get(contrarian_signal, DEFAULT_CONFIDENCE)
+            confidence = min(MAX_CONFIDENCE, confidence * RISK_CONFIDENCE_FACTOR.get(risk_level, 1.0))
+            
+            analysis = self._format_analysis(option_a_ratio, total_volume, contrarian_signal,
+                                             risk_level, recommendation, confidence, variables, derivation)
+            analysis["evaluation"] = budget.info()
+            if self.derivations is not None:
+                self.derivations.append(derivation)
+            return analysis
+            
+        except MeTTaBudgetExceeded as e:
+            print(f"⚠️ {e}; using fallback analysis")
+            analysis = self._fallback_analysis(market_data)
+            analysis["evaluation"] = e.info
+            return analysis
+        except Exception as e:
+            print(f"MeTTa analysis error: {e}")
+            return self._fallback_analysis(market_data)
+    
+    def analyze_markets(self, batch: Any) -> List[Dict]:
+        """Analyze many markets in one call
+        
+        `batch` may be a list of market dicts, a dict of column arrays, or a
+        pandas DataFrame, each with optionARatio/totalVolume columns. The
+        rules are evaluated over whole NumPy arrays; results have the same
+        shape as analyze_market's, in input order. No rule fires for an
+        individual market, so no derivation is recorded and `reasoning` is
+        the fixed summary; markets that fall back to analyze_market (without
+        NumPy, or for rules that do not vectorize) get one as usual.
+        
+        The batch is evaluated under one budget with the reasoner's limits,
+        and each result's `evaluation` reports that budget's use. A batch
+        that exceeds it is analyzed market by market instead, each market
+        with a budget of its own.
+        """
+        
+        if not NUMPY_AVAILABLE:
+            return [self.analyze_market(market) for market in self._batch_rows(batch)]
+        
+        budget = self.new_budget()
+        try:
+            ratios, volumes = self._batch_columns(batch)
+            if self._compiled_version != self.kb.version:
+                self._compile_rules()
+            
+            previous, _evaluation.budget = _evaluation.budget, budget
+            try:
+                contrarian = self._broadcast(self.vector_evaluator.call('contrarian-signal', ratios), ratios)
+                risk = self._broadcast(self.vector_evaluator.call('risk-level', volumes, ratios), ratios)
+                recommendation = self._broadcast(self.vector_evaluator.call('betting-recommendation', ratios, volumes), ratios)
+            finally:
+                _evaluation.budget = previous
+        except Exception as e:
+            # Rules nested too deeply to vectorize by recursion go the per-market, iterative way too
+            if isinstance(e, MeTTaBudgetExceeded):
+                print(f"⚠️ {e} in batch; analyzing markets one at a time")
+            elif not isinstance(e, (_NotVectorizable, RecursionError)):
+                print(f"Vectorized MeTTa analysis error: {e}")
+            return [self.analyze_market(market) for market in self._batch_rows(batch)]
+        
+        base = np.full(len(ratios), DEFAULT_CONFIDENCE)
+        for signal, value in CONTRARIAN_CONFIDENCE.items():
+            base[contrarian == signal] = value
+        factor = np.ones(len(ratios))
+        for level, value in RISK_CONFIDENCE_FACTOR.items():
+            factor[risk == level] = value
+        confidence = np.minimum(MAX_CONFIDENCE, base * factor)
+        
+        evaluation = budget.info()
+        analyses = []
+        for ratio, volume, signal, level, action, score in zip(
+                ratios.tolist(), volumes.tolist(), contrarian.tolist(),
+                risk.tolist(), recommendation.tolist(), confidence.tolist()):
+            analysis = self._format_analysis(ratio, volume, signal, level, action, score, {'$ratio': ratio, '$volume': volume})
+            analysis["evaluation"] = dict(evaluation)
+            analyses.append(analysis)
+        return analyses
+    
+    @staticmethod
+    def _batch_columns(batch: Any) -> Tuple[Any, Any]:
+        """Extract float arrays of optionARatio and totalVolume from a batch"""
+        
+        if hasattr(batch, 'columns'):
+            count = len(batch)
+            ratios = batch['optionARatio'].to_numpy(dtype=float) if 'optionARatio' in batch.columns else np.full(count, 0.5)
+            volumes = batch['totalVolume'].to_numpy(dtype=float) if 'totalVolume' in batch.columns else np.zeros(count)
+            return ratios, volumes
+        
+        if isinstance(batch, dict):
+            ratios = np.asarray(batch.get('optionARatio', 0.5), dtype=float)
+            volumes = np.asarray(batch.get('totalVolume', 0), dtype=float)
+            ratios, volumes = np.broadcast_arrays(ratios, volumes)
+            return ratios.ravel(), volumes.ravel()
+        
+        count = len(batch)
+        ratios = np.fromiter((float(market.get("optionARatio", 0.5)) for market in batch), float, count)
+        volumes = np.fromiter((float(market.get("totalVolume", 0)) for market in batch), float, count)
+        return ratios, volumes
+    
+    @staticmethod
+    def _batch_rows(batch: Any) -> List[Dict]:
+        """Per-market dicts for a batch, for the one-at-a-time fallback"""
+        
+        if hasattr(batch, 'to_dict'):
+            return batch.to_dict('records')
+        if isinstance(batch, dict):
+            columns = {key: list(values) if isinstance(values, (list, tuple)) or getattr(values, 'ndim', 0) > 0 else [values]
+                       for key, values in batch.items()}
+            count = max((len(values) for values in columns.values()), default=0)
+            return [{key: values[i] if len(values) > 1 else values[0] for key, values in columns.items()}
+                    for i in range(count)]
+        return list(batch)
+    
+    @staticmethod
+    def _broadcast(values: Any, like: Any) -> Any:
+        """Expand a scalar rule result to one object per market"""
+        
+        if isinstance(values, np.ndarray) and values.shape == like.shape:
+            return values
+        return np.broadcast_to(np.asarray(values, dtype=object), like.shape)
+    
+    def _format_analysis(self, option_a_ratio: float, total_volume: float, contrarian_signal: str,
+                         risk_level: str, recommendation: str, confidence: float, variables: Dict,
+                         derivation: Optional[MeTTaDerivation] = None) -> Dict:
+        """Build the analysis dict returned for one market
+        
+        With the derivation that produced it, `reasoning` spells out the rule
+        applications behind the decision instead of only their outcomes.
+        """
+        
+        if derivation is not None and derivation.nodes:
+            reasoning = f"MeTTa analysis: {derivation.render(self.functions)}"
+        else:
+            reasoning = f"MeTTa analysis: {contrarian_signal} detected with {option_a_ratio:.1%} ratio, {risk_level}"
+        metta_analysis = f"Applied MeTTa reasoning with {len(self.kb.rules)} rules"
+        if self.trace_rules and derivation is not None:
+            metta_analysis += f"; fired {', '.join(derivation.fired())}"
+        
+        return {
+            "recommendation": recommendation,
+            "confidence": confidence,
+            "reasoning": reasoning,
+            "risk_level": risk_level.replace('-', '_').upper(),
+            "metta_analysis": metta_analysis,
+            "contrarian_signal": contrarian_signal,
+            "variables_used": variables
+        }
     
     def _fallback_analysis(self, market_data: Dict) -> Dict:
         """Fallback analysis if MeTTa fails"""
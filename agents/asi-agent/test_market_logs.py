@@ -0,0 +1,275 @@
+"""
+Tests for eth_getLogs ingestion, against a fake JSON-RPC session
+"""
+
+import asyncio
+import bisect
+from dataclasses import asdict
+
+import pytest
+
+from market_logs import EVENT_TOPICS, LIMIT_EXCEEDED, LOG_GROW_AFTER, RATE_LIMITED, JSONRPCError, LogIngester, decode_log
+from market_state import MarketStateCache
+
+ADDRESS = "0x7a9d78d1e5fe688f80d4c2c06ca4c0407a967644"
+
+def word(value: int) -> str:
+    return format(value % (1 << 256), "064x")
+
+def topic(value: int) -> str:
+    return "0x" + word(value)
+
+def log(kind: str, block: int, index: int, market_id: int, data: str, *topics: str) -> dict:
+    return {"address": ADDRESS, "topics": [EVENT_TOPICS[kind], topic(market_id), *topics], "data": "0x" + data,
+            "blockNumber": hex(block), "logIndex": hex(index), "removed": False}
+
+def created_log(block: int, index: int, market_id: int, title: str, market_type: int = 0) -> dict:
+    text = title.encode().hex()
+    data = word(64) + word(market_type) + word(len(text) // 2) + text.ljust(-(-len(text) // 64) * 64, "0")
+    return log("MarketCreated", block, index, market_id, data, topic(0xabc))
+
+def bet_log(block: int, index: int, market_id: int, option: int, amount: int, shares: int) -> dict:
+    return log("BetPlaced", block, index, market_id, word(option) + word(amount) + word(shares), topic(1), topic(2))
+
+def resolved_log(block: int, index: int, market_id: int, outcome: int, final_price: int) -> dict:
+    return log("MarketResolved", block, index, market_id, word(outcome) + word(final_price), topic(3))
+
+class TestDecoders:
+    def test_market_created(self):
+        title = "Will BTC close above $100k on 2026-12-31? ✓ " * 3
+        assert decode_log(created_log(100, 2, 7, title, 1)) == {
+            "event": "MarketCreated", "market_id": 7, "title": title, "market_type": 1,
+            "block_number": 100, "log_index": 2}
+
+    def test_bet_placed(self):
+        assert decode_log(bet_log(0x1234, 0, 7, 1, 10 ** 18, 5 * 10 ** 17)) == {
+            "event": "BetPlaced", "market_id": 7, "option": 1, "amount": 10 ** 18, "shares": 5 * 10 ** 17,
+            "block_number": 0x1234, "log_index": 0}
+
+    def test_market_resolved_with_a_negative_price(self):
+        assert decode_log(resolved_log(9, 1, 7, 0, -123456789)) == {
+            "event": "MarketResolved", "market_id": 7, "outcome": 0, "final_price": -123456789,
+            "block_number": 9, "log_index": 1}
+
+    def test_other_and_removed_logs_are_skipped(self):
+        assert decode_log({"topics": ["0x" + "00" * 32], "data": "0x", "blockNumber": "0x1", "logIndex": "0x0"}) is None
+        assert decode_log({"topics": [], "data": "0x"}) is None
+        assert decode_log(dict(bet_log(1, 0, 1, 0, 1, 1), removed=True)) is None
+
+    def test_topics_match_case_insensitively(self):
+        entry = bet_log(1, 0, 1, 0, 1, 1)
+        entry["topics"][0] = entry["topics"][0].upper().replace("0X", "0x")
+        assert decode_log(entry)["event"] == "BetPlaced"
+
+class Response:
+    def __init__(self, reply: dict):
+        self.reply = reply
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    status = 200
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self):
+        await asyncio.sleep(0)
+        return self.reply
+
+class FakeNode:
+    """A JSON-RPC node holding the given logs that refuses eth_getLogs ranges wider than limit blocks"""
+
+    def __init__(self, logs: list, head: int, limit: int, message: str = "block range too large"):
+        self.logs = sorted(logs, key=lambda entry: (int(entry["blockNumber"], 16), int(entry["logIndex"], 16)))
+        self.blocks = [int(entry["blockNumber"], 16) for entry in self.logs]
+        self.head = head
+        self.limit = limit
+        self.message = message
+        self.ranges = []
+
+    def post(self, endpoint: str, json: dict) -> Response:
+        if json["method"] == "eth_blockNumber":
+            return Response({"jsonrpc": "2.0", "id": json["id"], "result": hex(self.head)})
+        query = json["params"][0]
+        first, last = int(query["fromBlock"], 16), int(query["toBlock"], 16)
+        self.ranges.append((first, last))
+        if last - first + 1 > self.limit:
+            return Response({"jsonrpc": "2.0", "id": json["id"],
+                             "error": {"code": LIMIT_EXCEEDED, "message": self.message}})
+        logs = self.logs[bisect.bisect_left(self.blocks, first):bisect.bisect_right(self.blocks, last)]
+        return Response({"jsonrpc": "2.0", "id": json["id"], "result": logs})
+
+def chain_logs(markets: int = 5, bets: int = 20, spacing: int = 37) -> list:
+    logs = [created_log(1000 + market_id, 0, market_id, f"Market {market_id}") for market_id in range(1, markets + 1)]
+    for round_ in range(bets):
+        block = 1000 + markets + 1 + round_ * spacing
+        logs += [bet_log(block, i, market_id, market_id % 2, 10 + round_, 5 + i)
+                 for i, market_id in enumerate(range(1, markets + 1))]
+    return logs
+
+def snapshot(cache: MarketStateCache) -> list:
+    # end_time of a market is only a placeholder set when it is first seen
+    return [dict(asdict(market), end_time=None) for market in cache.markets(ADDRESS)]
+
+def ingester(node: FakeNode, cache: MarketStateCache, **kwargs) -> LogIngester:
+    kwargs.setdefault("confirmations", 0)
+    return LogIngester(lambda: node, "http://node", ADDRESS, cache, start_block=1000, **kwargs)
+
+class TestGetLogs:
+    def test_refused_ranges_are_split_until_accepted(self):
+        logs = chain_logs()
+        node = FakeNode(logs, head=2000, limit=100)
+        fetcher = ingester(node, MarketStateCache(), range_blocks=1000)
+        result = asyncio.run(fetcher.get_logs(1000, 1999))
+        assert sorted(result, key=lambda entry: (entry["blockNumber"], entry["logIndex"])) == \
+            sorted(logs, key=lambda entry: (entry["blockNumber"], entry["logIndex"]))
+        # The width shrank below the node's limit, and may have grown back towards it since
+        assert fetcher.range_blocks < 200
+        accepted = [(first, last) for first, last in node.ranges if last - first + 1 <= 100]
+        assert sum(last - first + 1 for first, last in accepted) == 1000
+
+    def test_split_on_message_without_the_limit_code(self):
+        node = FakeNode(chain_logs(), head=2000, limit=50, message="query returned more than 10000 results")
+        node_post = node.post
+
+        def post(endpoint, json):
+            response = node_post(endpoint, json)
+            if "error" in response.reply:
+                response.reply["error"]["code"] = -32000
+            return response
+
+        node.post = post
+        fetcher = ingester(node, MarketStateCache(), range_blocks=400)
+        expected = [entry for entry in chain_logs() if int(entry["blockNumber"], 16) <= 1399]
+        assert len(asyncio.run(fetcher.get_logs(1000, 1399))) == len(expected)
+
+    def test_other_errors_are_raised(self):
+        node = FakeNode([], head=2000, limit=100)
+        node.post = lambda endpoint, json: Response({"jsonrpc": "2.0", "id": json["id"],
+                                                     "error": {"code": -32602, "message": "invalid address"}})
+        with pytest.raises(JSONRPCError) as error:
+            asyncio.run(ingester(node, MarketStateCache()).get_logs(1000, 1999))
+        assert error.value.code == -32602 and not error.value.range_too_large
+
+    @pytest.mark.parametrize("code, message", [
+        (RATE_LIMITED, "IP Rate limit exceeded on eth_getLogs"),
+        (LIMIT_EXCEEDED, "Your app has exceeded its request rate limited capacity"),
+        (429, "Too many requests"),
+    ])
+    def test_rate_limits_are_not_range_errors(self, code, message):
+        error = JSONRPCError(code, message)
+        assert error.rate_limited and not error.range_too_large
+
+    def test_rate_limited_requests_are_retried_without_splitting(self):
+        logs = chain_logs()
+        node = FakeNode(logs, head=2000, limit=1000)
+        node_post = node.post
+        throttled = []
+
+        def post(endpoint, json):
+            if len(throttled) < 3:
+                throttled.append(json["id"])
+                return Response({"jsonrpc": "2.0", "id": json["id"],
+                                 "error": {"code": RATE_LIMITED, "message": "IP Rate limit exceeded on eth_getLogs"}})
+            return node_post(endpoint, json)
+
+        node.post = post
+        fetcher = ingester(node, MarketStateCache(), range_blocks=1000, backoff=0)
+        assert len(asyncio.run(fetcher.get_logs(1000, 1999))) == len(logs)
+        assert node.ranges == [(1000, 1999)]
+        assert fetcher.range_blocks == 1000 and fetcher.requests == 4
+
+    def test_rate_limit_is_raised_after_the_retries(self):
+        node = FakeNode([], head=2000, limit=100)
+        node.post = lambda endpoint, json: Response({"jsonrpc": "2.0", "id": json["id"],
+                                                     "error": {"code": RATE_LIMITED, "message": "rate limit"}})
+        fetcher = ingester(node, MarketStateCache(), retries=2, backoff=0)
+        with pytest.raises(JSONRPCError) as error:
+            asyncio.run(fetcher.get_logs(1000, 1099))
+        assert error.value.rate_limited and fetcher.requests == 3
+
+    def test_range_grows_back_after_accepted_calls(self):
+        node = FakeNode(chain_logs(), head=5000, limit=100)
+        fetcher = ingester(node, MarketStateCache(), range_blocks=400)
+
+        async def run():
+            await fetcher.get_logs(1000, 1399)
+            shrunk = fetcher.range_blocks
+            node.limit = 400
+            start = 1400
+            for _ in range(3 * LOG_GROW_AFTER):
+                await fetcher.get_logs(start, start + fetcher.range_blocks - 1)
+                start += fetcher.range_blocks
+            return shrunk
+
+        assert asyncio.run(run()) == 100
+        assert fetcher.range_blocks == 400
+
+    def test_a_single_refused_block_is_raised(self):
+        node = FakeNode([], head=2000, limit=0)
+        with pytest.raises(JSONRPCError):
+            asyncio.run(ingester(node, MarketStateCache(), range_blocks=4).get_logs(1000, 1003))
+
+class TestIngest:
+    def expected(self, logs: list) -> list:
+        cache = MarketStateCache()
+        cache.apply(ADDRESS, sorted(map(decode_log, logs), key=lambda event: (event["block_number"], event["log_index"])))
+        return snapshot(cache)
+
+    @pytest.mark.parametrize("range_blocks, concurrency", [(100, 1), (100, 4), (1600, 4), (7, 3)])
+    def test_matches_applying_every_event(self, range_blocks, concurrency):
+        logs = chain_logs()
+        node = FakeNode(logs, head=1800, limit=100)
+        cache = MarketStateCache()
+        fetcher = ingester(node, cache, range_blocks=range_blocks, concurrency=concurrency)
+        assert asyncio.run(fetcher.ingest()) == len(logs)
+        assert snapshot(cache) == self.expected(logs)
+        assert cache.cursor(ADDRESS) == 1800
+
+    def test_confirmations_hold_back_recent_blocks(self):
+        logs = chain_logs()
+        last = max(int(entry["blockNumber"], 16) for entry in logs)
+        cache = MarketStateCache()
+        node = FakeNode(logs, head=last + 5, limit=100)
+        asyncio.run(ingester(node, cache, confirmations=10).ingest())
+        assert cache.cursor(ADDRESS) == last - 5
+        assert sum(market.total_pool for market in cache.markets(ADDRESS)) < \
+            sum(market["total_pool"] for market in self.expected(logs))
+
+    def test_later_calls_resume_from_the_cursor(self):
+        logs = chain_logs()
+        node = FakeNode(logs, head=1800, limit=100)
+        cache = MarketStateCache()
+        fetcher = ingester(node, cache)
+
+        async def run():
+            await fetcher.ingest()
+            node.ranges.clear()
+            node.logs.append(bet_log(1801, 0, 1, 0, 1000, 1000))
+            node.blocks.append(1801)
+            node.head = 1810
+            return await fetcher.ingest()
+
+        assert asyncio.run(run()) == 1
+        assert node.ranges == [(1801, 1810)]
+
+    def test_max_blocks_spreads_a_backfill_over_calls(self):
+        logs = chain_logs()
+        node = FakeNode(logs, head=1800, limit=100)
+        cache = MarketStateCache()
+        fetcher = ingester(node, cache, max_blocks=250)
+
+        async def run():
+            cursors = []
+            while True:
+                await fetcher.ingest()
+                cursors.append((cache.cursor(ADDRESS), fetcher.behind))
+                if not fetcher.behind:
+                    return cursors
+
+        assert asyncio.run(run()) == [(1249, 551), (1499, 301), (1749, 51), (1800, 0)]
+        assert snapshot(cache) == self.expected(logs)
@@ -0,0 +1,92 @@
+"""
+Tests for the incremental market-state cache
+"""
+
+from market_state import MARKET_STATE_FORMAT, MarketStateCache
+
+ADDRESS = "0x7a9D78D1E5fe688F80D4C2c06Ca4C0407A967644"
+
+def created(block, index, market_id, title="Will it rain?", market_type=1):
+    return {"event": "MarketCreated", "block_number": block, "log_index": index,
+            "market_id": market_id, "title": title, "market_type": market_type}
+
+def bet(block, index, market_id, option=0, amount=10, shares=10):
+    return {"event": "BetPlaced", "block_number": block, "log_index": index,
+            "market_id": market_id, "option": option, "amount": amount, "shares": shares}
+
+def resolved(block, index, market_id, outcome=1):
+    return {"event": "MarketResolved", "block_number": block, "log_index": index,
+            "market_id": market_id, "outcome": outcome}
+
+def test_apply_folds_events_into_markets():
+    cache = MarketStateCache()
+    assert cache.apply(ADDRESS, [created(1, 0, 1), bet(2, 0, 1, 0, 30, 25), bet(2, 1, 1, 1, 5, 7), created(3, 0, 2)]) == 4
+    newest, first = cache.markets(ADDRESS)
+    assert (newest.id, first.id) == (2, 1)
+    assert first.title == "Will it rain?" and first.market_type == "custom_event"
+    assert (first.option_a_shares, first.option_b_shares, first.total_pool) == (25, 7, 35)
+    assert cache.cursor(ADDRESS) == 3
+
+def test_events_at_or_before_the_cursor_are_skipped():
+    cache = MarketStateCache()
+    cache.apply(ADDRESS, [created(1, 0, 1), bet(5, 2, 1)])
+    # Replaying a batch that overlaps the last one applies only what is new
+    assert cache.apply(ADDRESS, [bet(5, 2, 1), bet(5, 3, 1), bet(6, 0, 1)]) == 2
+    assert cache.markets(ADDRESS)[0].total_pool == 30
+    assert cache.contract(ADDRESS)["log_index"] == 0
+
+def test_advance_covers_the_whole_block():
+    cache = MarketStateCache()
+    cache.apply(ADDRESS, [created(1, 0, 1)])
+    cache.advance(ADDRESS, 10)
+    assert cache.cursor(ADDRESS) == 10 and cache.contract(ADDRESS)["log_index"] is None
+    assert cache.apply(ADDRESS, [bet(10, 99, 1)]) == 0
+    assert cache.apply(ADDRESS, [bet(11, 0, 1)]) == 1
+    # The cursor never moves backwards
+    cache.advance(ADDRESS, 5)
+    assert cache.cursor(ADDRESS) == 11
+
+def test_unknown_markets_are_created_from_later_events():
+    cache = MarketStateCache()
+    cache.apply(ADDRESS, [bet(7, 0, 42, option=1, amount=3, shares=4), resolved(8, 0, 42, outcome=0)])
+    market = cache.markets(ADDRESS)[0]
+    assert (market.id, market.title, market.option_b_shares) == (42, "Market 42", 4)
+    assert (market.status, market.outcome) == ("resolved", 0)
+
+def test_take_changed_returns_each_market_once_most_recent_first():
+    cache = MarketStateCache()
+    cache.apply(ADDRESS, [created(1, 0, 1), created(1, 1, 2), bet(2, 0, 1)])
+    assert [market.id for market in cache.take_changed(ADDRESS)] == [1, 2]
+    assert cache.take_changed(ADDRESS) == []
+
+def test_mark_changed_requeues_behind_newer_changes():
+    cache = MarketStateCache()
+    cache.apply(ADDRESS, [created(1, 0, 1), created(1, 1, 2), created(1, 2, 3)])
+    newest, middle, _ = cache.take_changed(ADDRESS)
+    cache.apply(ADDRESS, [bet(2, 0, 2)])
+    cache.mark_changed(ADDRESS, [newest, middle])
+    assert [market.id for market in cache.take_changed(ADDRESS)] == [2, 3]
+    assert cache.take_changed(ADDRESS) == []
+
+def test_addresses_are_case_insensitive():
+    cache = MarketStateCache()
+    cache.apply(ADDRESS.lower(), [created(1, 0, 1)])
+    assert cache.cursor(ADDRESS.upper()) == 1
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "market_state.json")
+    cache = MarketStateCache(path)
+    cache.apply(ADDRESS, [created(1, 0, 1), bet(2, 4, 1), resolved(3, 0, 1)])
+    assert cache.save()
+
+    loaded = MarketStateCache(path)
+    assert loaded.markets(ADDRESS) == cache.markets(ADDRESS)
+    assert (loaded.cursor(ADDRESS), loaded.contract(ADDRESS)["log_index"]) == (3, 0)
+    assert loaded.apply(ADDRESS, [resolved(3, 0, 1)]) == 0
+
+def test_other_formats_and_unreadable_files_are_ignored(tmp_path):
+    path = tmp_path / "market_state.json"
+    path.write_text('{"format": %d, "contracts": {}}' % (MARKET_STATE_FORMAT + 1))
+    assert MarketStateCache(str(path)).contracts == {}
+    path.write_text("{not json")
+    assert MarketStateCache(str(path)).contracts == {}
@@ -0,0 +1,343 @@
+"""
+Tests for the MeTTa reasoning engine
+"""
+
+import io
+import random
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+import metta_engine
+from metta_engine import (MeTTaAtom, MeTTaExpression, MeTTaKnowledgeBase, MeTTaParser, MeTTaReasoner,
+                          MeTTaSyntaxError, MeTTaType, snapshot_hash, unify)
+
+SOURCE = """
+; Rules and facts of every shape the parser handles
+(= (contrarian-signal $ratio)
+   (if (> $ratio 0.75) high-contrarian
+       (if (> $ratio 0.65) medium-contrarian low-contrarian)))
+(= (market-category crypto) high-volatility)
+(= (greeting $name) "hello, world (not a form)")
+(price BTC 65000.5)
+(price ETH -3)
+(edge (nested (deeply (nested $x))) $x)
+(note "line one
+line two")
+(flag True)
+"""
+
+def forms_of(kb: MeTTaKnowledgeBase):
+    return [str(form) for form in kb.rules], [str(form) for form in kb.facts]
+
+@pytest.fixture
+def reasoner(tmp_path):
+    return MeTTaReasoner(knowledge_base_file=str(tmp_path / "missing.metta"), use_snapshot=False)
+
+class TestParser:
+    def test_single_pass_matches_legacy(self):
+        for text in ("(= (f $x) (+ $x 1))", "(price BTC 65000.5)", "(a (b (c d)) e)", "atom", "-3"):
+            assert str(MeTTaParser().parse(text)) == str(MeTTaParser("legacy").parse(text))
+
+    def test_parse_all_reads_every_form(self):
+        forms = MeTTaParser().parse_all(SOURCE)
+        assert len(forms) == 8
+        assert forms[3] == MeTTaExpression([MeTTaAtom("price", MeTTaType.ATOM), MeTTaAtom("BTC", MeTTaType.ATOM),
+                                            MeTTaAtom(65000.5, MeTTaType.NUMBER)])
+
+    def test_deep_nesting_is_not_limited_by_recursion(self):
+        depth = 5000
+        form = MeTTaParser().parse("(f " * depth + "x" + ")" * depth)
+        for _ in range(depth):
+            form = form.atoms[1]
+        assert form == MeTTaAtom("x", MeTTaType.ATOM)
+
+    def test_unbalanced_input_is_a_syntax_error(self):
+        with pytest.raises(MeTTaSyntaxError):
+            MeTTaParser().parse_all("(f (g x)")
+        with pytest.raises(MeTTaSyntaxError):
+            MeTTaParser().parse_all('(f "open')
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+    def test_stream_matches_whole_text(self, chunk_size):
+        parser = MeTTaParser()
+        expected = [str(form) for form in parser.parse_all(SOURCE)]
+        assert [str(form) for form in parser.iter_stream(io.StringIO(SOURCE), chunk_size)] == expected
+
+    def test_stream_without_newlines_is_read_in_small_batches(self):
+        source = '; only this first line ends in a newline\n' + '(note "a b") (price ETH 2) ' * 1000
+        parser = MeTTaParser()
+        batches = list(parser._stream_batches(io.StringIO(source), 16))
+        assert "".join(text for text, _, _, _ in batches) == source
+        assert max(len(text) for text, _, _, _ in batches) < len(source) // 100
+        assert [str(form) for form in parser.iter_stream(io.StringIO(source), 16)] == \
+            [str(form) for form in parser.parse_all(source)]
+
+    def test_streamed_file_matches_source_load(self, tmp_path):
+        path = tmp_path / "kb.metta"
+        path.write_text(SOURCE * 50)
+        expected = MeTTaKnowledgeBase()
+        assert expected.load_source(SOURCE * 50)
+
+        streamed = MeTTaKnowledgeBase()
+        assert streamed.load_from_file(str(path), chunk_size=100)
+        assert forms_of(streamed) == forms_of(expected)
+
+    def test_parallel_load_matches_serial_load(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(metta_engine, "PARALLEL_LOAD_MIN_BYTES", 0)
+        path = tmp_path / "kb.metta"
+        path.write_text(SOURCE * 50)
+        serial = MeTTaKnowledgeBase()
+        assert serial.load_from_file(str(path))
+
+        parallel = MeTTaKnowledgeBase()
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            assert parallel.load_from_file(str(path), executor=pool)
+        assert forms_of(parallel) == forms_of(serial)
+
+    def test_reasoner_loads_in_parallel_with_load_workers(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(metta_engine, "PARALLEL_LOAD_MIN_BYTES", 0)
+        load_parallel = MeTTaKnowledgeBase._load_parallel
+        calls = []
+
+        def spy(kb, filename, workers, executor):
+            calls.append(workers)
+            return load_parallel(kb, filename, workers, executor)
+
+        monkeypatch.setattr(MeTTaKnowledgeBase, "_load_parallel", spy)
+        path = tmp_path / "kb.metta"
+        path.write_text(SOURCE * 50)
+        serial = MeTTaReasoner(knowledge_base_file=str(path), use_snapshot=False)
+        assert calls == []
+        parallel = MeTTaReasoner(knowledge_base_file=str(path), use_snapshot=False, load_workers=2)
+        assert calls == [2]
+        assert forms_of(parallel.kb) == forms_of(serial.kb)
+
+class TestClauses:
+    def test_nested_parameters_bind(self, reasoner):
+        reasoner.kb.add_rule("(= (first (pair $a $b)) $a)")
+        reasoner.kb.add_rule("(= (same (pair $a $a)) yes)")
+        assert reasoner.query("(first (pair 1 2))") == [1]
+        assert reasoner.query("(same (pair 3 3))") == ["yes"]
+        assert reasoner.query("(same (pair 3 4))") == [reasoner.parser.parse("(same (pair 3 4))")]
+
+    def test_nested_parameters_bind_in_the_interpreter(self, reasoner):
+        reasoner.kb.add_rule("(= (first (pair $a $b)) $a)")
+        reasoner.query("(first (pair 1 2))")
+        with reasoner.evaluation():
+            assert reasoner.compiler.interpreter.evaluate(reasoner.parser.parse("(first (pair 1 2))"), {}) == 1
+
+    @pytest.mark.parametrize("query, expected", [
+        ("(if (unknown 1) yes no)", "no"),
+        ("(and (unknown 1) True)", False),
+        ("(or (unknown 1) False)", False),
+        ("(if True yes no)", "yes"),
+        ("(if False yes no)", "no"),
+        ("(if (> 2 1) yes no)", "yes"),
+    ])
+    def test_only_true_selects_a_branch(self, reasoner, query, expected):
+        assert reasoner.query(query) == [expected]
+        with reasoner.evaluation():
+            assert reasoner.compiler.interpreter.evaluate(reasoner.parser.parse(query), {}) == expected
+
+    @pytest.mark.parametrize("query", ["(< $unbound 5)", "(> (kelly-bet-size foo 2) -1)", "(>= low-risk 0)",
+                                       "(<= 1 True)"])
+    def test_comparisons_of_non_numbers_do_not_reduce(self, reasoner, query):
+        expr = reasoner.parser.parse(query)
+        assert [str(result) for result in reasoner.query(query)] == [str(expr)]
+        assert reasoner.query(f"(if {query} yes no)") == ["no"]
+        with reasoner.evaluation():
+            assert str(reasoner.compiler.interpreter.evaluate(expr, {})) == str(expr)
+            assert str(reasoner.compiler.compile(expr)({})) == str(expr)
+
+class TestVectorEvaluator:
+    # Conditions the scalar path treats as false, next to the ones it treats as true
+    CONDITIONS = [True, False, "True", "yes", 1, 0.0]
+
+    @pytest.mark.parametrize("body", ["(if $c yes no)", "(if (and $c True) yes no)",
+                                      "(if (or False $c) yes no)", "(and $c $c)", "(or $c False)"])
+    def test_conditions_match_the_scalar_path(self, reasoner, body):
+        np = pytest.importorskip("numpy")
+        compiled = reasoner.compiler.compile(reasoner.parser.parse(body))
+        with reasoner.evaluation():
+            expected = [compiled({"$c": condition}) for condition in self.CONDITIONS]
+
+        reasoner.kb.add_rule(f"(= (check $c) {body})")
+        conditions = np.empty(len(self.CONDITIONS), dtype=object)
+        conditions[:] = self.CONDITIONS
+        assert list(metta_engine.MeTTaVectorEvaluator(reasoner.kb).call("check", conditions)) == expected
+
+class TestTabling:
+    def test_adding_a_rule_keeps_other_functions_and_tables(self, reasoner):
+        reasoner.analyze_market({"optionARatio": 0.8, "totalVolume": 2000})
+        signal = reasoner.functions["contrarian-signal"]
+        tabled = len(reasoner.table)
+        assert tabled
+
+        reasoner.kb.add_rule("(= (double $x) (* $x 2))")
+        assert reasoner.query("(double 21)") == [42]
+        assert reasoner.functions["contrarian-signal"].clauses == signal.clauses
+        assert len(reasoner.table) >= tabled
+
+        reasoner.kb.add_rule("(= (contrarian-signal $ratio) always)")
+        assert reasoner.query("(contrarian-signal 0.9)") == ["high-contrarian", "always"]
+
+    def test_equal_arguments_of_other_types_are_tabled_apart(self, reasoner):
+        # First results are tabled, so evaluate the way analyze_market does rather than through query()
+        reasoner.kb.add_rule("(= (id $x) $x)")
+        reasoner.query("(id 1)")
+        evaluate = reasoner.compiler.interpreter.evaluate
+        with reasoner.evaluation():
+            assert evaluate(reasoner.parser.parse("(id 1)"), {}) == 1
+            assert evaluate(reasoner.parser.parse("(if (id (> 2 1)) yes no)"), {}) == "yes"
+            result = evaluate(reasoner.parser.parse("(id 1.0)"), {})
+            assert result == 1.0 and type(result) is float
+            assert reasoner.functions["id"](True) is True
+
+class TestSnapshot:
+    def test_round_trip(self, tmp_path):
+        kb = MeTTaKnowledgeBase()
+        kb.load_source(SOURCE)
+        path = str(tmp_path / "kb.cache")
+        digest = snapshot_hash(SOURCE)
+        assert kb.save_snapshot(path, digest)
+
+        loaded = MeTTaKnowledgeBase()
+        assert loaded.load_snapshot(path, digest)
+        assert forms_of(loaded) == forms_of(kb)
+        assert loaded.rules_for("market-category", 1) == kb.rules_for("market-category", 1)
+        assert loaded.match("(price $coin $p)") == kb.match("(price $coin $p)")
+
+    def test_stale_or_corrupt_snapshot_is_ignored(self, tmp_path):
+        kb = MeTTaKnowledgeBase()
+        kb.load_source(SOURCE)
+        path = tmp_path / "kb.cache"
+        kb.save_snapshot(str(path), snapshot_hash(SOURCE))
+
+        other = MeTTaKnowledgeBase()
+        assert not other.load_snapshot(str(path), snapshot_hash(SOURCE + "(extra)"))
+        path.write_bytes(path.read_bytes()[:40])
+        assert not other.load_snapshot(str(path), snapshot_hash(SOURCE))
+        assert not other.rules and not other.facts
+
+class TestReload:
+    def test_only_changed_forms_are_replaced(self, tmp_path):
+        path = tmp_path / "kb.metta"
+        path.write_text("(= (double $x) (* $x 2))\n(= (triple $x) (* $x 3))\n(price BTC 1)\n")
+        reasoner = MeTTaReasoner(knowledge_base_file=str(path), use_snapshot=False)
+        assert reasoner.query("(double 2)") == [4]
+        assert reasoner.query("(triple 2)") == [6]
+        triple = reasoner.functions["triple"]
+
+        path.write_text("(= (double $x) (* $x 20))\n(= (triple $x) (* $x 3))\n(price BTC 1)\n(price ETH 2)\n")
+        assert reasoner.reload() == {"added": 2, "removed": 1}
+        assert reasoner.query("(double 2)") == [40]
+        assert reasoner.functions["triple"].clauses == triple.clauses
+        assert len(reasoner.kb.match("(price $coin $p)")) == 2
+
+    def test_unchanged_file_is_a_no_op(self, tmp_path):
+        path = tmp_path / "kb.metta"
+        path.write_text("(= (double $x) (* $x 2))\n")
+        reasoner = MeTTaReasoner(knowledge_base_file=str(path), use_snapshot=False)
+        assert reasoner.reload() == {"added": 0, "removed": 0}
+
+    def test_syntax_error_keeps_current_rules(self, tmp_path):
+        path = tmp_path / "kb.metta"
+        path.write_text("(= (double $x) (* $x 2))\n")
+        reasoner = MeTTaReasoner(knowledge_base_file=str(path), use_snapshot=False)
+        path.write_text("(= (double $x) (* $x 20)\n")
+        reasoner.reload()
+        assert reasoner.query("(double 2)") == [4]
+
+class TestUnify:
+    parse = MeTTaParser().parse
+
+    def test_binds_variables_on_both_sides(self):
+        bindings = unify(self.parse("(price $coin 5)"), self.parse("(price BTC $p)"))
+        assert bindings == {"$coin": MeTTaAtom("BTC", MeTTaType.ATOM)}
+
+    def test_resolves_through_chains(self):
+        # $x is bound to the other side's $z, and $z in turn to (g 1)
+        bindings = unify(self.parse("(f $x $x)"), self.parse("(f $z (g 1))"))
+        assert str(bindings["$x"]) == "(g 1)"
+
+    def test_same_names_on_each_side_are_distinct(self):
+        bindings = unify(self.parse("(f $x 1)"), self.parse("(f 2 $x)"))
+        assert bindings == {"$x": MeTTaAtom(2, MeTTaType.NUMBER)}
+
+    def test_failures(self):
+        assert unify(self.parse("(f 1)"), self.parse("(f 2)")) is None
+        assert unify(self.parse("(f $x $x)"), self.parse("(f 1 2)")) is None
+        assert unify(self.parse("(f $x)"), self.parse("(f 1 2)")) is None
+        # Occurs check: $x cannot be bound to a term containing itself
+        assert unify(self.parse("(f $x $x)"), self.parse("(f $y (g $y))")) is None
+
+    def test_knowledge_base_unify(self):
+        kb = MeTTaKnowledgeBase()
+        kb.load_source(SOURCE)
+        assert [bindings["$p"].value for bindings in kb.unify("(price $coin $p)")] == [65000.5, -3]
+        assert [str(bindings["$y"]) for bindings in kb.unify("(edge $y 7)")] == ["(nested (deeply (nested 7)))"]
+
+class TestConcurrency:
+    def test_shared_reasoner_matches_serial_results(self, reasoner):
+        rng = random.Random(7)
+        markets = [{"optionARatio": round(rng.random(), 3), "totalVolume": rng.randrange(0, 20000)}
+                   for _ in range(1000)]
+
+        # Evaluation counters depend on which results were already tabled, so they are not compared
+        def outcome(market):
+            analysis = reasoner.analyze_market(market)
+            analysis.pop("evaluation")
+            return analysis
+
+        expected = [outcome(market) for market in markets]
+        stop = threading.Event()
+
+        def mutate():
+            # Unrelated facts change the knowledge base, so functions are recompiled mid-flight
+            i = 0
+            while not stop.is_set():
+                reasoner.kb.add_fact(f"(stress-fact {i})")
+                i += 1
+                stop.wait(0.001)
+
+        # Switch threads as often as possible so races on shared state actually interleave
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        mutator = threading.Thread(target=mutate)
+        mutator.start()
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                results = list(pool.map(outcome, markets))
+        finally:
+            stop.set()
+            mutator.join()
+            sys.setswitchinterval(interval)
+        assert results == expected
+
+class TestBudget:
+    def test_budget_exceeded_is_raised(self, reasoner):
+        reasoner.max_steps = 50
+        reasoner.kb.add_rule("(= (loop $x) (loop (+ $x 1)))")
+        with pytest.raises(metta_engine.MeTTaBudgetExceeded):
+            reasoner.query("(loop 1)")
+
+    def test_batches_report_and_respect_the_budget(self, reasoner, capsys):
+        pytest.importorskip("numpy")
+        reasoner.kb.add_rule("(= (contrarian-signal $ratio) (if (> $ratio 0.7) high-contrarian low-contrarian))")
+        reasoner.kb.add_rule("(= (risk-level $volume $ratio) medium-risk)")
+        reasoner.kb.add_rule("(= (betting-recommendation $ratio $volume) HOLD)")
+        markets = [{"optionARatio": 0.8, "totalVolume": 10}, {"optionARatio": 0.2, "totalVolume": 10}]
+        analyses = reasoner.analyze_markets(markets)
+        assert [analysis["contrarian_signal"] for analysis in analyses] == ["high-contrarian", "low-contrarian"]
+        assert all(analysis["evaluation"]["steps"] == 3 for analysis in analyses)
+
+        # A batch over budget is retried market by market, each under a budget of its own
+        reasoner.max_steps = 2
+        capsys.readouterr()
+        analyses = reasoner.analyze_markets(markets)
+        assert "in batch" in capsys.readouterr().out
+        assert [analysis["evaluation"]["steps"] for analysis in analyses] == [3, 3]
+        assert all(analysis["reasoning"].startswith("Fallback") for analysis in analyses)